@@ -0,0 +1,14 @@
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUBS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stubs')
+
+# The controllers use the mocked pin factory here, and import pins the way vending_machine.py does
+os.environ.setdefault('TESTING_ENVIRONMENT', '1')
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'vending_machine')]
+
+# The API client and the frontend are installed from git; a checkout without them uses the stand-ins
+if any(importlib.util.find_spec(name) is None for name in ('swagger_client', 'frontend')):
+    sys.path.append(STUBS)
@@ -0,0 +1,17 @@
+"""Stand-in for the FerryTix frontend: a controller thread that keeps what it was given to show."""
+from queue import Queue
+from threading import Thread
+
+
+class FrontendController(Thread):
+    def __init__(self, report_to=None):
+        self.results = report_to
+        self.tasks = Queue()
+
+        super(FrontendController, self).__init__(target=self.handler, daemon=True)
+
+    def handler(self):
+        pass
+
+    def start_all(self):
+        pass
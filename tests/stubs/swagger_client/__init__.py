@@ -0,0 +1,9 @@
+"""
+Stand-in for the generated FerryTix API client, for checkouts where it is not
+installed. It keeps the parts the controllers use: Configuration, ApiClient.call_api,
+the REST layer underneath it and the DefaultApi methods, all over real HTTP.
+"""
+from .api_client import ApiClient
+from .configuration import Configuration
+from .default_api import DefaultApi
+from .models import *
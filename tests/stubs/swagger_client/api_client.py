@@ -0,0 +1,47 @@
+import json
+from urllib.parse import quote
+from . import rest
+from .configuration import Configuration
+
+
+class ApiClient:
+    def __init__(self, configuration=None, header_name=None, header_value=None, cookie=None):
+        self.configuration = configuration or Configuration()
+        self.rest_client = rest.RESTClientObject(self.configuration)
+        self.default_headers = {}
+        if header_name is not None:
+            self.default_headers[header_name] = header_value
+
+    def set_default_header(self, header_name, header_value):
+        self.default_headers[header_name] = header_value
+
+    def call_api(
+            self, resource_path, method, path_params=None, query_params=None, header_params=None, body=None,
+            post_params=None, files=None, response_type=None, auth_settings=None, async_req=None,
+            _return_http_data_only=None, collection_formats=None, _preload_content=True, _request_timeout=None
+    ):
+        headers = dict(self.default_headers)
+        headers.update(header_params or {})
+        settings = self.configuration.auth_settings()
+        for auth in auth_settings or ():
+            setting = settings.get(auth)
+            if setting and setting['in'] == 'header':
+                headers[setting['key']] = setting['value']
+
+        for name, value in (path_params or {}).items():
+            resource_path = resource_path.replace('{%s}' % name, quote(str(value), safe=''))
+        url = self.configuration.host + resource_path
+        if hasattr(body, 'to_dict'):
+            body = body.to_dict()
+
+        response = self.rest_client.request(
+            method, url, headers=headers, body=body,
+            _preload_content=_preload_content, _request_timeout=_request_timeout
+        )
+        if not _preload_content:
+            data = response
+        else:
+            data = json.loads(response.data) if response_type and response.data else None
+        if _return_http_data_only:
+            return data
+        return data, response.status, response.headers
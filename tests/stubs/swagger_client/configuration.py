@@ -0,0 +1,15 @@
+class Configuration:
+    def __init__(self):
+        self.host = 'http://localhost'
+        self.api_key = {}
+        self.api_key_prefix = {}
+        self.verify_ssl = True
+        self.ssl_ca_cert = None
+        self.cert_file = None
+        self.key_file = None
+        self.assert_hostname = None
+        self.proxy = None
+        self.connection_pool_maxsize = 4
+
+    def auth_settings(self):
+        return {}
@@ -0,0 +1,36 @@
+from .api_client import ApiClient
+
+
+class DefaultApi:
+    def __init__(self, api_client=None):
+        self.api_client = api_client or ApiClient()
+
+    def _call(self, path, method, response_type=None, body=None, **path_params):
+        return self.api_client.call_api(
+            path, method, path_params=path_params, body=body, response_type=response_type,
+            header_params={'Accept': 'application/json'}, _return_http_data_only=True,
+        )
+
+    def faehr_card_uuid_get(self, uuid):
+        return self._call('/faehrCard/{uuid}', 'GET', 'object', uuid=uuid)
+
+    def faehr_card_uuid_balance_get(self, uuid):
+        return self._call('/faehrCard/{uuid}/balance', 'GET', 'object', uuid=uuid)
+
+    def faehr_card_uuid_topup_post(self, body, uuid):
+        return self._call('/faehrCard/{uuid}/topup', 'POST', body=body, uuid=uuid)
+
+    def ticket_sales_post(self, body):
+        return self._call('/ticketSales', 'POST', body=body)
+
+    def machines_uuid_status_patch(self, body, uuid):
+        return self._call('/machines/{uuid}/status', 'PATCH', body=body, uuid=uuid)
+
+    def machines_uuid_commands_get_with_http_info(self, uuid):
+        return self.api_client.call_api(
+            '/machines/{uuid}/commands', 'GET', path_params={'uuid': uuid}, response_type='object',
+            header_params={'Accept': 'application/json'}, _return_http_data_only=False,
+        )
+
+    def machines_uuid_commands_get(self, uuid):
+        return self.machines_uuid_commands_get_with_http_info(uuid)[0]
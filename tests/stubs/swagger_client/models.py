@@ -0,0 +1,32 @@
+class Model:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    def __eq__(self, other):
+        return type(other) is type(self) and other.__dict__ == self.__dict__
+
+
+class FaehrCard(Model):
+    pass
+
+
+class TicketSale(Model):
+    pass
+
+
+class TopUp(Model):
+    pass
+
+
+class MachineStatus(Model):
+    pass
+
+
+class MachineConfiguration(Model):
+    pass
+
+
+__all__ = ['FaehrCard', 'TicketSale', 'TopUp', 'MachineStatus', 'MachineConfiguration']
@@ -0,0 +1,46 @@
+import json
+import urllib3
+
+
+class ApiException(Exception):
+    def __init__(self, status=None, reason=None, http_resp=None):
+        if http_resp is not None:
+            self.status = http_resp.status
+            self.reason = http_resp.reason
+            self.body = http_resp.data
+            self.headers = http_resp.headers
+        else:
+            self.status = status
+            self.reason = reason
+            self.body = None
+            self.headers = None
+
+    def __str__(self):
+        return f"({self.status})\nReason: {self.reason}\n"
+
+
+class RESTClientObject:
+    def __init__(self, configuration, pools_size=4, maxsize=None):
+        self.pool_manager = urllib3.PoolManager(
+            num_pools=pools_size, maxsize=maxsize or configuration.connection_pool_maxsize
+        )
+
+    def request(self, method, url, headers=None, body=None, _preload_content=True, _request_timeout=None):
+        # As in the generated client: without _request_timeout the call is made with timeout=None
+        timeout = None
+        if _request_timeout:
+            if isinstance(_request_timeout, (int, float)):
+                timeout = urllib3.Timeout(total=_request_timeout)
+            else:
+                timeout = urllib3.Timeout(connect=_request_timeout[0], read=_request_timeout[1])
+
+        headers = dict(headers or {})
+        if body is not None:
+            headers.setdefault('Content-Type', 'application/json')
+            body = json.dumps(body)
+        response = self.pool_manager.request(
+            method, url, body=body, preload_content=_preload_content, timeout=timeout, headers=headers
+        )
+        if not 200 <= response.status <= 299:
+            raise ApiException(http_resp=response)
+        return response
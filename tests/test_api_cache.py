@@ -0,0 +1,53 @@
+from vending_machine.benchmarks.api import controller_for
+from vending_machine.controllers import api_cache
+from vending_machine.controllers.api_cache import ResponseCache
+from vending_machine.controllers.api_controller import GetFaehrcardBalance, PostTopUp
+from vending_machine.simulator.fake_api import FakeApi, FakeRecord
+
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(api_cache, 'monotonic', lambda: now[0])
+    cache = ResponseCache()
+    cache.put('balance', 500, ttl=30)
+
+    now[0] = 129.0
+    assert cache.get('balance') == 500
+    now[0] = 130.0
+    assert cache.get('balance') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_the_least_recently_used_entry_goes_first():
+    cache = ResponseCache(max_entries=2)
+    cache.put('a', 1, ttl=60)
+    cache.put('b', 2, ttl=60)
+    cache.get('a')
+    cache.put('c', 3, ttl=60)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+
+
+def test_lookups_for_the_same_card_share_one_call_and_then_the_cache():
+    api = FakeApi(latency=0.1, balances={'card-1': 700})
+    card = FakeRecord(uuid='card-1')
+    with controller_for(api, 3) as controller:
+        first = controller.request(GetFaehrcardBalance(card, controller.context))
+        second = controller.request(GetFaehrcardBalance(card, controller.context))
+        assert first is second
+        assert first.result(timeout=5).balance == 700
+
+        assert controller.request(GetFaehrcardBalance(card, controller.context)).result(timeout=5).balance == 700
+        assert api.calls['faehr_card_uuid_balance_get'] == 1
+
+
+def test_a_top_up_invalidates_the_cached_balance():
+    api = FakeApi(balances={'card-1': 700})
+    card = FakeRecord(uuid='card-1')
+    with controller_for(api, 3) as controller:
+        controller.request(GetFaehrcardBalance(card, controller.context)).result(timeout=5)
+        controller.request(PostTopUp(card, FakeRecord(amount=500), controller.context)).result(timeout=5)
+
+        assert controller.request(GetFaehrcardBalance(card, controller.context)).result(timeout=5).balance == 1200
+        assert api.calls['faehr_card_uuid_balance_get'] == 2
@@ -0,0 +1,38 @@
+import pytest
+
+from vending_machine.benchmarks.api import controller_for
+from vending_machine.controllers.api_controller import APIRequest, GetFaehrCard, PatchStatus
+from vending_machine.controllers.request_scheduler import RequestPriority
+from vending_machine.simulator.fake_api import FakeApi
+
+
+class UnusableCard(APIRequest):
+    priority = RequestPriority.INTERACTIVE
+
+    def __call__(self, api_instance, **kwargs):
+        return api_instance.faehr_card_uuid_get(uuid='unusable')
+
+    def apply(self, result):
+        raise ValueError("no fare class")
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_a_response_that_cannot_be_applied_fails_only_its_own_request(workers):
+    api = FakeApi()
+    with controller_for(api, workers) as controller:
+        future = controller.request(UnusableCard(controller.context))
+        with pytest.raises(ValueError):
+            future.result(timeout=5)
+
+        # The same workers answer the next request
+        card = controller.request(GetFaehrCard('card-1', controller.context)).result(timeout=5)
+        assert card.uuid == 'card-1'
+        assert all(thread.is_alive() for thread in controller.request_threads)
+
+
+def test_a_single_worker_takes_every_priority():
+    api = FakeApi()
+    with controller_for(api, 1) as controller:
+        assert controller.request_threads[0].lowest == RequestPriority.TELEMETRY
+        controller.request(PatchStatus({'door': 'closed'}, context=controller.context)).result(timeout=5)
+    assert api.status['door'] == 'closed'
@@ -0,0 +1,76 @@
+import pytest
+
+from vending_machine.controllers import card_index as card_index_module
+from vending_machine.controllers.card_index import CardIndex
+
+BLOCKED = ['blocked-%d' % i for i in range(50)]
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = CardIndex(str(tmp_path / 'card_index.bin'), capacity=100)
+    index.fetched = 0
+
+    def fetch():
+        index.fetched += 1
+    index.on_needs_full = fetch
+    return index
+
+
+def test_blocked_cards_are_turned_away_and_survive_a_restart(index):
+    assert index.update({'version': 1, 'blocked': BLOCKED})
+    assert all(index.maybe_blocked(uuid) and index.is_blocked(uuid) for uuid in BLOCKED)
+    assert sum(index.maybe_blocked('good-%d' % i) for i in range(1000)) < 10
+
+    reopened = CardIndex(index.path, capacity=100)
+    assert reopened.version == 1
+    assert all(reopened.maybe_blocked(uuid) for uuid in BLOCKED)
+
+
+def test_a_delta_adds_to_the_list_and_a_gap_asks_for_all_of_it(index):
+    index.update({'version': 1, 'blocked': BLOCKED[:10]})
+    assert index.update({'version': 2, 'base_version': 1, 'blocked': ['late']})
+    assert index.maybe_blocked('late') and index.maybe_blocked(BLOCKED[0])
+
+    assert not index.update({'version': 5, 'base_version': 4, 'blocked': ['later']})
+    assert not index.maybe_blocked('later')
+    assert index.sync_version == 0 and index.fetched == 1
+
+
+def test_a_list_longer_than_the_filter_grows_it(index):
+    index.update({'version': 1, 'blocked': ['card-%d' % i for i in range(300)]})
+    assert index.capacity == 600
+    assert CardIndex(index.path, capacity=100).capacity == 600
+    assert index.fetched == 0
+
+
+@pytest.mark.parametrize('update', [
+    {'version': 2 ** 40, 'blocked': ['new']},
+    {'version': '2', 'blocked': ['new']},
+    {'version': 2, 'blocked': 'new'},
+    {'version': 2, 'blocked': [7]},
+    {'blocked': ['new']},
+    ['new'],
+])
+def test_a_malformed_update_changes_nothing(index, update):
+    index.update({'version': 1, 'blocked': BLOCKED})
+    assert not index.update(update)
+
+    assert index.version == 1 and not index.maybe_blocked('new')
+    assert CardIndex(index.path, capacity=100).version == 1
+    assert index.fetched == 1
+
+
+def test_allowed_cards_are_answered_locally_until_they_expire_or_get_blocked(index, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(card_index_module, 'monotonic', lambda: now[0])
+    index.allow_ttl = 60.0
+    index.allow('card-1', {'uuid': 'card-1'})
+    index.allow('card-2', {'uuid': 'card-2'})
+
+    assert index.allowed_card('card-1') == {'uuid': 'card-1'}
+    index.update({'version': 1, 'blocked': ['card-1']})
+    assert index.allowed_card('card-1') is None
+
+    now[0] = 161.0
+    assert index.allowed_card('card-2') is None
@@ -0,0 +1,148 @@
+from queue import Empty
+
+import pytest
+
+from vending_machine.controllers.cash_controller import (
+    CashController, CashControllerMessage, CashCommand, SettleExpired, Status
+)
+from vending_machine.controllers.changebox import ChangeBox
+from vending_machine.controllers.clock import clock, VirtualClock
+
+
+class Signals:
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, signal, block=True, timeout=None):
+        self.messages.append(signal.message)
+
+
+@pytest.fixture
+def virtual_clock():
+    source = VirtualClock(100.0)
+    clock.install(source)
+    yield source
+    clock.reset()
+
+
+@pytest.fixture
+def controller(virtual_clock):
+    controller = CashController(report_to=Signals(), change_box=ChangeBox())
+    yield controller
+    controller.release()
+
+
+def drain(controller):
+    # What the controller's own thread would do with its queue, without the thread
+    while True:
+        try:
+            task = controller.tasks.get_nowait()
+        except Empty:
+            return
+        event = controller.as_event(task)
+        if event is not None:
+            controller.dispatch(event)
+
+
+def command(controller, text):
+    controller.dispatch(CashCommand.parse(text))
+    drain(controller)
+
+
+def insert(controller, register, pulses, source):
+    edges = register.decoder.edges
+    for _ in range(pulses):
+        edges.rising()
+        source.sleep(0.05)
+        edges.falling()
+        source.sleep(0.05)
+    register.decode()
+    source.sleep(register.decoder.train_gap)
+    register.decode()
+    drain(controller)
+
+
+def settle(controller, source):
+    source.advance_to(controller.settle_deadline())
+    controller.dispatch(SettleExpired())
+    drain(controller)
+
+
+def test_accepting_cash_opens_both_acceptors(controller):
+    command(controller, 'ACCEPT_CASH 250')
+
+    assert controller.cash_state.status == Status.ACCEPTING_CASH
+    assert controller.cash_state.required_amount == 250
+    assert controller.coin_register.is_open and controller.note_register.is_open
+    assert controller.results.messages == [CashControllerMessage.ACCEPTING_CASH]
+
+
+def test_notes_stay_out_when_their_change_could_not_be_paid(virtual_clock):
+    controller = CashController(report_to=Signals(), change_box=ChangeBox({10: 0, 20: 0, 50: 0, 100: 0, 200: 0}))
+    try:
+        command(controller, 'ACCEPT_CASH 250')
+        assert controller.coin_register.is_open
+        assert not controller.note_register.is_open
+    finally:
+        controller.release()
+
+
+def test_payment_is_ready_once_the_acceptors_settle(controller, virtual_clock):
+    command(controller, 'ACCEPT_CASH 50')
+    insert(controller, controller.coin_register, 5, virtual_clock)
+
+    # The last coin is counted, but another one may still be on its way
+    assert controller.cash_state.balance == 50
+    assert controller.cash_state.status == Status.ACCEPTING_CASH
+    assert controller.pending is not None
+
+    settle(controller, virtual_clock)
+    assert controller.cash_state.status == Status.PAYMENT_READY
+    assert not controller.coin_register.is_open and not controller.note_register.is_open
+    assert controller.results.messages[-1] == CashControllerMessage.PAYMENT_READY
+
+
+def test_taking_the_money_pays_out_the_change(controller, virtual_clock):
+    command(controller, 'ACCEPT_CASH 50')
+    insert(controller, controller.coin_register, 6, virtual_clock)
+    settle(controller, virtual_clock)
+    tens = controller.change_box.denominations[10]
+
+    command(controller, 'TAKE_MONEY')
+    assert controller.cash_state.status == Status.DENYING_CASH
+    assert controller.cash_state.balance == 0
+    assert controller.change_box.denominations[10] == tens - 1
+    assert controller.results.messages[-1] == CashControllerMessage.PAYMENT_COLLECTED
+
+
+def test_denying_cash_at_payment_ready_drops_the_payment(controller, virtual_clock):
+    command(controller, 'ACCEPT_CASH 50')
+    insert(controller, controller.coin_register, 5, virtual_clock)
+    settle(controller, virtual_clock)
+
+    command(controller, 'DENY_CASH')
+    assert controller.cash_state.status == Status.DENYING_CASH
+    assert controller.cash_state.balance == 0
+    assert controller.results.messages[-1] == CashControllerMessage.PAYMENT_DROPPED
+
+
+def test_a_cancel_waits_for_the_coin_still_on_its_way(controller, virtual_clock):
+    command(controller, 'ACCEPT_CASH 250')
+    insert(controller, controller.coin_register, 3, virtual_clock)
+
+    command(controller, 'DENY_CASH')
+    assert controller.cash_state.status == Status.ACCEPTING_CASH
+    assert controller.pending is not None
+
+    settle(controller, virtual_clock)
+    assert controller.cash_state.status == Status.DENYING_CASH
+    assert controller.cash_state.balance == 0
+    assert controller.pending is None
+
+
+def test_commands_that_do_not_fit_the_state_are_ignored(controller):
+    command(controller, 'TAKE_MONEY')
+    command(controller, 'DENY_CASH')
+
+    assert controller.cash_state.status == Status.DENYING_CASH
+    assert controller.results.messages == []
@@ -0,0 +1,111 @@
+import pytest
+
+from vending_machine.controllers.cash_controller import CashController, SettleExpired
+from vending_machine.controllers.cash_journal import CashJournal, JournalKind, JournalSource
+from vending_machine.controllers.changebox import ChangeBox
+from vending_machine.controllers.clock import clock, VirtualClock
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'cash_journal.bin')
+
+
+def test_a_session_cut_short_is_recovered_with_its_balance(path):
+    journal = CashJournal(path, capacity=64)
+    journal.session = 1
+    journal.append(JournalKind.OPENED, required=250)
+    journal.append(JournalKind.PULSE, amount=100, balance=100, required=250, source=JournalSource.COIN)
+    journal.append(JournalKind.PULSE, amount=50, balance=150, required=250, source=JournalSource.COIN)
+    journal.commit()
+    # Power is cut: the journal is never closed
+    reopened = CashJournal(path, capacity=64)
+
+    assert reopened.recovered.session == 1
+    assert reopened.recovered.balance == 150
+    assert reopened.recovered.kind == JournalKind.PULSE
+    assert reopened.seq == 4
+    assert reopened.session == 1
+
+
+def test_a_finished_session_is_not_recovered(path):
+    journal = CashJournal(path, capacity=64)
+    journal.session = 1
+    journal.append(JournalKind.OPENED, required=100)
+    journal.append(JournalKind.PULSE, amount=100, balance=100, required=100, source=JournalSource.COIN)
+    journal.append(JournalKind.COLLECTED, amount=100, balance=0)
+    journal.close()
+
+    assert CashJournal(path, capacity=64).recovered is None
+
+
+def test_a_torn_record_is_skipped(path):
+    journal = CashJournal(path, capacity=64)
+    journal.session = 1
+    journal.append(JournalKind.PULSE, amount=100, balance=100, source=JournalSource.COIN)
+    seq = journal.append(JournalKind.COLLECTED, amount=100, balance=0)
+    # The power cut hit while the last record was written
+    journal.map[journal._offset(seq) + 12] ^= 0xFF
+    journal.commit()
+
+    reopened = CashJournal(path, capacity=64)
+    assert [record.kind for record in reopened.records()] == [JournalKind.PULSE]
+    assert reopened.recovered.balance == 100
+
+
+def test_the_ring_keeps_the_newest_records(path):
+    journal = CashJournal(path, capacity=8)
+    for balance in range(1, 21):
+        journal.append(JournalKind.PULSE, amount=1, balance=balance)
+    journal.close()
+
+    records = CashJournal(path, capacity=8).records()
+    assert [record.balance for record in records] == list(range(13, 21))
+
+
+def test_a_damaged_file_is_moved_aside(path):
+    with open(path, 'wb') as journal_file:
+        journal_file.write(b'not a journal')
+
+    journal = CashJournal(path, capacity=8)
+    assert journal.records() == []
+    with open(path + '.damaged', 'rb') as damaged:
+        assert damaged.read() == b'not a journal'
+
+
+class Signals:
+    def publish(self, signal, block=True, timeout=None):
+        pass
+
+
+class ShortPayout:
+    # Hoppers that run dry with 50 still to pay
+    def dispense(self, change_box, amount):
+        return 50
+
+
+@pytest.mark.parametrize('payout, refunded, restored', [(None, 150, 0), (ShortPayout(), 100, 50)])
+def test_a_recovered_session_books_only_what_was_paid_back(path, payout, refunded, restored):
+    journal = CashJournal(path, capacity=64)
+    journal.session = 1
+    journal.append(JournalKind.OPENED, required=250)
+    journal.append(JournalKind.PULSE, amount=150, balance=150, required=250, source=JournalSource.COIN)
+    journal.commit()
+
+    clock.install(VirtualClock(100.0))
+    controller = CashController(
+        report_to=Signals(), journal=CashJournal(path, capacity=64), change_box=ChangeBox(payout=payout)
+    )
+    try:
+        assert controller.cash_state.balance == 150
+        controller.dispatch(SettleExpired())
+        assert controller.pending is None
+        assert controller.cash_state.balance == restored
+    finally:
+        controller.release()
+        clock.reset()
+
+    booked = {record.kind: record.amount for record in CashJournal(path, capacity=64).records()[2:]}
+    assert booked.pop(JournalKind.RECOVERED) == 150
+    assert booked.get(JournalKind.REFUNDED, 0) == refunded
+    assert booked.get(JournalKind.RESTORED, 0) == restored
@@ -0,0 +1,83 @@
+from itertools import product
+from random import Random
+
+import pytest
+
+from vending_machine.controllers.changebox import ChangeBox
+
+
+def fewest_coins(stock, amount):
+    # Every combination the stock allows, small enough to try them all
+    denominations = sorted(stock)
+    best = None
+    for counts in product(*(range(stock[denomination] + 1) for denomination in denominations)):
+        if sum(count * denomination for count, denomination in zip(counts, denominations)) == amount:
+            coins = sum(counts)
+            best = coins if best is None else min(best, coins)
+    return best
+
+
+@pytest.mark.parametrize('stock', [
+    {10: 3, 20: 2, 50: 1, 100: 2, 200: 1},
+    {20: 4, 50: 3, 200: 2},
+    {10: 0, 20: 5, 50: 1, 100: 0, 200: 3},
+    {50: 7},
+])
+def test_plan_pays_the_fewest_coins_the_stock_allows(stock):
+    box = ChangeBox(dict(stock), max_change=800)
+    for amount in range(0, 810, 10):
+        best = fewest_coins(stock, amount)
+        payout = box.plan(amount)
+        if best is None:
+            assert payout is None, amount
+            assert not box.can_make_change(amount)
+            continue
+        assert payout is not None, amount
+        assert sum(count * denomination for denomination, count in payout.items()) == amount
+        assert sum(payout.values()) == best
+        assert all(count <= stock[denomination] for denomination, count in payout.items())
+
+
+def test_tables_follow_the_stock():
+    box = ChangeBox({20: 1, 50: 1}, max_change=500)
+    assert box.plan(60) is None
+
+    box.take_in(20, 2)
+    assert box.plan(60) == {20: 3}
+
+    box.pay_out({20: 3})
+    assert box.plan(60) is None
+
+
+def test_give_change_returns_what_could_not_be_paid():
+    box = ChangeBox({50: 1}, max_change=500)
+    assert box.give_change(30) == 30
+    assert box.give_change(50) == 0
+    assert box.denominations[50] == 0
+
+
+def test_tables_updated_in_place_match_a_fresh_build():
+    random = Random(3)
+    box = ChangeBox(max_change=2000)
+    for _ in range(200):
+        denomination = random.choice(list(box.denominations))
+        if random.random() < 0.5:
+            box.take_in(denomination, random.randint(1, 3))
+        else:
+            box.dispensed(denomination, random.randint(1, 20))
+        fresh = ChangeBox(dict(box.denominations), max_change=2000)
+        assert box._tables[-1] == fresh._tables[-1]
+    for amount in range(0, 2010, 10):
+        payout = box.plan(amount)
+        assert (payout is None) == (fresh.plan(amount) is None)
+        if payout is not None:
+            assert sum(payout.values()) == sum(fresh.plan(amount).values())
+            assert all(count <= box.denominations[denomination] for denomination, count in payout.items())
+
+
+def test_a_change_in_small_coins_leaves_the_larger_groups_alone():
+    box = ChangeBox()
+    larger = box._groups[:-1]
+    box.pay_out({10: 45})
+    assert all(before is after for before, after in zip(larger, box._groups[:-1]))
+    assert box.plan(30) == {20: 1, 10: 1}
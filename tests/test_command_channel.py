@@ -0,0 +1,126 @@
+from threading import Thread
+from time import sleep
+
+import pytest
+import swagger_client
+
+from vending_machine.controllers.api_controller import CommandReceiver
+from vending_machine.controllers.card_index import CardIndex
+from vending_machine.controllers.command_channel import CommandCursor
+from vending_machine.controllers.fare_catalog import FareCatalog
+from vending_machine.controllers.request_scheduler import Backoff
+from vending_machine.simulator.command_server import CommandHandler, CommandServer
+
+
+class Identity:
+    uuid = 'machine-1'
+
+
+class Context:
+    def __init__(self, host, directory):
+        configuration = swagger_client.Configuration()
+        configuration.host = host
+        self.long_poll_api = swagger_client.DefaultApi(swagger_client.ApiClient(configuration))
+        self.identity = Identity()
+        self.fare_catalog = FareCatalog(str(directory / 'fare_catalog.bin'))
+        self.card_index = CardIndex(str(directory / 'card_index.bin'))
+
+
+class Controller:
+    """What CommandReceiver uses of an APIController."""
+
+    def __init__(self, context):
+        self.context = context
+        self.backoff = Backoff()
+        self.results = self
+        self.commands = []
+        self.reloads = 0
+
+    def publish(self, signal, block=True, timeout=None):
+        self.commands.append(signal.command)
+
+    def refresh_config(self):
+        self.reloads += 1
+
+
+class NoStreamHandler(CommandHandler):
+    def stream(self):
+        self.send_error(404)
+
+
+@pytest.fixture
+def server():
+    server = CommandServer(hold=0.2).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def receiver_for(tmp_path, monkeypatch):
+    monkeypatch.setattr(CommandCursor, 'CURSOR_FILE', str(tmp_path / 'command.cursor'))
+
+    def receiver_for(server, **kwargs):
+        return CommandReceiver(Controller(Context(server.url, tmp_path)), **kwargs)
+    return receiver_for
+
+
+def test_long_poll_delivers_in_order_and_acknowledges_with_the_etag(server, receiver_for):
+    receiver = receiver_for(server)
+    server.push('DENY_CASH')
+    server.push('RELOAD_CONFIG')
+    server.push('ACCEPT_CASH 250')
+
+    assert receiver.poll() == 3
+    assert receiver.controller.commands == ['DENY_CASH', 'ACCEPT_CASH 250']
+    assert receiver.controller.reloads == 1
+    assert receiver.cursor.value == '3'
+
+    # Nothing past the cursor, so the backend answers 304 after its hold
+    assert receiver.poll() == 0
+    assert receiver.cursor.value == '3'
+
+
+def test_a_restarted_receiver_resumes_from_the_stored_cursor(server, receiver_for):
+    server.push('DENY_CASH')
+    receiver_for(server).poll()
+
+    server.push('ACCEPT_CASH 250')
+    restarted = receiver_for(server)
+    assert restarted.cursor.value == '1'
+    assert restarted.poll() == 1
+    assert restarted.controller.commands == ['ACCEPT_CASH 250']
+
+
+def test_the_stream_resumes_from_last_event_id(server, receiver_for):
+    receiver = receiver_for(server, stream=True)
+    receiver.cursor.advance('1')
+    server.push('DENY_CASH')
+    server.push('ACCEPT_CASH 250')
+
+    commands = receiver.receive()
+    try:
+        command = next(commands)
+    finally:
+        commands.close()
+    assert (command.id, command.text, command.cursor) == ('2', 'ACCEPT_CASH 250', '2')
+
+
+def test_without_a_stream_the_receiver_stays_on_long_polling(server, receiver_for):
+    server.RequestHandlerClass = NoStreamHandler
+    receiver = receiver_for(server, stream=True)
+    server.push('DENY_CASH')
+
+    assert receiver.poll() == 1
+    assert receiver.stream is None
+    assert receiver.controller.commands == ['DENY_CASH']
+
+
+def test_empty_answers_that_come_back_at_once_are_not_hot_looped(receiver_for):
+    server = CommandServer(hold=0.0).start()
+    try:
+        receiver = receiver_for(server, empty_poll_interval=0.2)
+        Thread(target=receiver.handler, daemon=True).start()
+        sleep(1.0)
+        assert 3 <= server.requests <= 7
+    finally:
+        server.stop()
@@ -0,0 +1,77 @@
+import pytest
+import yaml
+from loguru import logger
+
+from vending_machine.controllers.config_store import ConfigStore
+
+MINIMAL = {'api_key': 'key', 'uuid': 'machine-1', 'operator_note': 'kept as it is'}
+
+
+def write_config(path, values):
+    with open(path, 'w') as config_file:
+        config_file.write(yaml.safe_dump(values))
+    return str(path)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ConfigStore(write_config(tmp_path / 'machine.config.yaml', MINIMAL))
+
+
+@pytest.fixture
+def warnings():
+    messages = []
+    sink = logger.add(messages.append, level='WARNING', format='{message}')
+    yield messages
+    logger.remove(sink)
+
+
+def test_missing_keys_take_their_defaults(store):
+    assert store.snapshot.api_workers == 3
+    assert store.snapshot.runtime == 'threads'
+    assert store.snapshot.status_interval == 60.0
+
+
+@pytest.mark.parametrize('values', [
+    {'uuid': 'machine-1'},
+    dict(MINIMAL, runtime='greenlets'),
+    dict(MINIMAL, api_workers='5'),
+    dict(MINIMAL, api_workers=0),
+])
+def test_an_invalid_file_is_refused(tmp_path, values):
+    with pytest.raises(ValueError):
+        ConfigStore(write_config(tmp_path / 'machine.config.yaml', values))
+
+
+def test_a_bad_remote_value_costs_only_its_own_key(store, warnings):
+    store.apply_remote({'api_workers': '5', 'host': 'https://backend', 'uuid': 'someone-else', 'status_interval': 30})
+
+    assert store.snapshot.host == 'https://backend'
+    assert store.snapshot.status_interval == 30.0
+    assert store.snapshot.api_workers == 3
+    assert store.snapshot.uuid == 'machine-1'
+    assert any('api_workers' in message for message in warnings)
+
+    on_disk = yaml.safe_load(open(store.path))
+    assert on_disk['host'] == 'https://backend' and on_disk['operator_note'] == 'kept as it is'
+    assert 'api_workers' not in on_disk
+
+
+def test_a_change_that_needs_a_restart_is_stored_and_logged(store, warnings):
+    seen = []
+    store.subscribe(seen.append)
+    store.apply_remote({'command_stream': True, 'log_level': 'DEBUG'})
+
+    assert seen[-1].command_stream and seen[-1].log_level == 'DEBUG'
+    restart = [message for message in warnings if 'restart' in message]
+    assert len(restart) == 1 and 'command_stream' in restart[0]
+
+
+def test_an_invalid_edit_on_disk_keeps_the_current_configuration(store):
+    write_config(store.path, dict(MINIMAL, api_workers='many'))
+    store.reload()
+    assert store.snapshot.api_workers == 3
+
+    write_config(store.path, dict(MINIMAL, api_workers=5))
+    store.reload()
+    assert store.snapshot.api_workers == 5
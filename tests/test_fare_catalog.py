@@ -0,0 +1,74 @@
+import pytest
+
+from vending_machine.controllers.fare_catalog import Fare, FareCatalog
+
+FULL = {'version': 3, 'upsert': [
+    {'product_id': 1, 'name': 'Adult', 'price': 250},
+    {'product_id': 1, 'fare_class': 1, 'name': 'Child', 'price': 120},
+    {'product_id': 2, 'name': 'Bicycle', 'price': 150},
+]}
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = FareCatalog(str(tmp_path / 'fare_catalog.bin'))
+    catalog.fetched = 0
+
+    def fetch():
+        catalog.fetched += 1
+    catalog.on_needs_full = fetch
+    return catalog
+
+
+def test_a_full_catalog_is_quoted_and_survives_a_restart(catalog):
+    assert catalog.update(FULL)
+    assert catalog.quote(1) == 250 and catalog.quote(1, 1) == 120
+
+    reopened = FareCatalog(catalog.path)
+    assert reopened.version == 3
+    assert reopened.menu == catalog.menu
+    assert Fare(2, 0, 'Bicycle', 150) in reopened.menu
+
+
+def test_a_delta_changes_only_what_it_names(catalog):
+    catalog.update(FULL)
+    assert catalog.update({'version': 4, 'base_version': 3, 'remove': [[2, 0]],
+                           'upsert': [{'product_id': 1, 'name': 'Adult', 'price': 270}]})
+
+    assert catalog.version == 4
+    assert catalog.quote(1) == 270 and catalog.quote(1, 1) == 120
+    assert catalog.quote(2) is None
+
+
+def test_a_delta_from_another_version_asks_for_the_full_catalog(catalog):
+    catalog.update(FULL)
+    assert not catalog.update({'version': 6, 'base_version': 5, 'upsert': []})
+
+    assert catalog.version == 3
+    assert catalog.sync_version == 0 and catalog.fetched == 1
+
+
+@pytest.mark.parametrize('fare', [
+    {'product_id': 1, 'name': None, 'price': 250},
+    {'product_id': 1, 'fare_class': 70000, 'name': 'Adult', 'price': 250},
+    {'product_id': 1, 'name': 'Adult', 'price': -1},
+    {'product_id': '1', 'name': 'Adult', 'price': 250},
+    {'product_id': 1, 'name': 'Adult'},
+    ['Adult', 250],
+])
+def test_a_malformed_fare_rejects_the_whole_delta(catalog, fare):
+    catalog.update(FULL)
+    assert not catalog.update({'version': 4, 'base_version': 3, 'remove': [[2, 0]], 'upsert': [fare]})
+
+    assert catalog.version == 3 and catalog.quote(2) == 150
+    assert FareCatalog(catalog.path).version == 3
+    assert catalog.fetched == 1
+
+
+def test_commands_carry_deltas_as_json(catalog):
+    assert catalog.handle_command('CATALOG_DELTA ' + '{"version": 1, "upsert": [{"product_id": 7, "name": "Car", "price": 900}]}')
+    assert catalog.quote(7) == 900
+
+    assert catalog.handle_command(b'CATALOG_DELTA {not json')
+    assert catalog.fetched == 1
+    assert not catalog.handle_command('DENY_CASH')
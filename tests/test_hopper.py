@@ -0,0 +1,58 @@
+import pytest
+
+from vending_machine.controllers.changebox import ChangeBox
+from vending_machine.controllers.hopper import HopperState, PayoutScheduler, default_hoppers
+from vending_machine.simulator.hoppers import HopperSimulator
+
+
+@pytest.fixture
+def hoppers():
+    hoppers = default_hoppers(jam_timeout=0.2)
+    for hopper in hoppers:
+        hopper.run_on = 0.02
+    simulators = {hopper.denomination: HopperSimulator(hopper, coins_per_second=200.0) for hopper in hoppers}
+    for simulator in simulators.values():
+        simulator.start()
+    yield simulators
+    for simulator in simulators.values():
+        simulator.stop()
+    for hopper in hoppers:
+        hopper.motor.close()
+        hopper.sensor.close()
+
+
+def test_a_hopper_stops_once_the_sensor_counted_every_coin(hoppers):
+    simulator = hoppers[20]
+    assert simulator.hopper.dispense(4) == 4
+    assert simulator.hopper.state == HopperState.READY
+    assert not simulator.hopper.motor.value
+    assert simulator.ejected == 4
+
+
+def test_an_empty_hopper_reports_what_it_paid_and_stalls(hoppers):
+    simulator = hoppers[50]
+    simulator.stock = 2
+    assert simulator.hopper.dispense(5) == 2
+    assert simulator.hopper.state == HopperState.STALLED
+    assert not simulator.hopper.motor.value
+
+
+def test_a_stalled_hopper_is_replaced_by_smaller_coins(hoppers):
+    hoppers[50].stock = 0
+    box = ChangeBox({10: 5, 20: 5, 50: 5, 100: 5, 200: 5},
+                    payout=PayoutScheduler([simulator.hopper for simulator in hoppers.values()]))
+
+    assert box.give_change(70) == 0
+    assert sum(denomination * simulator.ejected for denomination, simulator in hoppers.items()) == 70
+    assert hoppers[50].ejected == 0
+    # The empty hopper is left out of the plans until it is refilled
+    assert 50 in box.stalled_hoppers and box.denominations[50] == 0
+    assert box.denominations[20] + box.denominations[10] < 10
+
+
+def test_coins_that_drop_outside_a_payout_are_taken_from_the_stock(hoppers):
+    box = ChangeBox({10: 5, 20: 5}, payout=PayoutScheduler([hoppers[10].hopper, hoppers[20].hopper]))
+    hoppers[10].hopper.coin_passed()
+
+    assert box.give_change(20) == 0
+    assert box.denominations == {10: 4, 20: 4}
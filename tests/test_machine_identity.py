@@ -0,0 +1,68 @@
+from base64 import b64decode
+from threading import Event, Thread
+
+import pytest
+import yaml
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives import hashes, serialization
+
+from vending_machine.controllers.client_context import MachineIdentity
+from vending_machine.controllers.config_store import ConfigStore
+from vending_machine.controllers.merkle import canonical_json
+from vending_machine.controllers.signature_schemes import KeyType
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(MachineIdentity, 'IDENTITY_FILE', str(tmp_path / 'identity.pem'))
+    path = tmp_path / 'machine.config.yaml'
+    with open(path, 'w') as config_file:
+        config_file.write(yaml.safe_dump({'api_key': 'key', 'uuid': 'machine-1', 'key_type': 'ed25519'}))
+    return ConfigStore(str(path))
+
+
+def test_the_key_on_disk_is_used_on_the_next_start(store):
+    identity = MachineIdentity(store)
+    store.update({'key_type': 'ecdsa-p256'})
+
+    restarted = MachineIdentity(store)
+    assert restarted.scheme.key_type == KeyType.ED25519
+    assert restarted.get_public_key() == identity.get_public_key()
+
+
+def test_rotating_switches_the_scheme_and_keeps_the_old_key(store):
+    identity = MachineIdentity(store)
+    old_public_key = identity.get_public_key()
+
+    public_key = identity.rotate_key(KeyType.ECDSA_P256)
+    assert public_key != old_public_key
+    assert identity.key_type == KeyType.ECDSA_P256 and store.snapshot.key_type == 'ecdsa-p256'
+
+    with open(MachineIdentity.IDENTITY_FILE + '.previous', 'rb') as key_file:
+        previous = serialization.load_pem_private_key(key_file.read(), password=None)
+    assert identity.scheme.public_bytes(previous) != public_key.encode()
+    assert MachineIdentity(store).get_public_key() == public_key
+
+    record = {'amount': 250}
+    signature = b64decode(identity.sign(record))
+    loaded = serialization.load_pem_public_key(public_key.encode())
+    loaded.verify(signature, canonical_json(record), ec.ECDSA(hashes.SHA256()))
+
+
+def test_signing_never_sees_a_half_rotated_key(store):
+    identity = MachineIdentity(store)
+    done = Event()
+
+    def rotate():
+        for key_type in [KeyType.ECDSA_P256, KeyType.ED25519] * 10:
+            identity.rotate_key(key_type)
+        done.set()
+
+    rotator = Thread(target=rotate)
+    rotator.start()
+    try:
+        while not done.is_set():
+            identity.sign({'amount': 250})
+            identity.get_public_key()
+    finally:
+        rotator.join()
@@ -0,0 +1,37 @@
+import pytest
+
+from vending_machine.controllers.merkle import MerkleTree, canonical_json, verify_proof
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 8, 13])
+def test_every_leaf_proves_its_place_under_the_root(size):
+    leaves = [canonical_json({'sale': i, 'price': 100 + i}) for i in range(size)]
+    tree = MerkleTree(leaves)
+    for index, leaf in enumerate(leaves):
+        assert verify_proof(leaf, tree.proof(index), tree.root)
+
+
+def test_a_proof_fails_for_other_data_or_another_root():
+    leaves = [canonical_json({'sale': i}) for i in range(5)]
+    tree = MerkleTree(leaves)
+    other = MerkleTree(leaves[:4])
+
+    assert not verify_proof(canonical_json({'sale': 9}), tree.proof(2), tree.root)
+    assert not verify_proof(leaves[2], tree.proof(3), tree.root)
+    assert not verify_proof(leaves[4], tree.proof(4), other.root)
+
+
+def test_a_single_leaf_is_not_an_inner_node():
+    # Without domain separation two leaves could be passed off as their parent
+    leaves = [b'a', b'b']
+    tree = MerkleTree(leaves)
+    assert MerkleTree([tree.levels[0][0] + tree.levels[0][1]]).root != tree.root
+
+
+def test_canonical_json_ignores_key_order():
+    assert canonical_json({'b': 1, 'a': 'ä'}) == canonical_json({'a': 'ä', 'b': 1})
+
+
+def test_an_empty_tree_is_refused():
+    with pytest.raises(ValueError):
+        MerkleTree([])
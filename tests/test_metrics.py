@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from vending_machine.controllers.async_runtime import LoopQueue
+from vending_machine.controllers.clock import clock, VirtualClock
+from vending_machine.controllers.metrics import Histogram, TimedQueue
+
+
+@pytest.fixture
+def virtual_clock():
+    source = VirtualClock(100.0)
+    clock.install(source)
+    yield source
+    clock.reset()
+
+
+def test_percentiles_stay_within_two_significant_digits():
+    histogram = Histogram()
+    for millisecond in range(1, 1001):
+        histogram.record(millisecond / 1000)
+
+    assert histogram.count == 1000
+    assert histogram.percentile(50) == pytest.approx(0.5, rel=0.01)
+    assert histogram.percentile(99) == pytest.approx(0.99, rel=0.01)
+    assert histogram.to_dict()['max'] == 1.0
+
+
+def test_a_timed_queue_records_how_long_each_item_waited(virtual_clock):
+    tasks = TimedQueue('test.timed_queue')
+    tasks.put('ACCEPT_CASH 250')
+    virtual_clock.sleep(0.2)
+    tasks.put('DENY_CASH')
+    virtual_clock.sleep(0.1)
+
+    assert tasks.get() == 'ACCEPT_CASH 250'
+    assert tasks.get_nowait() == 'DENY_CASH'
+    assert tasks.wait.count == 2
+    assert tasks.wait.max == pytest.approx(0.3)
+    assert tasks.wait.total == pytest.approx(0.4)
+
+
+def test_the_loop_queue_keeps_recording_into_the_replaced_queue(virtual_clock):
+    replaced = TimedQueue('test.loop_queue')
+
+    async def run():
+        tasks = LoopQueue(asyncio.get_running_loop(), wait=replaced.wait)
+        tasks.put('TAKE_MONEY')
+        virtual_clock.sleep(0.05)
+        return await tasks.get()
+
+    assert asyncio.run(run()) == 'TAKE_MONEY'
+    assert replaced.wait.count == 1
+    assert replaced.wait.max == pytest.approx(0.05)
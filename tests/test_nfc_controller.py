@@ -0,0 +1,89 @@
+import pytest
+
+from vending_machine.controllers.clock import clock, VirtualClock
+from vending_machine.controllers.nfc_controller import NFCController, NFCTag
+
+CARD = '0b7a3f6e-51f4-4d0f-9a43-2f0e8c1d5b61'
+
+
+class Signals:
+    def __init__(self):
+        self.tags = []
+
+    def publish(self, signal, block=True, timeout=None):
+        self.tags.append(signal.tag.id)
+
+
+@pytest.fixture
+def virtual_clock():
+    source = VirtualClock(100.0)
+    clock.install(source)
+    yield source
+    clock.reset()
+
+
+@pytest.fixture
+def controller(virtual_clock):
+    return NFCController(report_to=Signals(), debounce=2.0, recent_tags=2)
+
+
+def tap(controller, uid):
+    controller.tag_read(NFCTag(uid, CARD))
+    while not controller.tasks.empty():
+        controller.handle(controller.tasks.get_nowait())
+
+
+def test_tags_are_only_taken_while_reading(controller):
+    tap(controller, 1)
+    assert controller.results.tags == []
+
+    controller.handle(NFCController.Tasks.READ_TAG)
+    tap(controller, 1)
+    assert controller.results.tags == [1]
+    assert controller.view.state.nfc == 'DETECTED' and controller.view.state.tag == '1'
+
+    controller.handle(NFCController.Tasks.STOP_READING)
+    tap(controller, 2)
+    assert controller.results.tags == [1]
+    assert controller.view.state.nfc == 'IDLE' and controller.last_read_tag is None
+
+
+def test_a_card_left_on_the_reader_is_one_tap(controller, virtual_clock):
+    controller.handle(NFCController.Tasks.READ_TAG)
+    for _ in range(10):
+        tap(controller, 1)
+        virtual_clock.sleep(0.5)
+    assert controller.results.tags == [1]
+
+    # Taken off and put back after the debounce is a new tap
+    virtual_clock.sleep(2.0)
+    tap(controller, 1)
+    assert controller.results.tags == [1, 1]
+
+
+def test_other_cards_do_not_wait_for_the_debounce(controller, virtual_clock):
+    controller.handle(NFCController.Tasks.READ_TAG)
+    tap(controller, 1)
+    tap(controller, 2)
+    tap(controller, 3)
+    # Only the last recent_tags cards are remembered
+    tap(controller, 1)
+    assert controller.results.tags == [1, 2, 3, 1]
+
+
+def test_a_new_read_forgets_the_tags_of_the_last_one(controller):
+    controller.handle(NFCController.Tasks.READ_TAG)
+    tap(controller, 1)
+    controller.handle(NFCController.Tasks.READ_TAG)
+    tap(controller, 1)
+    assert controller.results.tags == [1, 1]
+
+
+@pytest.mark.parametrize('data, valid', [
+    (CARD + '  ', True),
+    ('0b7a3f6e-51f4-1d0f-9a43-2f0e8c1d5b61', False),
+    ('not a card', False),
+    (None, False),
+])
+def test_only_version_4_uuids_are_valid_cards(data, valid):
+    assert NFCTag(1, data).is_valid() == valid
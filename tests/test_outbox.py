@@ -0,0 +1,112 @@
+import os
+
+import pytest
+from swagger_client.rest import ApiException
+
+from vending_machine.benchmarks.api import BenchContext
+from vending_machine.controllers.api_controller import APIController, DURABLE_REQUESTS, PatchStatus, PostTicketSale
+from vending_machine.controllers.outbox import Outbox
+from vending_machine.controllers.signal_bus import SignalBus
+from vending_machine.simulator.fake_api import FakeApi, FakeRecord
+
+
+class AnsweringApi(FakeApi):
+    def __init__(self, status):
+        super(AnsweringApi, self).__init__()
+        self.answer = status
+
+    def ticket_sales_post(self, body):
+        self._call('ticket_sales_post')
+        raise ApiException(status=self.answer, reason="Refused")
+
+
+@pytest.fixture
+def controller_for(tmp_path, monkeypatch):
+    # The outbox lives next to the working directory; only the request workers run, the test flushes
+    os.mkdir(tmp_path / 'run')
+    monkeypatch.chdir(tmp_path / 'run')
+
+    def controller_for(api):
+        controller = APIController(SignalBus(), BenchContext(api, str(tmp_path)), workers=2)
+        for request_thread in controller.request_threads:
+            request_thread.daemon = True
+            request_thread.start()
+        return controller
+    return controller_for
+
+
+def sale(controller, price):
+    return controller.request(PostTicketSale(FakeRecord(product_id=1, price=price), controller.context))
+
+
+def test_records_are_committed_before_they_are_sent_and_survive_a_restart(controller_for):
+    controller = controller_for(FakeApi())
+    futures = [sale(controller, price) for price in (250, 120, 900)]
+
+    reopened = Outbox(requests=DURABLE_REQUESTS)
+    pending = reopened.pending(controller.context, limit=10)
+    assert [request.data['price'] for request in pending] == [250, 120, 900]
+    assert [request.idempotency_key for request in pending] == list(controller.outbox_futures)
+    assert not any(future.done() for future in futures)
+
+
+def test_a_flush_delivers_every_record_once_and_settles_its_future(controller_for):
+    api = FakeApi()
+    controller = controller_for(api)
+    futures = [sale(controller, price) for price in (250, 120)]
+
+    assert controller.outbox_flusher.flush()
+    assert [record['price'] for record in api.sales] == [250, 120]
+    assert all(future.done() and future.exception() is None for future in futures)
+    assert len(controller.outbox) == 0 and not controller.outbox_futures
+
+    assert controller.outbox_flusher.flush()
+    assert len(api.sales) == 2
+
+
+def test_records_wait_in_the_outbox_while_the_backend_is_down(controller_for):
+    api = FakeApi(failure_rate=1.0)
+    controller = controller_for(api)
+    future = sale(controller, 250)
+
+    assert not controller.outbox_flusher.flush()
+    assert not future.done() and len(controller.outbox) == 1
+
+    api.failure_rate = 0.0
+    assert controller.outbox_flusher.flush()
+    assert future.exception(timeout=1) is None
+    assert len(api.sales) == 1
+    assert len(controller.outbox) == 0
+
+
+@pytest.mark.parametrize('status, delivered', [(409, True), (422, False)])
+def test_a_record_the_backend_answered_is_never_sent_again(controller_for, status, delivered):
+    api = AnsweringApi(status)
+    controller = controller_for(api)
+    future = sale(controller, 250)
+
+    assert controller.outbox_flusher.flush()
+    assert len(controller.outbox) == 0
+    if delivered:
+        assert future.result(timeout=1) is None
+    else:
+        assert future.exception(timeout=1).status == 422
+
+    controller.outbox_flusher.flush()
+    assert api.calls['ticket_sales_post'] == 1
+
+
+def test_unsent_status_patches_go_out_as_one(controller_for):
+    api = FakeApi()
+    controller = controller_for(api)
+    futures = [
+        controller.request(PatchStatus(fields, context=controller.context))
+        for fields in ({'door': 'open', 'temperature': 5}, {'door': 'closed'}, {'coins': 3})
+    ]
+
+    assert controller.outbox_flusher.flush()
+    assert api.calls['machines_uuid_status_patch'] == 1
+    assert {field: api.status[field] for field in ('door', 'temperature', 'coins')} == {
+        'door': 'closed', 'temperature': 5, 'coins': 3
+    }
+    assert all(future.done() and future.exception() is None for future in futures)
@@ -0,0 +1,68 @@
+import pytest
+
+from vending_machine.controllers.clock import clock, VirtualClock
+from vending_machine.controllers.pulse_decoder import PulseDecoder
+
+
+@pytest.fixture
+def virtual_clock():
+    source = VirtualClock(100.0)
+    clock.install(source)
+    yield source
+    clock.reset()
+
+
+def pulse(decoder, source, width, gap=0.05):
+    decoder.edges.rising()
+    source.sleep(width)
+    decoder.edges.falling()
+    source.sleep(gap)
+
+
+def test_counts_pulses_and_closes_the_train_after_the_gap(virtual_clock):
+    trains = []
+    decoder = PulseDecoder(0.02, 0.08, train_gap=0.3, on_train=trains.append)
+    for _ in range(5):
+        pulse(decoder, virtual_clock, 0.05)
+
+    assert decoder.decode() == 5
+    assert not trains and not decoder.idle
+
+    virtual_clock.sleep(0.3)
+    assert decoder.decode() == 0
+    assert [train.pulses for train in trains] == [5]
+    assert decoder.idle
+
+
+def test_pulses_of_the_wrong_width_are_glitches(virtual_clock):
+    decoder = PulseDecoder(0.02, 0.08, train_gap=0.3)
+    pulse(decoder, virtual_clock, 0.005)
+    pulse(decoder, virtual_clock, 0.05)
+    pulse(decoder, virtual_clock, 0.2)
+    # A second rising edge without a falling one in between
+    decoder.edges.rising()
+    virtual_clock.sleep(0.01)
+    pulse(decoder, virtual_clock, 0.05)
+
+    assert decoder.decode() == 2
+    assert decoder.glitches == 3
+
+
+def test_a_pulse_split_across_two_decodes_is_counted_once(virtual_clock):
+    decoder = PulseDecoder(0.02, 0.08, train_gap=0.3)
+    decoder.edges.rising()
+    virtual_clock.sleep(0.05)
+    assert decoder.decode() == 0
+    assert not decoder.idle
+
+    decoder.edges.falling()
+    assert decoder.decode() == 1
+
+
+def test_edges_beyond_the_buffer_are_counted_as_overruns(virtual_clock):
+    decoder = PulseDecoder(0.02, 0.08, train_gap=0.3, buffer_size=4)
+    for _ in range(3):
+        pulse(decoder, virtual_clock, 0.05)
+
+    assert decoder.edges.overruns == 2
+    assert decoder.decode() == 2
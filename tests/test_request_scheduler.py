@@ -0,0 +1,60 @@
+from time import sleep
+
+from vending_machine.controllers.request_scheduler import CircuitBreaker, RequestPriority, RequestScheduler
+
+
+class Task:
+    def __init__(self, name, priority):
+        self.name = name
+        self.priority = priority
+        self.enqueued = None
+
+
+def test_tasks_come_out_by_priority_then_in_order():
+    scheduler = RequestScheduler()
+    for name, priority in [('status', RequestPriority.TELEMETRY), ('sale', RequestPriority.SALES),
+                           ('card', RequestPriority.INTERACTIVE), ('balance', RequestPriority.INTERACTIVE)]:
+        scheduler.put(Task(name, priority))
+
+    assert [scheduler.get().name for _ in range(4)] == ['card', 'balance', 'sale', 'status']
+
+
+def test_a_restricted_worker_leaves_lower_priorities_alone():
+    scheduler = RequestScheduler()
+    scheduler.put(Task('status', RequestPriority.TELEMETRY))
+
+    task, wait = scheduler.poll(RequestPriority.INTERACTIVE)
+    assert task is None and wait is None
+    assert scheduler.poll()[0].name == 'status'
+
+
+def test_a_delayed_task_keeps_its_first_enqueue_time():
+    scheduler = RequestScheduler()
+    task = Task('status', RequestPriority.TELEMETRY)
+    scheduler.put(task)
+    first = task.enqueued
+    scheduler.get()
+
+    scheduler.put(task, delay=0.02)
+    assert scheduler.poll()[0] is None
+    sleep(0.03)
+    assert scheduler.get() is task
+    assert task.enqueued == first
+
+
+def test_the_breaker_opens_and_lets_a_single_probe_through():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.0)
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
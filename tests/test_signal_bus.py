@@ -0,0 +1,71 @@
+from queue import Full
+
+import pytest
+
+from vending_machine.controllers.signal_bus import (
+    BackendCommand, CashSignal, LegacySignal, OverflowPolicy, SignalBus, TagDetected, Topic, ViewUpdate
+)
+
+
+def test_topics_take_turns_so_a_burst_cannot_starve_the_others():
+    bus = SignalBus()
+    for message in ('a', 'b', 'c'):
+        bus.publish(CashSignal(message))
+    bus.publish(TagDetected(7))
+
+    received = [bus.get(timeout=0) for _ in range(4)]
+    assert [type(signal).__name__ for signal in received] == ['CashSignal', 'TagDetected', 'CashSignal', 'CashSignal']
+    assert [signal.message for signal in received if signal.topic == Topic.CASH] == ['a', 'b', 'c']
+    assert bus.get(timeout=0) is None
+
+
+def test_the_view_keeps_only_its_latest_state():
+    bus = SignalBus()
+    for balance in (10, 20, 30):
+        bus.publish(ViewUpdate({'balance': balance}, {'balance': balance}))
+
+    assert bus.get(timeout=0).state == {'balance': 30}
+    assert bus.get(timeout=0) is None
+    assert bus.dropped() == {'view': 2}
+
+
+@pytest.mark.parametrize('policy, kept', [(OverflowPolicy.DROP_OLDEST, [2, 3, 4]), (OverflowPolicy.DROP_NEWEST, [0, 1, 2])])
+def test_a_bounded_topic_drops_by_its_policy(policy, kept):
+    bus = SignalBus({Topic.NFC: (policy, 3)})
+    for tag in range(5):
+        bus.publish(TagDetected(tag))
+
+    assert [bus.get(timeout=0).tag for _ in range(3)] == kept
+    assert bus.dropped() == {'nfc': 2}
+
+
+def test_a_full_blocking_topic_makes_the_producer_wait():
+    bus = SignalBus({Topic.CASH: (OverflowPolicy.BLOCK, 2)})
+    bus.publish(CashSignal('a'))
+    bus.publish(CashSignal('b'))
+
+    with pytest.raises(Full):
+        bus.publish(CashSignal('c'), block=False)
+    with pytest.raises(Full):
+        bus.publish(CashSignal('c'), timeout=0.05)
+
+    bus.get(timeout=0)
+    bus.publish(CashSignal('c'), block=False)
+    assert [bus.get(timeout=0).message for _ in range(2)] == ['b', 'c']
+    assert bus.dropped() == {}
+
+
+def test_subscribers_get_only_their_topic():
+    bus = SignalBus()
+    commands, legacy = [], []
+    bus.subscribe(Topic.COMMAND, commands.append)
+    bus.subscribe(Topic.LEGACY, legacy.append)
+
+    bus.publish(BackendCommand('DENY_CASH'))
+    bus.put('raw payload')
+    bus.publish(CashSignal('ignored'))
+    while bus.dispatch(timeout=0):
+        pass
+
+    assert [signal.command for signal in commands] == ['DENY_CASH']
+    assert len(legacy) == 1 and isinstance(legacy[0], LegacySignal) and legacy[0].payload == 'raw payload'
@@ -0,0 +1,68 @@
+from time import monotonic
+
+import pytest
+
+from vending_machine.benchmarks.api import BenchContext
+from vending_machine.controllers.status_reporter import StatusReporter
+from vending_machine.simulator.fake_api import FakeApi
+
+
+class Controller:
+    """Keeps the fields of every PatchStatus instead of sending it."""
+
+    def __init__(self, context):
+        self.context = context
+        self.patches = []
+
+    def request(self, request):
+        self.patches.append({
+            field: value for field, value in request.data.items() if field not in ('signature', 'idempotency_key')
+        })
+
+
+@pytest.fixture
+def reporter(tmp_path):
+    reporter = StatusReporter(Controller(BenchContext(FakeApi(), str(tmp_path))), interval=60.0)
+    reporter.values = {'door': 'closed', 'coins_10': 50, 'latency': 1}
+    for field in ('door', 'coins_10'):
+        reporter.register(field, lambda field=field: reporter.values[field])
+    reporter.register('latency', lambda: reporter.values['latency'], volatile=True)
+    return reporter
+
+
+def test_only_what_changed_is_sent_once_the_interval_is_up(reporter):
+    patches = reporter.api_controller.patches
+    next_send = reporter.tick(monotonic())
+    assert patches == [{'door': 'closed', 'coins_10': 50, 'latency': 1}]
+
+    reporter.values['coins_10'] = 49
+    assert reporter.tick(next_send) == next_send
+    assert len(patches) == 1
+
+    reporter.tick(monotonic())
+    assert patches[-1] == {'coins_10': 49, 'latency': 1}
+
+    reporter.tick(monotonic())
+    assert len(patches) == 2
+
+
+def test_a_critical_value_is_sent_at_once(reporter):
+    reporter.register('door', lambda: reporter.values['door'], critical=lambda door: door == 'open')
+    next_send = reporter.tick(monotonic())
+
+    reporter.values['coins_10'] = 49
+    reporter.tick(next_send)
+    reporter.values['door'] = 'open'
+    reporter.tick(next_send)
+    assert reporter.api_controller.patches[-1] == {'door': 'open', 'coins_10': 49, 'latency': 1}
+
+
+def test_volatile_values_only_go_along_with_a_change(reporter):
+    reporter.tick(monotonic())
+    reporter.values['latency'] = 7
+    reporter.tick(monotonic())
+    assert len(reporter.api_controller.patches) == 1
+
+    reporter.values['door'] = 'open'
+    reporter.tick(monotonic())
+    assert reporter.api_controller.patches[-1] == {'door': 'open', 'latency': 7}
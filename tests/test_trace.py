@@ -0,0 +1,74 @@
+import json
+import os
+
+import pytest
+
+from vending_machine.controllers.clock import clock, VirtualClock
+from vending_machine.controllers.trace import COIN, NOTE, Trace, TraceKind, TraceRecorder
+
+
+@pytest.fixture
+def virtual_clock():
+    source = VirtualClock(1000.0)
+    clock.install(source)
+    yield source
+    clock.reset()
+
+
+def test_events_come_back_as_they_were_recorded(tmp_path, virtual_clock):
+    path = str(tmp_path / 'session.trace')
+    recorder = TraceRecorder(path=path)
+    recorder.record(TraceKind.STATE, payload=json.dumps({'nfc_debounce': 2.0}).encode())
+    virtual_clock.sleep(0.25)
+    recorder._edge_hook(COIN)(clock.monotonic(), 1)
+    virtual_clock.sleep(0.05)
+    recorder._edge_hook(COIN)(clock.monotonic(), 0)
+    recorder.flush()
+    # Longer than a 32 bit microsecond delta holds, so a TIME record goes in between
+    virtual_clock.sleep(3 * 3600)
+    recorder._edge_hook(NOTE)(clock.monotonic(), 1)
+    recorder.record(TraceKind.OUTPUT, payload=b'PAYMENT_READY')
+    recorder.flush()
+    recorder.file.close()
+
+    trace = Trace(path)
+    assert [(event.kind, event.arg, event.payload) for event in trace.events] == [
+        (TraceKind.STATE, 0, b'{"nfc_debounce": 2.0}'),
+        (TraceKind.EDGE, COIN << 1 | 1, b''),
+        (TraceKind.EDGE, COIN << 1, b''),
+        (TraceKind.EDGE, NOTE << 1 | 1, b''),
+        (TraceKind.OUTPUT, 0, b'PAYMENT_READY'),
+    ]
+    assert [event.at for event in trace.events] == pytest.approx([0.0, 0.25, 0.3, 10800.3, 10800.3], abs=1e-6)
+    assert trace.outputs() == [(pytest.approx(10800.3, abs=1e-6), 'PAYMENT_READY')]
+
+
+def test_half_a_record_at_the_end_is_dropped(tmp_path, virtual_clock):
+    path = str(tmp_path / 'session.trace')
+    recorder = TraceRecorder(path=path)
+    recorder.record(TraceKind.COMMAND, payload=b'ACCEPT_CASH 250')
+    recorder.record(TraceKind.COMMAND, payload=b'TAKE_MONEY')
+    recorder.flush()
+    recorder.file.close()
+    with open(path, 'r+b') as trace_file:
+        trace_file.truncate(trace_file.seek(0, 2) - 3)
+
+    assert [event.payload for event in Trace(path).events] == [b'ACCEPT_CASH 250']
+
+
+def test_a_recorder_that_falls_behind_keeps_the_newest_events(tmp_path, virtual_clock):
+    path = str(tmp_path / 'session.trace')
+    recorder = TraceRecorder(path=path, max_events=3)
+    for position in range(5):
+        recorder.record(TraceKind.COMMAND, payload=b'%d' % position)
+    assert recorder.dropped == 2
+
+    recorder.flush()
+    recorder.file.close()
+    assert [event.payload for event in Trace(path).events] == [b'2', b'3', b'4']
+
+
+def test_every_start_gets_a_trace_of_its_own(tmp_path):
+    recorder = TraceRecorder(path=str(tmp_path / 'session-{started}.trace'))
+    assert '{started}' not in recorder.path
+    assert os.path.basename(recorder.path).startswith('session-2')
@@ -0,0 +1,108 @@
+import gzip
+import socket
+from threading import Thread
+from time import monotonic
+
+import pytest
+import swagger_client
+from urllib3.exceptions import ReadTimeoutError
+
+from vending_machine.controllers.transport import PoolSettings, Transport, TransportSettings
+
+
+class Backend(Thread):
+    """Accepts connections and reads the request; answers it only when told to."""
+
+    def __init__(self, answer=None):
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen()
+        self.answer = answer
+        self.requests = []
+        self.connections = []
+        super(Backend, self).__init__(target=self.handler, daemon=True)
+
+    @property
+    def host(self):
+        return 'http://127.0.0.1:%d' % self.server.getsockname()[1]
+
+    def handler(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            self.connections.append(connection)
+            Thread(target=self.serve, args=(connection,), daemon=True).start()
+
+    def serve(self, connection):
+        # Keeps answering on the same connection, as the pool reuses it
+        buffered = b''
+        while True:
+            while b'\r\n\r\n' not in buffered:
+                try:
+                    data = connection.recv(65536)
+                except OSError:
+                    return
+                if not data:
+                    return
+                buffered += data
+            head, _, buffered = buffered.partition(b'\r\n\r\n')
+            length = [int(line.split(b':')[1]) for line in head.split(b'\r\n') if line.lower().startswith(b'content-length')]
+            length = length[0] if length else 0
+            while len(buffered) < length:
+                buffered += connection.recv(65536)
+            body, buffered = buffered[:length], buffered[length:]
+            self.requests.append((head, body))
+            if self.answer is not None:
+                connection.sendall(self.answer)
+
+    def stop(self):
+        self.server.close()
+        for connection in self.connections:
+            connection.close()
+
+
+@pytest.fixture
+def backend():
+    backends = []
+
+    def start(answer=None):
+        backends.append(Backend(answer))
+        backends[-1].start()
+        return backends[-1]
+    yield start
+    for started in backends:
+        started.stop()
+
+
+def api_for(host, read_timeout=15.0, compress_min_size=None):
+    configuration = swagger_client.Configuration()
+    configuration.host = host
+    transport = Transport(configuration, TransportSettings(
+        requests=PoolSettings(maxsize=1, read_timeout=read_timeout, connect_timeout=1.0),
+        compress_min_size=compress_min_size, prewarm=False,
+    ))
+    return swagger_client.DefaultApi(transport.api_client(transport.settings.requests))
+
+
+def test_a_stalled_backend_times_out_after_the_read_timeout(backend):
+    api = api_for(backend().host, read_timeout=0.3)
+
+    start = monotonic()
+    with pytest.raises(ReadTimeoutError):
+        api.faehr_card_uuid_get(uuid='card-1')
+    assert monotonic() - start < 2.0
+
+
+def test_large_bodies_are_gzipped_when_enabled(backend):
+    server = backend(b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n')
+    api = api_for(server.host, compress_min_size=64)
+
+    api.ticket_sales_post(body={'items': ['ticket'] * 50})
+    api.ticket_sales_post(body={'items': []})
+
+    (big_head, big_body), (small_head, small_body) = server.requests
+    assert b'content-encoding: gzip' in big_head.lower()
+    assert gzip.decompress(big_body).startswith(b'{"items"')
+    assert b'content-encoding' not in small_head.lower() and small_body == b'{"items": []}'
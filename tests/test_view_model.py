@@ -0,0 +1,53 @@
+from vending_machine.controllers.signal_bus import SignalBus, Topic
+from vending_machine.controllers.view_model import ViewModel
+
+
+def test_the_first_frame_carries_every_field():
+    view = ViewModel()
+    update = view.frame()
+
+    assert update.state == view.state
+    assert update.changed == view.state._asdict()
+    assert view.frame() is None
+
+
+def test_updates_between_frames_go_out_together():
+    view = ViewModel()
+    view.frame()
+    states = []
+    view.on_update = states.append
+
+    for balance in (10, 30, 80):
+        view.update(session='ACCEPTING_CASH', balance=balance)
+    assert view.changed.is_set()
+    assert [state.balance for state in states] == [10, 30, 80]
+
+    update = view.frame()
+    assert update.changed == {'session': 'ACCEPTING_CASH', 'balance': 80}
+    assert update.state.balance == 80
+    assert view.frame() is None
+
+
+def test_an_update_that_changes_nothing_is_not_sent():
+    view = ViewModel()
+    view.frame()
+    view.update(balance=0, nfc='IDLE')
+
+    assert not view.changed.is_set()
+    assert view.frame() is None
+
+
+def test_frames_are_published_to_the_view_topic():
+    bus = SignalBus()
+    view = ViewModel(bus)
+    view.send()
+    view.update(required=250)
+    view.update(balance=100)
+    view.send()
+    view.send()
+
+    assert bus.depth()['view'] == 1
+    update = bus.get(timeout=0)
+    assert update.topic == Topic.VIEW
+    assert update.changed == {'required': 250, 'balance': 100}
+    assert bus.dropped() == {'view': 1}
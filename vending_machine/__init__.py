@@ -1,5 +1,4 @@
 from . import main_power_switch
 from . import pins
 from . import status_light
-from . import vending_machine
 from . import controllers
@@ -0,0 +1,6 @@
+from . import signing
+from . import queues
+from . import change
+from . import cash
+from . import nfc
+from . import api
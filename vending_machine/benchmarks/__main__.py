@@ -0,0 +1,47 @@
+import argparse
+import json
+import os
+import platform
+import sys
+from datetime import datetime, timezone
+from . import api, cash, change, nfc, queues, signing
+
+SUITES = {
+    'api': api.run,
+    'cash': cash.run,
+    'change': change.run,
+    'nfc': nfc.run,
+    'queues': queues.run,
+    'signing': signing.run,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs the benchmarks against simulated hardware")
+    parser.add_argument('suites', nargs='*', help=f"Suites to run, all by default: {', '.join(SUITES)}")
+    parser.add_argument('--output', default='../benchmarks.json')
+    args = parser.parse_args()
+
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"Unknown suites: {', '.join(sorted(unknown))}")
+    if not os.environ.get('TESTING_ENVIRONMENT'):
+        sys.exit("Run the benchmarks with TESTING_ENVIRONMENT=1, they drive mocked pins")
+
+    results = {
+        'started': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'suites': {},
+    }
+    for name in args.suites or SUITES:
+        print(f"Running {name}", file=sys.stderr)
+        results['suites'][name] = SUITES[name]()
+
+    tmp_file = args.output + '.tmp'
+    with open(tmp_file, 'w') as output:
+        json.dump(results, output, indent=1)
+    os.replace(tmp_file, args.output)
+    print(json.dumps(results, indent=1))
+    sys.stdout.flush()
+    # The controllers' threads never return
+    os._exit(0)
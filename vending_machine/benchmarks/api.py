@@ -0,0 +1,84 @@
+import os
+from concurrent.futures import wait
+from contextlib import contextmanager
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from ..controllers.api_controller import APIController, GetFaehrCard, PatchStatus
+from ..controllers.card_index import CardIndex
+from ..controllers.client_context import MachineIdentity, SigningKey
+from ..controllers.fare_catalog import FareCatalog
+from ..controllers.signal_bus import SignalBus
+from ..controllers.signature_schemes import SIGNATURE_SCHEMES, KeyType
+from ..simulator.fake_api import FakeApi
+
+
+class BenchContext:
+    """What APIController reads from a ClientContext, without a config file or a key on disk."""
+
+    def __init__(self, api, directory):
+        self.api = self.long_poll_api = api
+        self.batch_signing = False
+        self.identity = MachineIdentity.__new__(MachineIdentity)
+        self.identity.uuid = 'bench'
+        scheme = SIGNATURE_SCHEMES[KeyType.ED25519]
+        self.identity._key = SigningKey(scheme, scheme.generate())
+        self.fare_catalog = FareCatalog(os.path.join(directory, 'fare_catalog.bin'))
+        self.card_index = CardIndex(os.path.join(directory, 'card_index.bin'))
+
+
+@contextmanager
+def controller_for(api, workers):
+    # The outbox and the command cursor live next to the working directory, as on a machine
+    with TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.mkdir(os.path.join(directory, 'run'))
+        os.chdir(os.path.join(directory, 'run'))
+        try:
+            controller = APIController(SignalBus(), BenchContext(api, directory), workers=workers)
+            for request_thread in controller.request_threads:
+                request_thread.daemon = True
+                request_thread.start()
+            controller.outbox_flusher.daemon = True
+            controller.outbox_flusher.start()
+            yield controller
+        finally:
+            os.chdir(cwd)
+
+
+def settle(futures, timeout):
+    done, not_done = wait(futures, timeout=timeout)
+    return sum(1 for future in done if future.exception() is not None) + len(not_done)
+
+
+def bench_lookups(latency, failure_rate=0.0, cards=200, workers=3):
+    # Card lookups for cards the index has never seen, so every one goes to the backend
+    api = FakeApi(latency=latency, failure_rate=failure_rate)
+    with controller_for(api, workers) as controller:
+        start = perf_counter()
+        futures = [
+            controller.request(GetFaehrCard(f'card-{i}', controller.context)) for i in range(cards)
+        ]
+        failed = settle(futures, timeout=60)
+        elapsed = perf_counter() - start
+    return {'per_s': cards / elapsed, 'failed': failed, 'calls': sum(api.calls.values())}
+
+
+def bench_durable(latency, records=50, workers=3):
+    # Time until the outbox has delivered every record and resolved its future
+    api = FakeApi(latency=latency)
+    with controller_for(api, workers) as controller:
+        start = perf_counter()
+        futures = [
+            controller.request(PatchStatus({'sequence': i}, context=controller.context)) for i in range(records)
+        ]
+        failed = settle(futures, timeout=60)
+        elapsed = perf_counter() - start
+    return {'settled_s': elapsed, 'failed': failed, 'calls': sum(api.calls.values())}
+
+
+def run():
+    return {
+        'lookups_20ms': bench_lookups(0.02),
+        'lookups_20ms_10pct_failing': bench_lookups(0.02, failure_rate=0.1),
+        'durable_20ms': bench_durable(0.02),
+    }
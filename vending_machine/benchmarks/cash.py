@@ -0,0 +1,75 @@
+from statistics import mean
+from time import monotonic
+from ..controllers.cash_controller import CashControllerMessage
+from .rig import Rig
+
+# (pulse width, gap) in seconds; the coin register accepts widths of 25 to 200 ms
+COIN_RATES = {
+    'realistic': (0.05, 0.05),
+    'fast': (0.03, 0.02),
+    'stress': (0.026, 0.008),
+    'out_of_spec': (0.015, 0.01),
+}
+
+
+def bench_pulse_accuracy(pulses=40, rates=None):
+    rig = Rig.get()
+    register = rig.cash_controller.coin_register
+    results = {}
+    for name, (width, gap) in (rates or COIN_RATES).items():
+        rig.reset()
+        glitches = register.glitches
+        started = monotonic()
+        rig.coins.train(pulses, width, gap)
+        elapsed = monotonic() - started
+        rig.settle()
+        counted = rig.cash_controller.cash_state.balance // register.balance_per_pulse
+        results[name] = {
+            'width_s': width,
+            'gap_s': gap,
+            'pulses_per_s': pulses / elapsed,
+            'sent': pulses,
+            'counted': counted,
+            'glitches': register.glitches - glitches,
+        }
+    return results
+
+
+def bench_completion(rounds=3, price=60, paid=100):
+    """
+    Time from the last pulse of a payment to PAYMENT_READY, which is bounded
+    below by the pulse clearance, and from TAKE_MONEY to PAYMENT_COLLECTED,
+    which includes paying out the change.
+    """
+    rig = Rig.get()
+    tasks = rig.cash_controller.tasks
+    ready, collected = [], []
+    for _ in range(rounds):
+        rig.reset()
+        tasks.put(f'ACCEPT_CASH {price}')
+        rig.wait_for(CashControllerMessage.ACCEPTING_CASH)
+
+        rig.coins.insert(paid)
+        last_pulse = monotonic()
+        ready_at = rig.wait_for(CashControllerMessage.PAYMENT_READY)
+
+        tasks.put('TAKE_MONEY')
+        take_at = monotonic()
+        collected_at = rig.wait_for(CashControllerMessage.PAYMENT_COLLECTED)
+        if ready_at is None or collected_at is None:
+            raise RuntimeError("The cash controller did not complete the payment")
+        ready.append(ready_at - last_pulse)
+        collected.append(collected_at - take_at)
+
+    return {
+        'pulse_clearance_s': rig.cash_controller.coin_register.pulse_clearance,
+        'ready_after_last_pulse_s': {'mean': mean(ready), 'max': max(ready)},
+        'collected_after_take_s': {'mean': mean(collected), 'max': max(collected)},
+    }
+
+
+def run():
+    return {
+        'pulse_accuracy': bench_pulse_accuracy(),
+        'completion': bench_completion(),
+    }
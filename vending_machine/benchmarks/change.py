@@ -0,0 +1,45 @@
+from random import randrange, seed
+from time import perf_counter
+from ..controllers.changebox import ChangeBox
+from .rig import Rig
+
+
+def bench_plan(rounds=10000):
+    start = perf_counter()
+    change_box = ChangeBox()
+    build = perf_counter() - start
+
+    # A 10 cent coin paid out and one taken in, what every payment does to the tables
+    start = perf_counter()
+    for _ in range(rounds // 100):
+        change_box.dispensed(10, 1)
+        change_box.take_in(10)
+    update = (perf_counter() - start) / (rounds // 50)
+
+    seed(0)
+    amounts = [randrange(0, change_box.max_change + 1, change_box.unit) for _ in range(rounds)]
+    start = perf_counter()
+    for amount in amounts:
+        change_box.plan(amount)
+    return {'build_s': build, 'update_s': update, 'plan_s': (perf_counter() - start) / rounds}
+
+
+def bench_payout(amounts=(40, 130, 380)):
+    # Real time, as the simulated hoppers eject at the rate of the hardware
+    change_box = Rig.get().cash_controller.change_box
+    results = {}
+    for amount in amounts:
+        for denomination in change_box.denominations:
+            change_box.refill(denomination, 50)
+        coins = sum(change_box.plan(amount).values())
+        start = perf_counter()
+        change_box.give_change(amount)
+        results[str(amount)] = {'coins': coins, 'payout_s': perf_counter() - start}
+    return results
+
+
+def run():
+    return {
+        'plan': bench_plan(),
+        'payout': bench_payout(),
+    }
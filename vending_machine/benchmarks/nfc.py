@@ -0,0 +1,42 @@
+from statistics import mean
+from time import sleep
+from ..controllers.nfc_controller import NFCController
+from ..controllers.signal_bus import SignalBus
+from ..simulator.fake_nfc import FakeMFRC522, tap_pattern
+
+CARDS = [
+    (0x1A2B3C4D, '0b7a3f6e-51f4-4d0f-9a43-2f0e8c1d5b61'),
+    (0x5E6F7A8B, '6c2e9d1a-7b3f-4e8a-b5c4-0d9f2a6e1b37'),
+]
+
+
+def bench_taps(count=10, interval=0.8, duration=0.4):
+    signals = SignalBus()
+    controller = NFCController(report_to=signals, debounce=0.2)
+    reader = FakeMFRC522(tap_pattern(CARDS, count, interval, duration, start=0.2))
+    controller.reader.rfc_reader = reader
+    controller.start_all()
+    controller.tasks.put(NFCController.Tasks.READ_TAG)
+
+    detected = []
+    for _ in range(count):
+        signal = signals.get(timeout=interval * 2)
+        if signal is None:
+            break
+        detected.append(signal.tag)
+    controller.tasks.put(NFCController.Tasks.STOP_READING)
+    sleep(0.2)
+
+    # Taps start on a fixed schedule, so the delay is measured against it
+    delays = [tag.seen - (reader.started + tap.at) for tag, tap in zip(detected, reader.taps)]
+    return {
+        'taps': count,
+        'detected': len(detected),
+        'tap_to_probe_s': {'mean': mean(delays), 'max': max(delays)} if delays else None,
+        'probes': reader.probes,
+        'sector_reads': reader.reads,
+    }
+
+
+def run():
+    return {'taps': bench_taps()}
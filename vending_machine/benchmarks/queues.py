@@ -0,0 +1,56 @@
+from threading import Thread
+from time import perf_counter
+from ..controllers.request_scheduler import RequestPriority, RequestScheduler
+from ..controllers.signal_bus import SignalBus, Topic, APIResult, ViewUpdate
+
+
+class Task:
+    def __init__(self, priority):
+        self.priority = priority
+
+
+def bench_signal_bus(messages=100000):
+    bus = SignalBus()
+    bus.subscribe(Topic.API_RESULT, lambda signal: None)
+    start = perf_counter()
+    for i in range(messages):
+        bus.publish(APIResult('bench', i))
+        bus.dispatch()
+    same_thread = (perf_counter() - start) / messages
+
+    # A producer thread bursting view updates against one dispatcher
+    received = []
+    bus.subscribe(Topic.VIEW, received.append)
+    producer = Thread(target=lambda: [bus.publish(ViewUpdate(None, {'balance': i})) for i in range(messages)])
+    start = perf_counter()
+    producer.start()
+    while producer.is_alive():
+        bus.dispatch(timeout=0.001)
+    while bus.dispatch(timeout=0):
+        pass
+    burst = perf_counter() - start
+    return {
+        'publish_dispatch_s': same_thread,
+        'burst_s': burst,
+        'burst_delivered': len(received),
+        'burst_dropped': bus.dropped().get(Topic.VIEW.value, 0),
+    }
+
+
+def bench_request_scheduler(tasks=100000):
+    scheduler = RequestScheduler()
+    priorities = list(RequestPriority)
+    batch = [Task(priorities[i % len(priorities)]) for i in range(tasks)]
+    start = perf_counter()
+    for task in batch:
+        scheduler.put(task)
+    for _ in batch:
+        scheduler.get()
+    return {'put_get_s': (perf_counter() - start) / tasks}
+
+
+def run():
+    return {
+        'signal_bus': bench_signal_bus(),
+        'request_scheduler': bench_request_scheduler(),
+    }
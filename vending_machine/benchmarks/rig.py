@@ -0,0 +1,60 @@
+from time import monotonic, sleep
+from ..controllers.cash_controller import CashController
+from ..controllers.signal_bus import SignalBus, CashSignal
+from ..simulator.pulse_generator import CoinPulseGenerator, NotePulseGenerator
+from ..simulator.hoppers import HopperSimulator
+
+
+class Rig:
+    """
+    One simulated machine for all benchmarks in a run. gpiozero allows a pin to
+    be claimed only once per process, so the controller is built once and reset
+    between benchmarks.
+    """
+
+    _rig = None
+
+    def __init__(self):
+        self.signals = SignalBus()
+        self.cash_controller = CashController(report_to=self.signals)
+        self.coins = CoinPulseGenerator()
+        self.notes = NotePulseGenerator()
+        self.hoppers = [
+            HopperSimulator(hopper)
+            for hopper in self.cash_controller.change_box.payout.hoppers.values()
+        ]
+        self.cash_controller.start_all()
+        for hopper in self.hoppers:
+            hopper.start()
+
+    @classmethod
+    def get(cls):
+        if cls._rig is None:
+            cls._rig = cls()
+        return cls._rig
+
+    def settle(self, timeout=5.0):
+        # Waits until both registers have counted and closed everything they saw
+        deadline = monotonic() + timeout
+        registers = (self.cash_controller.coin_register, self.cash_controller.note_register)
+        while monotonic() < deadline:
+            if all(register.decoder.idle for register in registers):
+                return
+            sleep(0.01)
+
+    def reset(self):
+        self.settle()
+        cash_state = self.cash_controller.cash_state
+        with cash_state.BALANCE_LOCK:
+            cash_state.balance = 0
+        while self.signals.get(timeout=0) is not None:
+            pass
+
+    def wait_for(self, message, timeout=10.0):
+        # Returns when the cash controller reported message, or None on timeout
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            signal = self.signals.get(timeout=deadline - monotonic())
+            if isinstance(signal, CashSignal) and signal.message == message:
+                return monotonic()
+        return None
@@ -0,0 +1,71 @@
+import json
+from time import perf_counter
+from ..controllers.signature_schemes import SIGNATURE_SCHEMES, KeyType
+from ..controllers.client_context import MachineIdentity, SigningKey
+
+# Roughly what a PostTicketSale body looks like before it is signed
+SAMPLE_RECORD = {
+    'idempotency_key': '7d0c6c3e-3a8e-4c55-9a3c-0f2b8a9a7c11',
+    'machine': 'c8a3f1a4-9b7e-4f6c-8a51-3d2e1f0b9c77',
+    'product': 'adult-single',
+    'price': 380,
+    'paid_with': 'cash',
+    'sold_at': '2026-01-01T08:15:00+00:00',
+}
+
+
+def bench_keygen(key_type: KeyType, rounds):
+    scheme = SIGNATURE_SCHEMES[key_type]
+    start = perf_counter()
+    for _ in range(rounds):
+        scheme.generate()
+    return (perf_counter() - start) / rounds
+
+
+def bench_sign(key_type: KeyType, rounds):
+    scheme = SIGNATURE_SCHEMES[key_type]
+    private_key = scheme.generate()
+    data = json.dumps(SAMPLE_RECORD).encode()
+    start = perf_counter()
+    for _ in range(rounds):
+        scheme.sign(private_key, data)
+    return (perf_counter() - start) / rounds
+
+
+def bench_identity(key_type: KeyType, rounds, batch_size=64):
+    # The same path sales take: canonical JSON, then one signature per record or per batch
+    identity = MachineIdentity.__new__(MachineIdentity)
+    scheme = SIGNATURE_SCHEMES[key_type]
+    identity._key = SigningKey(scheme, scheme.generate())
+
+    start = perf_counter()
+    for _ in range(rounds):
+        identity.sign(SAMPLE_RECORD)
+    single = (perf_counter() - start) / rounds
+
+    batches = max(1, rounds // batch_size)
+    start = perf_counter()
+    for _ in range(batches):
+        identity.signed_batch([dict(SAMPLE_RECORD) for _ in range(batch_size)])
+    return {
+        'records_per_s': 1 / single,
+        'batched_records_per_s': batches * batch_size / (perf_counter() - start),
+    }
+
+
+def run(keygen_rounds=None, sign_rounds=200):
+    # RSA-4096 generation takes seconds on a Pi, so it gets fewer rounds by default
+    keygen_rounds = keygen_rounds or {KeyType.RSA: 2, KeyType.ED25519: 200, KeyType.ECDSA_P256: 200}
+    results = {}
+    for key_type in KeyType:
+        results[key_type.value] = {
+            'keygen_s': bench_keygen(key_type, keygen_rounds[key_type]),
+            'sign_s': bench_sign(key_type, sign_rounds),
+            'identity': bench_identity(key_type, sign_rounds),
+        }
+    return results
+
+
+if __name__ == '__main__':
+    for name, result in run().items():
+        print(f"{name:>12}  keygen {result['keygen_s'] * 1e3:10.3f} ms  sign {result['sign_s'] * 1e3:8.3f} ms")
@@ -1,7 +1,29 @@
 from . import nfc_controller
+from . import api_cache
+from . import request_scheduler
+from . import outbox
+from . import batch_signer
+from . import command_channel
 from . import api_controller
+from . import pulse_decoder
+from . import cash_journal
 from . import cash_controller
 from . import ec_card_controller
+from . import hopper
 from . import changebox
+from . import signature_schemes
+from . import merkle
+from . import transport
+from . import config_store
+from . import fare_catalog
+from . import card_index
+from . import clock
+from . import log_sink
+from . import metrics
+from . import signal_bus
+from . import view_model
+from . import trace
+from . import async_runtime
 from . import client_context
+from . import status_reporter
 from . import client_controller
@@ -1,79 +1,225 @@
-from threading import Thread
-from queue import Queue
+from concurrent.futures import Future
+from threading import Thread, Lock
+from time import monotonic, sleep
+from typing import Union
+from uuid import uuid4
 from swagger_client import DefaultApi
 from swagger_client.rest import ApiException
+from urllib3.exceptions import HTTPError
 from abc import ABC
+from loguru import logger
+from .api_cache import ResponseCache
 from .client_context import ClientContext
+from .outbox import Outbox, OutboxFlusher
+from .batch_signer import BatchSigner
+from .card_index import CardBlocked
+from .command_channel import CommandCursor, LongPollChannel, SSEChannel
+from .signal_bus import SignalBus, APIResult, BackendCommand
+from .metrics import metrics
+from .log_sink import Throttle
+from .request_scheduler import RequestPriority, RequestScheduler, Backoff, CircuitBreaker, CircuitOpen
 from swagger_client.models import *
 
+log = logger.bind(controller='api')
+
 
 class APIRequest(ABC):
+    cache_key = None
+    ttl = 0
+    fresh = False
+    durable = False
+    priority = RequestPriority.TELEMETRY
+    max_attempts = 3
+
     def __init__(self, context: ClientContext):
         self.context = context
+        self.attempts = 0
+        self.enqueued = None
+
+    @property
+    def endpoint(self):
+        return type(self).__name__
+
+    def invalidates(self):
+        return ()
+
+    def local_result(self):
+        return None
+
+    def local_error(self):
+        # An error known without asking the backend, the request is then never sent
+        return None
+
+    def failure(self, error):
+        # What the caller is told when the request failed with error
+        return error
+
+    def apply(self, result):
+        pass
 
     def __call__(self, api_instance: DefaultApi, **kwargs):
         pass
 
 
 class GetFaehrCard(APIRequest):
+    priority = RequestPriority.INTERACTIVE
+
     def __init__(self, uuid: str, context: ClientContext):
         super(GetFaehrCard, self).__init__(context)
         self.uuid = uuid
+        self.cache_key = ('faehr_card', uuid)
+        self.ttl = 300
+        # A card that may be blocked is always asked about, never answered from the cache
+        self.fresh = context.card_index.maybe_blocked(uuid)
+
+    def local_result(self):
+        return None if self.fresh else self.context.card_index.allowed_card(self.uuid)
+
+    def local_error(self):
+        return CardBlocked(self.uuid) if self.context.card_index.is_blocked(self.uuid) else None
+
+    def failure(self, error):
+        # A card in the filter is most likely blocked, so it is turned away while the backend cannot tell
+        if self.fresh and not APIController.answered(error):
+            return CardBlocked(self.uuid)
+        return error
 
     def __call__(self, api_instance: DefaultApi, **kwargs):
         resp = api_instance.faehr_card_uuid_get(uuid=self.uuid)
         return resp
 
+    def apply(self, result):
+        self.context.card_index.allow(self.uuid, result)
+
 
 class GetFaehrcardBalance(APIRequest):
+    priority = RequestPriority.INTERACTIVE
+
     def __init__(self, faehrcard: FaehrCard, context: ClientContext):
         super().__init__(context)
         self.faehrcard = faehrcard
+        self.cache_key = ('balance', faehrcard.uuid)
+        self.ttl = 30
 
     def __call__(self, api_instance: DefaultApi, **kwargs):
         resp = api_instance.faehr_card_uuid_balance_get(uuid=self.faehrcard.uuid)
         return resp
 
 
-class PostTicketSale(APIRequest):
-    def __init__(self, ticket_sale: TicketSale, context: ClientContext):
-        super(PostTicketSale, self).__init__(context)
-        self.signed_data = self.context.identity.signed_data(ticket_sale.to_dict())
+class DurableAPIRequest(APIRequest):
+    """
+    A signed record that has to reach the backend exactly once. It is written to
+    the outbox before it is sent, and carries an idempotency key inside the
+    signed payload so that a resend after a lost acknowledgement is harmless.
+    """
+    durable = True
+
+    def __init__(self, data: dict, context: ClientContext):
+        super(DurableAPIRequest, self).__init__(context)
+        data['idempotency_key'] = str(uuid4())
+        self.data = data
+        # In batch mode the BatchSigner signs the record together with its neighbours
+        self.signed_data = None if context.batch_signing else self.context.identity.signed_data(data)
+
+    @property
+    def idempotency_key(self):
+        return self.data['idempotency_key']
+
+    def outbox_args(self):
+        return {}
+
+    @classmethod
+    def restore(cls, signed_data: dict, context: ClientContext, **outbox_args):
+        request = cls.__new__(cls)
+        APIRequest.__init__(request, context)
+        request.data = request.signed_data = signed_data
+        request.__dict__.update(outbox_args)
+        return request
+
+
+class PostTicketSale(DurableAPIRequest):
+    priority = RequestPriority.SALES
+
+    def __init__(self, ticket_sale: TicketSale, context: ClientContext, faehrcard: FaehrCard = None):
+        super(PostTicketSale, self).__init__(ticket_sale.to_dict(), context)
+        self.faehrcard_uuid = faehrcard.uuid if faehrcard else None
+
+    def outbox_args(self):
+        return {'faehrcard_uuid': self.faehrcard_uuid}
+
+    def invalidates(self):
+        return (('balance', self.faehrcard_uuid),) if self.faehrcard_uuid else ()
 
     def __call__(self, api_instance: DefaultApi, **kwargs):
         resp = api_instance.ticket_sales_post(body=self.signed_data)
         return resp
 
 
-class PostTopUp(APIRequest):
+class PostTopUp(DurableAPIRequest):
+    priority = RequestPriority.SALES
+
     def __init__(self, faehrcard: FaehrCard, top_up: TopUp, context: ClientContext):
-        super(PostTopUp, self).__init__(context)
-        self.signed_data = self.context.identity.signed_data(top_up.to_dict())
-        self.faehrcard = faehrcard
+        super(PostTopUp, self).__init__(top_up.to_dict(), context)
+        self.faehrcard_uuid = faehrcard.uuid
+
+    def outbox_args(self):
+        return {'faehrcard_uuid': self.faehrcard_uuid}
+
+    def invalidates(self):
+        return (('balance', self.faehrcard_uuid),)
 
     def __call__(self, api_instance: DefaultApi, **kwargs):
-        resp = api_instance.faehr_card_uuid_topup_post(body=self.signed_data, uuid=self.faehrcard.uuid)
+        resp = api_instance.faehr_card_uuid_topup_post(body=self.signed_data, uuid=self.faehrcard_uuid)
         return resp
 
 
-class PatchStatus(APIRequest):
-    def __init__(self, status: MachineStatus, context: ClientContext):
-        super(PatchStatus, self).__init__(context)
-        self.signed_data = self.context.identity.signed_data(status.to_dict())
+class PatchStatus(DurableAPIRequest):
+    def __init__(self, status: Union[MachineStatus, dict], context: ClientContext):
+        # A plain dict carries only the fields that changed
+        super(PatchStatus, self).__init__(dict(status) if isinstance(status, dict) else status.to_dict(), context)
 
     def __call__(self, api_instance: DefaultApi, **kwargs):
         resp = api_instance.machines_uuid_status_patch(body=self.signed_data, uuid=self.context.identity.uuid)
         return resp
 
 
+DURABLE_REQUESTS = {cls.__name__: cls for cls in (PostTicketSale, PostTopUp, PatchStatus)}
+
+
 class GetMachineConfig(APIRequest):
-    def __init__(self, machine_config: MachineConfiguration, context: ClientContext):
+    # The generated client has no method for it, so it goes through call_api
+    CONFIG_PATH = '/machines/{uuid}/config'
+
+    def __init__(self, context: ClientContext):
         super(GetMachineConfig, self).__init__(context)
-        self.machine_config = machine_config.to_dict()
 
     def __call__(self, api_instance: DefaultApi, **kwargs):
-        resp = api_instance.machines_uuid_commands_get(uuid=self.context.identity.uuid)
-        return resp
+        client = api_instance.api_client
+        resp = client.call_api(
+            self.CONFIG_PATH, 'GET',
+            path_params={'uuid': self.context.identity.uuid},
+            header_params={
+                'Accept': 'application/json',
+                # 0 asks for the whole catalog or list
+                'X-Catalog-Version': str(self.context.fare_catalog.sync_version),
+                'X-Blocklist-Version': str(self.context.card_index.sync_version),
+            },
+            response_type='object',
+            auth_settings=list(client.configuration.auth_settings()),
+            _return_http_data_only=True,
+        )
+        return resp or {}
+
+    def apply(self, result):
+        config = dict(result.to_dict() if hasattr(result, 'to_dict') else result)
+        catalog = config.pop('catalog', None)
+        if catalog:
+            self.context.fare_catalog.update(catalog)
+        blocklist = config.pop('blocklist', None)
+        if blocklist:
+            self.context.card_index.update(blocklist)
+        # Only keys the schema marks as remote are taken, api_key and uuid never are
+        self.context.config_store.apply_remote(config)
 
 
 class RetrieveCommand(APIRequest):
@@ -86,52 +232,267 @@ class RetrieveCommand(APIRequest):
 
 
 class APIController:
-    def __init__(self, report_to: Queue, context: ClientContext):
+    # Server side failures and timeouts count against the backend, client errors do not
+    RETRYABLE = {408, 429}
+
+    def __init__(
+            self, report_to: SignalBus, context: ClientContext, workers=3, interactive_workers=1, command_stream=False
+    ):
         self.results = report_to
         self.api = context.api
-        self.tasks = Queue()
+        self.tasks = RequestScheduler()
         self.context = context
 
-        self.request_thread = RequestThread(self)
-        self.command_receiver = CommandReceiver(self)
+        self.backoff = Backoff()
+        self.breaker = CircuitBreaker()
+
+        self.cache = ResponseCache()
+        self.in_flight = {}
+        self.in_flight_lock = Lock()
+        self.on_response = None
+        # An outage fails every request, one warning per interval is enough
+        self.failure_log = Throttle(interval=10.0)
+
+        self.outbox = Outbox(requests=DURABLE_REQUESTS)
+        self.outbox_futures = {}
+
+        # At least one worker takes every priority, or sales, telemetry and the outbox are never sent
+        interactive_workers = max(0, min(interactive_workers, workers - 1))
+        self.request_threads = [
+            RequestThread(self, lowest=RequestPriority.INTERACTIVE if i < interactive_workers else RequestPriority.TELEMETRY)
+            for i in range(workers)
+        ]
+        self.command_receiver = CommandReceiver(self, stream=command_stream)
+        self.outbox_flusher = OutboxFlusher(self, self.outbox)
+        self.batch_signer = BatchSigner(self)
+        context.fare_catalog.on_needs_full = self.refresh_config
+        context.card_index.on_needs_full = self.refresh_config
 
     def start_all(self):
-        self.request_thread.start()
+        for request_thread in self.request_threads:
+            request_thread.start()
         self.command_receiver.start()
-
-    def request(self, request: APIRequest):
+        self.outbox_flusher.start()
+        self.batch_signer.start()
+
+    @classmethod
+    def answered(cls, error):
+        # Whether the backend itself turned the request down, as opposed to not getting to it
+        if not isinstance(error, ApiException) or error.status is None:
+            return False
+        return error.status < 500 and error.status not in cls.RETRYABLE
+
+    def refresh_config(self):
+        # Retried with backoff until the backend answers, the machine runs on its local config meanwhile
+        return self.request(GetMachineConfig(self.context))
+
+    def request(self, request: APIRequest) -> Future:
+        if request.durable:
+            # Sales never wait for the network or the signer, only for the local commit
+            request.future = self.outbox_futures[request.idempotency_key] = Future()
+            self.outbox.add(request)
+            if request.signed_data is None:
+                self.batch_signer.add(request)
+            else:
+                self.outbox_flusher.wake()
+            return request.future
+
+        error = request.local_error()
+        if error is not None:
+            future = Future()
+            future.set_exception(error)
+            return future
+
+        key = request.cache_key
+        if key is None:
+            request.future = Future()
+            self.tasks.put(request)
+            return request.future
+
+        cached = request.local_result()
+        if cached is None and not request.fresh:
+            cached = self.cache.get(key)
+        if cached is not None:
+            self.results.publish(APIResult(request.endpoint, cached))
+            future = Future()
+            future.set_result(cached)
+            return future
+
+        with self.in_flight_lock:
+            # Lookups for the same card share whatever call is already underway
+            pending = self.in_flight.get(key)
+            if pending is not None:
+                return pending.future
+            request.future = Future()
+            self.in_flight[key] = request
         self.tasks.put(request)
+        return request.future
+
+    def execute(self, request: APIRequest):
+        if not self.breaker.allow():
+            if request.priority == RequestPriority.INTERACTIVE or request.durable:
+                # The customer is waiting, so tell them now instead of after a timeout;
+                # the outbox backs off for all of its records at once
+                return self.fail(request, CircuitOpen())
+            return self.tasks.put(request, delay=max(self.breaker.retry_in(), self.backoff.base_delay))
+
+        try:
+            with metrics.span(f'api.{request.endpoint}'):
+                result = request(api_instance=self.api)
+        except ApiException as e:
+            if self.answered(e):
+                self.breaker.success()
+                return self.fail(request, e)
+            return self.retry(request, e)
+        except (HTTPError, OSError) as e:
+            return self.retry(request, e)
+        except Exception as e:
+            # Anything else is a fault of this request, not of the connection; the worker
+            # carries on and a half-open breaker gets its next probe later
+            self.breaker.failure()
+            return self.fail(request, e)
+
+        self.breaker.success()
+        self.backoff.success(request.endpoint)
+        self.complete(request, result)
+
+    def process(self, request: APIRequest):
+        # A fault of the controller itself must not cost a worker, nor leave the caller waiting forever
+        try:
+            self.execute(request)
+        except Exception as e:
+            log.opt(exception=e).error(f"{request.endpoint} could not be handled")
+            if request.cache_key is not None:
+                with self.in_flight_lock:
+                    self.in_flight.pop(request.cache_key, None)
+            future = getattr(request, 'future', None)
+            if future is not None and not future.done():
+                future.set_exception(e)
+
+    def log_failure(self, request: APIRequest, error):
+        suppressed = self.failure_log.allow()
+        if suppressed is not None:
+            log.bind(transaction=getattr(request, 'idempotency_key', None), suppressed=suppressed).warning(
+                f"{request.endpoint} failed after {request.attempts} attempts: {error!r}"
+            )
+
+    def retry(self, request: APIRequest, error):
+        self.breaker.failure()
+        request.attempts += 1
+        if request.durable or (
+                request.priority == RequestPriority.INTERACTIVE and request.attempts >= request.max_attempts
+        ):
+            return self.fail(request, error)
+        self.log_failure(request, error)
+        self.tasks.put(request, delay=self.backoff.failure(request.endpoint))
+
+    def fail(self, request: APIRequest, error):
+        self.log_failure(request, error)
+        if request.cache_key is not None:
+            with self.in_flight_lock:
+                self.in_flight.pop(request.cache_key, None)
+        request.future.set_exception(request.failure(error))
+
+    def metrics(self):
+        return {
+            'queue_depth': {priority.name: depth for priority, depth in self.tasks.depth().items()},
+            'queue_wait': {priority.name: stats.to_dict() for priority, stats in self.tasks.waits.items()},
+            'signal_depth': self.results.depth(),
+            'circuit': self.breaker.state,
+            'outbox': len(self.outbox),
+        }
+
+    def complete(self, request: APIRequest, result):
+        try:
+            request.apply(result)
+        except Exception as e:
+            # A response the machine cannot use is neither cached nor handed on
+            log.opt(exception=e).error(f"{request.endpoint} returned a response that cannot be applied")
+            return self.fail(request, e)
+        if request.cache_key is not None:
+            self.cache.put(request.cache_key, result, request.ttl)
+            with self.in_flight_lock:
+                self.in_flight.pop(request.cache_key, None)
+        for key in request.invalidates():
+            self.cache.invalidate(key)
+        if self.on_response is not None:
+            self.on_response(request.endpoint, result)
+
+        self.results.publish(APIResult(request.endpoint, result))
+        future = getattr(request, 'future', None)
+        if future is not None:
+            future.set_result(result)
 
 
 class RequestThread(Thread):
-    def __init__(self, controller: APIController):
+    def __init__(self, controller: APIController, lowest=RequestPriority.TELEMETRY):
         self.controller = controller
+        self.lowest = lowest
 
         super(RequestThread, self).__init__(target=self.handler)
 
     def handler(self):
         while True:
-            task = self.controller.tasks.get()
-            try:
-                self.controller.results.put(task(api_instance=self.controller.api))
-            except ApiException as e:
-                self.controller.tasks.put(task)
+            self.controller.process(self.controller.tasks.get(self.lowest))
 
 
 class CommandReceiver(Thread):
-    def __init__(self, controller: APIController):
+    FAILURES = (ApiException, HTTPError, OSError)
+    RELOAD_CONFIG = 'RELOAD_CONFIG'
+
+    def __init__(self, controller: APIController, stream=False, empty_poll_interval=1.0):
         self.controller = controller
+        self.empty_poll_interval = empty_poll_interval
+        self.cursor = CommandCursor()
+        self.channel = LongPollChannel(controller.context, self.cursor)
+        self.stream = SSEChannel(controller.context, self.cursor) if stream else None
 
         super(CommandReceiver, self).__init__(target=self.handler)
 
+    def receive(self):
+        if self.stream is not None:
+            try:
+                yield from self.stream.receive()
+                return
+            except ApiException as e:
+                if e.status not in (404, 405, 501):
+                    raise
+                # The backend has no push stream, so stay on long-polling
+                self.stream = None
+        yield from self.channel.receive()
+
+    def deliver(self, text):
+        context = self.controller.context
+        if text.strip() == self.RELOAD_CONFIG:
+            self.controller.refresh_config()
+        elif not (context.fare_catalog.handle_command(text) or context.card_index.handle_command(text)):
+            self.controller.results.publish(BackendCommand(text))
+
+    def poll(self):
+        received = 0
+        for command in self.receive():
+            received += 1
+            if command.text is None:
+                log.warning(f"Command {command.id} carries no command text")
+            elif self.cursor.is_new(command.id):
+                self.deliver(command.text)
+            # Acknowledged only once handed on, a crash before this gets the command again
+            self.cursor.advance(command.cursor)
+        return received
+
+    def idle(self, started):
+        # A backend or proxy that answers 304 or 408 at once instead of holding the poll
+        # would otherwise be asked again and again without a pause
+        return max(0.0, started + self.empty_poll_interval - monotonic())
+
     def handler(self):
         while True:
-            request = RetrieveCommand(context=self.controller.context)
+            started = monotonic()
             try:
-                res = request(api_instance=self.controller.api)
-                self.controller.results.put(res)
-            except ApiException as e:
-                if e.status == 408:
-                    pass
-                else:
-                    raise e
+                received = self.poll()
+            except self.FAILURES:
+                sleep(self.controller.backoff.failure(RetrieveCommand.__name__))
+            else:
+                self.controller.backoff.success(RetrieveCommand.__name__)
+                if not received:
+                    sleep(self.idle(started))
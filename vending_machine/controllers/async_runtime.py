@@ -0,0 +1,290 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from .cash_controller import CashRegister, SettleExpired
+from .outbox import Outbox
+from .api_controller import RetrieveCommand
+from .request_scheduler import RequestPriority
+from .clock import clock
+
+
+class LoopQueue:
+    """
+    Stands in for a controller's task Queue. Producers on any thread keep
+    calling put; the item is handed to the event loop, where one task awaits it.
+    Given the replaced queue's ``wait`` histogram, it keeps recording waits there.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, wait=None):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self.wait = wait
+
+    def put(self, item, block=True, timeout=None):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (clock.monotonic(), item))
+
+    def put_nowait(self, item):
+        self.put(item)
+
+    async def get(self):
+        enqueued, item = await self.queue.get()
+        if self.wait is not None:
+            self.wait.record(clock.monotonic() - enqueued)
+        return item
+
+    def empty(self):
+        return self.queue.empty()
+
+
+class LoopEvent:
+    """A threading.Event lookalike whose waiter is a task on the event loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.event = asyncio.Event()
+
+    def set(self):
+        self.loop.call_soon_threadsafe(self.event.set)
+
+    def clear(self):
+        self.event.clear()
+
+    def is_set(self):
+        return self.event.is_set()
+
+    async def wait(self, timeout=None):
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+class AsyncRuntime:
+    """
+    Runs a ClientController's controllers as tasks on one event loop instead
+    of one thread each.
+
+    GPIO callbacks still run on the pin factory's thread; they only record the
+    edge and wake the register's task. Calls that block, such as HTTP requests
+    and signing, go to a small executor. Pulse counting, cash transitions with
+    their payouts and MFRC522 SPI transfers get an executor of their own, so a
+    held long-poll or a slow backend never delays a coin or a tap. A register
+    that sees no edges and a reader that is not reading cause no wakeups at all.
+    """
+
+    def __init__(self, client_controller, executor_workers=None):
+        self.client_controller = client_controller
+        api_controller = client_controller.api_controller
+        # One slot per request worker, plus the command long-poll, the outbox and the background jobs
+        self.executor_workers = executor_workers or len(api_controller.request_threads) + 3
+        # The cash controller, both registers and the NFC reader
+        self.hardware_workers = 4
+        self.executor = None
+        self.hardware = None
+        self.loop = None
+        self.tasks = []
+
+    async def blocking(self, function, *args, executor=None):
+        return await self.loop.run_in_executor(executor or self.executor, function, *args)
+
+    def spawn(self, coroutine):
+        self.tasks.append(self.loop.create_task(coroutine))
+
+    def run(self):
+        asyncio.run(self.main())
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(max_workers=self.executor_workers, thread_name_prefix='runtime')
+        self.hardware = ThreadPoolExecutor(max_workers=self.hardware_workers, thread_name_prefix='hardware')
+        controller = self.client_controller
+        cash_controller = controller.cash_controller
+        nfc_controller = controller.nfc_controller
+        api_controller = controller.api_controller
+
+        # Queues and events the threaded handlers would block on are swapped for loop-aware ones
+        cash_controller.tasks = LoopQueue(self.loop, wait=cash_controller.tasks.wait)
+        nfc_controller.tasks = LoopQueue(self.loop, wait=nfc_controller.tasks.wait)
+        api_controller.batch_signer.requests = LoopQueue(self.loop)
+        api_controller.batch_signer.recover()
+        api_controller.outbox_flusher._wakeup = LoopEvent(self.loop)
+        api_controller.outbox_flusher._wakeup.set()
+        controller.status_reporter._wakeup = LoopEvent(self.loop)
+        reading = LoopEvent(self.loop)
+        controller.view.changed = LoopEvent(self.loop)
+
+        bus_ready = LoopEvent(self.loop)
+        controller.signals.on_ready = bus_ready.set
+
+        workers = [LoopEvent(self.loop) for _ in api_controller.request_threads]
+        api_controller.tasks.on_put = lambda: [worker.set() for worker in workers]
+
+        self.spawn(self.watch_config(controller.context.config_store))
+        self.spawn(self.dispatch_signals(bus_ready))
+        self.spawn(self.run_cash_controller(cash_controller))
+        self.spawn(self.run_register(cash_controller.coin_register))
+        self.spawn(self.run_register(cash_controller.note_register))
+        self.spawn(self.run_nfc_controller(nfc_controller, reading))
+        self.spawn(self.run_nfc_reader(nfc_controller, reading))
+        self.spawn(self.run_view(controller.view))
+        for request_thread, wakeup in zip(api_controller.request_threads, workers):
+            self.spawn(self.run_requests(api_controller, request_thread.lowest, wakeup))
+        self.spawn(self.run_command_receiver(api_controller.command_receiver))
+        self.spawn(self.run_outbox(api_controller.outbox_flusher))
+        self.spawn(self.run_batch_signer(api_controller.batch_signer))
+        self.spawn(self.run_status_reporter(controller.status_reporter))
+        self.spawn(self.export_metrics(controller.metrics_exporter))
+        if controller.trace_recorder is not None:
+            self.spawn(self.flush_trace(controller.trace_recorder))
+        controller.frontend_controller.start_all()
+        controller.ec_card_controller.start_all()
+        api_controller.refresh_config()
+
+        await asyncio.sleep(1)
+        controller.power_switch.power_on()
+        await asyncio.gather(*self.tasks)
+
+    async def watch_config(self, store):
+        while True:
+            await asyncio.sleep(store.poll_interval)
+            store.check()
+
+    async def dispatch_signals(self, ready: LoopEvent):
+        signals = self.client_controller.signals
+        while True:
+            ready.clear()
+            while signals.dispatch(timeout=0):
+                pass
+            await ready.wait()
+
+    async def run_cash_controller(self, cash_controller):
+        while True:
+            try:
+                task = await asyncio.wait_for(cash_controller.tasks.get(), cash_controller.event_timeout())
+            except asyncio.TimeoutError:
+                event = SettleExpired()
+            else:
+                event = cash_controller.as_event(task)
+            if event is not None:
+                # Transitions drive relays and hoppers, and a payout can take seconds
+                await self.blocking(cash_controller.dispatch, event, executor=self.hardware)
+
+    async def run_register(self, register: CashRegister):
+        edges = register.decoder.edges
+        wakeup = LoopEvent(self.loop)
+        state = {'decoding': False}
+
+        def edge(record):
+            def callback():
+                record()
+                if not state['decoding']:
+                    wakeup.set()
+            return callback
+
+        register.pulse_pin.when_pressed = edge(edges.rising)
+        register.pulse_pin.when_released = edge(edges.falling)
+
+        while True:
+            wakeup.clear()
+            state['decoding'] = True
+            while True:
+                # Counting takes the balance lock, which a payout may hold for a while
+                await self.blocking(register.decode, executor=self.hardware)
+                if register.decoder.idle:
+                    # An edge recorded after this flag is cleared wakes the task again
+                    state['decoding'] = False
+                    if not len(edges):
+                        break
+                    state['decoding'] = True
+                await asyncio.sleep(register.decode_interval)
+            await wakeup.wait()
+
+    async def run_nfc_controller(self, nfc_controller, reading: LoopEvent):
+        while True:
+            nfc_controller.handle(await nfc_controller.tasks.get())
+            if nfc_controller.reading.is_set():
+                reading.set()
+
+    async def run_nfc_reader(self, nfc_controller, reading: LoopEvent):
+        reader = nfc_controller.reader
+        while True:
+            if not nfc_controller.reading.is_set():
+                reading.clear()
+                await reading.wait()
+                reader.wake()
+                continue
+            await asyncio.sleep(await self.blocking(reader.poll, executor=self.hardware))
+
+    async def run_view(self, view):
+        while True:
+            await view.changed.wait()
+            view.changed.clear()
+            view.send()
+            await asyncio.sleep(view.interval)
+
+    async def run_requests(self, api_controller, lowest: RequestPriority, wakeup: LoopEvent):
+        while True:
+            wakeup.clear()
+            task, wait = api_controller.tasks.poll(lowest)
+            if task is None:
+                await wakeup.wait(wait)
+                continue
+            await self.blocking(api_controller.process, task)
+
+    async def run_command_receiver(self, command_receiver):
+        # The generated client is synchronous, so the held long-poll occupies one executor slot
+        controller = command_receiver.controller
+        while True:
+            started = monotonic()
+            try:
+                received = await self.blocking(command_receiver.poll)
+            except command_receiver.FAILURES:
+                await asyncio.sleep(controller.backoff.failure(RetrieveCommand.__name__))
+            else:
+                controller.backoff.success(RetrieveCommand.__name__)
+                if not received:
+                    await asyncio.sleep(command_receiver.idle(started))
+
+    async def run_outbox(self, flusher):
+        backoff = flusher.controller.backoff
+        while True:
+            await flusher._wakeup.wait()
+            flusher._wakeup.clear()
+            batch = await self.blocking(flusher.send)
+            if batch:
+                # The request tasks send it, nothing holds an executor slot while they do
+                await asyncio.wait([asyncio.wrap_future(request.future) for request in batch])
+            if batch is None or await self.blocking(flusher.settle, batch):
+                backoff.success(Outbox.__name__)
+            else:
+                await asyncio.sleep(backoff.failure(Outbox.__name__))
+                flusher._wakeup.set()
+
+    async def run_batch_signer(self, signer):
+        while True:
+            batch = [await signer.requests.get()]
+            deadline = monotonic() + signer.linger
+            while len(batch) < signer.max_batch:
+                try:
+                    batch.append(await asyncio.wait_for(signer.requests.get(), max(0.0, deadline - monotonic())))
+                except asyncio.TimeoutError:
+                    break
+            await self.blocking(signer.sign, batch)
+
+    async def run_status_reporter(self, reporter):
+        next_send = monotonic()
+        while True:
+            await reporter._wakeup.wait(max(0.0, next_send - monotonic()))
+            reporter._wakeup.clear()
+            next_send = await self.blocking(reporter.tick, next_send)
+
+    async def export_metrics(self, exporter):
+        while True:
+            await asyncio.sleep(exporter.interval)
+            await self.blocking(exporter.export)
+
+    async def flush_trace(self, recorder):
+        while True:
+            await asyncio.sleep(recorder.flush_interval)
+            await self.blocking(recorder.flush)
@@ -0,0 +1,44 @@
+from queue import Queue, Empty
+from threading import Thread
+from time import monotonic
+
+
+class BatchSigner(Thread):
+    def __init__(self, controller, max_batch=64, linger=0.05):
+        self.controller = controller
+        self.max_batch = max_batch
+        self.linger = linger
+        self.requests = Queue()
+
+        super(BatchSigner, self).__init__(target=self.handler)
+
+    def add(self, request):
+        self.requests.put(request)
+
+    def recover(self):
+        for request in self.controller.outbox.unsigned(self.controller.context):
+            self.add(request)
+
+    def collect(self):
+        # Wait for the first record, then give its neighbours up to linger seconds to join
+        batch = [self.requests.get()]
+        deadline = monotonic() + self.linger
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.requests.get(timeout=max(0.0, deadline - monotonic())))
+            except Empty:
+                break
+        return batch
+
+    def sign(self, batch):
+        # The records are in the outbox already, signing only replaces their payload
+        self.controller.context.identity.signed_batch([request.data for request in batch])
+        for request in batch:
+            request.signed_data = request.data
+        self.controller.outbox.signed(batch)
+        self.controller.outbox_flusher.wake()
+
+    def handler(self):
+        self.recover()
+        while True:
+            self.sign(self.collect())
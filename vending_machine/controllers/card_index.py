@@ -0,0 +1,210 @@
+import json
+import math
+import os
+import struct
+from collections import OrderedDict
+from hashlib import blake2b
+from threading import Lock
+from time import monotonic
+from loguru import logger
+
+
+class CardBlocked(Exception):
+    pass
+
+
+class BloomFilter:
+    def __init__(self, bits, hashes, data=None):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray(data) if data is not None else bytearray((bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity, fp_rate):
+        bits = max(64, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        return cls(bits, max(1, round(bits / capacity * math.log(2))))
+
+    def _positions(self, key: str):
+        # Two halves of one digest give all the positions (Kirsch-Mitzenmacher)
+        digest = blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.data[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str):
+        return all(self.data[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class CardIndex:
+    """
+    Answers most taps without the backend. A Bloom filter holds the blocked card
+    UUIDs and an LRU holds cards the backend recently confirmed. A card that is
+    not in the filter and is in the LRU is accepted locally; a filter hit or an
+    unknown card is looked up online.
+
+    The filter may report a good card as blocked, so only the cards named in
+    recent updates, which are also kept exactly, are rejected without asking.
+
+    Bloom filters cannot forget, so an unblocked card only leaves the filter
+    when the backend sends the full list again.
+    """
+
+    INDEX_FILE = '../card_index.bin'
+    MAGIC = b'FTXB'
+    FORMAT = 2
+    HEADER = struct.Struct('<4sHIIIII')
+    DELTA_COMMAND = 'BLOCKLIST_DELTA'
+
+    def __init__(
+            self, path=None, capacity=20000, fp_rate=0.001, allowed=512, allow_ttl=3600.0, recently_blocked=4096
+    ):
+        self.path = path or CardIndex.INDEX_FILE
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.allowed_size = allowed
+        self.allow_ttl = allow_ttl
+        self.recently_blocked_size = recently_blocked
+        self.lock = Lock()
+        self.allowed = OrderedDict()
+        self.recently_blocked = OrderedDict()
+        self.version = 0
+        self.count = 0
+        self.needs_full = False
+        # Called whenever the full list is needed, so that it is fetched
+        self.on_needs_full = None
+        self.blocked = BloomFilter.for_capacity(capacity, fp_rate)
+
+        if os.path.isfile(self.path):
+            with open(self.path, 'rb') as index_file:
+                data = index_file.read()
+            try:
+                magic, fmt, version, count, capacity, bits, hashes = self.HEADER.unpack_from(data, 0)
+                if magic != self.MAGIC or fmt != self.FORMAT or len(data) != self.HEADER.size + (bits + 7) // 8:
+                    raise ValueError(f"{self.path} is not a card index")
+            except (ValueError, struct.error):
+                # An index from an older format or a damaged one: start empty, the next sync asks for the full list
+                pass
+            else:
+                self.version, self.count = version, count
+                # A filter grown for a longer list keeps its size across restarts
+                self.capacity = max(self.capacity, capacity)
+                self.blocked = BloomFilter(bits, hashes, data[self.HEADER.size:])
+
+    def _write(self):
+        tmp_file = self.path + '.tmp'
+        with open(tmp_file, 'wb') as index_file:
+            index_file.write(self.HEADER.pack(
+                self.MAGIC, self.FORMAT, self.version, self.count, self.capacity,
+                self.blocked.bits, self.blocked.hashes
+            ))
+            index_file.write(self.blocked.data)
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        os.replace(tmp_file, self.path)
+
+    @property
+    def sync_version(self):
+        return 0 if self.needs_full else self.version
+
+    def maybe_blocked(self, uuid):
+        return uuid in self.blocked
+
+    def is_blocked(self, uuid):
+        return uuid in self.recently_blocked
+
+    def _block(self, uuid):
+        self.blocked.add(uuid)
+        self.allowed.pop(uuid, None)
+        self.recently_blocked[uuid] = None
+        self.recently_blocked.move_to_end(uuid)
+        while len(self.recently_blocked) > self.recently_blocked_size:
+            self.recently_blocked.popitem(last=False)
+
+    def allowed_card(self, uuid):
+        """Returns the cached card when it can be accepted without the backend."""
+        with self.lock:
+            entry = self.allowed.get(uuid)
+            if entry is None:
+                return None
+            card, expires = entry
+            if expires < monotonic() or uuid in self.blocked:
+                del self.allowed[uuid]
+                return None
+            self.allowed.move_to_end(uuid)
+            return card
+
+    def allow(self, uuid, card):
+        with self.lock:
+            self.allowed[uuid] = (card, monotonic() + self.allow_ttl)
+            self.allowed.move_to_end(uuid)
+            while len(self.allowed) > self.allowed_size:
+                self.allowed.popitem(last=False)
+
+    def apply_update(self, update: dict):
+        """
+        Applies ``{'version', 'base_version', 'blocked': [...]}``. An update without
+        base_version replaces the whole list. Returns False on a version gap.
+        """
+        with self.lock:
+            version = update['version']
+            # Checked before anything changes, the header has no room for more
+            if not isinstance(version, int) or isinstance(version, bool) or not 0 <= version <= 0xFFFFFFFF:
+                raise ValueError(f"version {version!r} does not fit the index header")
+            if version <= self.version:
+                return True
+
+            base_version = update.get('base_version')
+            blocked = update.get('blocked', ())
+            if not isinstance(blocked, (list, tuple)) or not all(isinstance(uuid, str) for uuid in blocked):
+                raise ValueError("blocked card UUIDs must be a list of strings")
+            if base_version is None:
+                # Size the new filter for the list it is rebuilt from
+                self.capacity = max(self.capacity, 2 * len(blocked))
+                self.blocked = BloomFilter.for_capacity(self.capacity, self.fp_rate)
+                self.recently_blocked.clear()
+                self.count = 0
+            elif base_version != self.version:
+                self.request_full()
+                return False
+
+            for uuid in blocked:
+                self._block(uuid)
+            self.count += len(blocked)
+            self.version = version
+            self.needs_full = False
+            self._write()
+            # Past its capacity the filter starts sending good cards online, so ask for a rebuild
+            if self.count > self.capacity:
+                self.request_full()
+            return True
+
+    def request_full(self):
+        self.needs_full = True
+        if self.on_needs_full is not None:
+            self.on_needs_full()
+
+    def update(self, update):
+        # A malformed update is dropped; it leaves a gap, so the whole list is fetched instead
+        try:
+            return self.apply_update(update)
+        except (KeyError, TypeError, ValueError, AttributeError, struct.error) as e:
+            logger.warning(f"Dropping a malformed blocklist update: {e!r}")
+            self.request_full()
+            return False
+
+    def handle_command(self, command):
+        if isinstance(command, bytes):
+            command = command.decode('utf-8', errors='replace')
+        if not isinstance(command, str) or not command.startswith(self.DELTA_COMMAND + ' '):
+            return False
+        try:
+            update = json.loads(command[len(self.DELTA_COMMAND) + 1:])
+        except ValueError as e:
+            logger.warning(f"Dropping a malformed blocklist update: {e!r}")
+            self.request_full()
+            return True
+        self.update(update)
+        return True
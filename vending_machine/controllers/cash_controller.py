@@ -1,13 +1,22 @@
 from .changebox import ChangeBox
+from .hopper import PayoutScheduler, default_hoppers
+from .pulse_decoder import PulseDecoder
+from .signal_bus import SignalBus, CashSignal
+from .view_model import ViewModel
+from .cash_journal import CashJournal, JournalKind, JournalSource
+from .metrics import metrics, TimedQueue
+from .clock import clock
+from .log_sink import Throttle
 from enum import Enum
 from typing import Union
-from datetime import datetime
+from time import sleep
 from threading import Lock, Thread, RLock
 from gpiozero.pins.mock import MockFactory
 from gpiozero import Device, Button, OutputDevice
 from pins import Pins
 import os
-from queue import Empty, Queue, Full
+from queue import Empty
+from loguru import logger
 
 # Set the default pin factory to a mock factory, if in testing environment
 if os.environ.get('TESTING_ENVIRONMENT', None):
@@ -66,73 +75,175 @@ class CollectorPosition(Enum):
     COLLECT = "COLLECT"
 
 
+class CashCommand:
+    kind: CashControllerCommand = None
+
+    @staticmethod
+    def parse(raw: Union[bytes, str]):
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8")
+        name, _, argument = raw.strip().partition(' ')
+        try:
+            kind = CashControllerCommand(name)
+        except ValueError:
+            return None
+        if kind == CashControllerCommand.ACCEPT_CASH:
+            return AcceptCash(int(argument))
+        return DenyCash() if kind == CashControllerCommand.DENY_CASH else TakeMoney()
+
+    def __str__(self):
+        return self.kind.value
+
+
+class AcceptCash(CashCommand):
+    kind = CashControllerCommand.ACCEPT_CASH
+
+    def __init__(self, amount: int):
+        self.amount = amount
+
+    def __str__(self):
+        return f"{self.kind.value} {self.amount}"
+
+
+class DenyCash(CashCommand):
+    kind = CashControllerCommand.DENY_CASH
+
+
+class TakeMoney(CashCommand):
+    kind = CashControllerCommand.TAKE_MONEY
+
+
+class PulseArrived:
+    def __init__(self, register):
+        self.register = register
+
+
+class SettleExpired:
+    pass
+
+
+class TrainClosed:
+    def __init__(self, register):
+        self.register = register
+
+
 class CashController(Thread):
-    def __init__(self, report_to: Queue, *args, **kwargs):
+    def __init__(
+            self, report_to: SignalBus, *args, journal: CashJournal = None, view: ViewModel = None,
+            change_box: ChangeBox = None, **kwargs
+    ):
         self.results = report_to
-        self.change_box = ChangeBox()
-        self.last_reported_amount = None
-        self.last_command = None
+        self.journal = journal
+        self.view = view or ViewModel()
+        # Numbers the payment sessions, in the journal as in the logs
+        self.transaction = journal.session if journal is not None else 0
+        self.log = logger.bind(controller='cash', transaction=self.transaction)
+        # Without a change box of its own the controller drives the machine's hoppers
+        self.change_box = change_box or ChangeBox(payout=PayoutScheduler(default_hoppers()))
+        self.pending = None
+        self.pending_since = None
+        self.on_command = None
 
         self.note_register = NoteAcceptorRegister(self)
         self.coin_register = CoinAcceptorRegister(self)
 
         self.cash_state = CashState()
-        self.tasks = Queue()
+        self.tasks = TimedQueue('queue.tasks.cash')
+
+        self.transitions = {
+            (Status.DENYING_CASH, AcceptCash): self.enable_cash,
+            (Status.ACCEPTING_CASH, AcceptCash): self.update_payment_status,
+            (Status.ACCEPTING_CASH, PulseArrived): self.update_payment_status,
+            (Status.ACCEPTING_CASH, DenyCash): self.cancel_cash,
+            (Status.PAYMENT_READY, DenyCash): self.cancel_cash,
+            (Status.PAYMENT_READY, TakeMoney): self.collect_payment,
+        }
+
+        if journal is not None and journal.recovered is not None:
+            # The money stays on the balance until it is paid back, so a payment that
+            # comes first still counts it. The refund is left pending, which makes it
+            # the first thing the controller does on its own thread.
+            self.cash_state.balance = journal.recovered.balance
+            self.pending = (self.recover_session, journal.recovered)
+            self.log.warning(f"Session {journal.recovered.session} was cut short holding {journal.recovered.balance}")
 
         super().__init__(target=self.handler)
 
     def not_registering(self):
-        with self.coin_register.last_pulse_l, self.note_register.last_pulse_l:
-            return (
-                    (
-                            not self.coin_register.last_pulse or
-                            (datetime.now() - self.coin_register.last_pulse).seconds >= 1
-                    )
-                    and (
-                            not self.note_register.last_pulse or
-                            (datetime.now() - self.note_register.last_pulse).seconds >= 2
-                    )
-            )
+        return self.coin_register.settled() and self.note_register.settled()
+
+    def settle_deadline(self):
+        return max(self.coin_register.settle_deadline(), self.note_register.settle_deadline())
+
+    def event_timeout(self):
+        return max(0.0, self.settle_deadline() - clock.monotonic()) if self.pending else None
+
+    @staticmethod
+    def as_event(task):
+        if isinstance(task, (bytes, str)):
+            return CashCommand.parse(task)
+        return task
+
+    def next_event(self):
+        try:
+            task = self.tasks.get(timeout=self.event_timeout())
+        except Empty:
+            return SettleExpired()
+        return self.as_event(task)
+
+    def dispatch(self, event):
+        if isinstance(event, TrainClosed):
+            # Counted on the register's side, made durable here and not on the decoding thread
+            if self.journal is not None:
+                self.journal.commit()
+            return
+        if self.on_command is not None and isinstance(event, CashCommand):
+            self.on_command(event)
+        if isinstance(event, SettleExpired) or (isinstance(event, PulseArrived) and self.pending):
+            # A transition waiting for the acceptors to settle is retried as is;
+            # new pulses only push its deadline further out.
+            if not self.pending:
+                return
+            transition, event = self.pending
+        else:
+            transition = self.transitions.get((self.cash_state.status, type(event)))
+            if transition is None:
+                return
+
+        if transition(event):
+            if self.pending_since is not None:
+                metrics.since('cash.settle_wait', self.pending_since)
+            self.pending, self.pending_since = None, None
+        else:
+            self.pending = (transition, event)
+            if self.pending_since is None:
+                self.pending_since = clock.monotonic()
+
+    def journal_entry(self, kind, amount=0, source=JournalSource.NONE, commit=False):
+        journal = self.journal
+        if journal is None:
+            return
+        journal.append(
+            kind, amount, self.cash_state.balance, self.cash_state.required_amount, source, session=self.transaction
+        )
+        if commit:
+            journal.commit()
+
+    def show(self):
+        self.view.update(
+            session=self.cash_state.status.name,
+            balance=self.cash_state.balance,
+            required=self.cash_state.required_amount,
+        )
 
     def handler(self):
         while True:
-            functions = {
-                CashControllerCommand.ACCEPT_CASH:
-                    self.enable_cash if self.cash_state.status == Status.DENYING_CASH else
-                    self.update_payment_status if self.cash_state.status == Status.ACCEPTING_CASH else None,
-                CashControllerCommand.DENY_CASH:
-                    self.cancel_cash if self.cash_state.status == Status.ACCEPTING_CASH else
-                    self.cancel_cash if self.cash_state.status == Status.PAYMENT_READY else None,
-                CashControllerCommand.TAKE_MONEY:
-                    self.collect_payment if self.cash_state.status == Status.PAYMENT_READY else None,
-            }
-
-            try:
-                cmd = self.tasks.get(timeout=1 if self.last_command else None)
-                cmd = cmd.decode("utf-8")
-                command = (
-                    CashControllerCommand.ACCEPT_CASH if cmd.startswith(CashControllerCommand.ACCEPT_CASH.value)
-                    else CashControllerCommand.DENY_CASH if cmd.startswith(
-                        CashControllerCommand.DENY_CASH.value) else
-                    CashControllerCommand.TAKE_MONEY if cmd.startswith(
-                        CashControllerCommand.TAKE_MONEY.value) else None
-                )
-                if command:
-                    fun = functions[command]
-                    if fun:
-                        if fun(command=cmd):
-                            self.last_command = None
-                        else:
-                            self.last_command = (command, cmd)
-
-            except Empty as e:
-                if self.last_command:
-                    fun = functions[self.last_command[0]]
-                    if fun(command=None):
-                        self.last_command = None
+            event = self.next_event()
+            if event is not None:
+                self.dispatch(event)
 
     # Payment Ready, Command Take Money
-    def collect_payment(self, command=None):
+    def collect_payment(self, event=None):
         self.set_collector(CollectorPosition.TAKE)
 
         assert not self.coin_register.is_open
@@ -140,11 +251,23 @@ class CashController(Thread):
 
         if self.not_registering():
             with self.cash_state.BALANCE_LOCK:
-                if self.cash_state.required_amount < self.cash_state.balance:
-                    self.change_box.give_change(self.cash_state.balance - self.cash_state.required_amount)
+                for coin in self.coin_register.inserted:
+                    if coin in self.change_box.denominations:
+                        self.change_box.take_in(coin)
+                change = max(0, self.cash_state.balance - self.cash_state.required_amount)
+                if change:
+                    self.journal_entry(JournalKind.CHANGE, amount=change, commit=True)
+
+            # A payout takes seconds, the registers must not wait on the balance meanwhile
+            owed = self.change_box.give_change(change) if change else 0
+            if owed:
+                self.journal_entry(JournalKind.OWED, amount=owed, commit=True)
+                self.log.error(f"{owed} of {change} change could not be paid out")
+            self.journal_entry(JournalKind.COLLECTED, amount=self.cash_state.balance, commit=True)
 
             self.reset_cash_state()
-            self.results.put(CashControllerMessage.PAYMENT_COLLECTED.value)
+            self.log.info("Payment collected")
+            self.results.publish(CashSignal(CashControllerMessage.PAYMENT_COLLECTED))
             return True
         return False
 
@@ -152,14 +275,16 @@ class CashController(Thread):
         pass
 
     # Payment Ready, Command deny Cash
-    def drop_payment(self, command=None):
+    def drop_payment(self, event=None):
         if self.coin_register.is_open or self.note_register.is_open:
             raise RuntimeError()
 
         self.set_collector(CollectorPosition.DROP)
+        self.journal_entry(JournalKind.DROPPED, amount=self.cash_state.balance, commit=True)
+        self.log.info(f"Payment of {self.cash_state.balance} dropped")
         self.reset_cash_state()
 
-        self.results.put(CashControllerMessage.PAYMENT_DROPPED.value)
+        self.results.publish(CashSignal(CashControllerMessage.PAYMENT_DROPPED))
 
         return True
 
@@ -168,68 +293,114 @@ class CashController(Thread):
             self.cash_state.balance = 0
             self.cash_state.required_amount = 0
             self.cash_state.status = Status.DENYING_CASH
-            self.last_reported_amount = 0
+            self.coin_register.inserted.clear()
+            self.note_register.inserted.clear()
+        self.show()
         return True
 
     # Denying Cash, Command accept cash
-    def enable_cash(self, command=None):
+    def enable_cash(self, event: AcceptCash = None):
         assert not self.coin_register.is_open
         assert not self.note_register.is_open
         assert self.cash_state.status == Status.DENYING_CASH
 
         if self.not_registering():
+            self.transaction += 1
+            self.log = logger.bind(controller='cash', transaction=self.transaction)
+            self.log.info(f"Accepting cash for {event.amount}")
             with self.cash_state.BALANCE_LOCK:
-                required_amount = int(command.split(' ')[1])
-                self.cash_state.required_amount = required_amount
+                self.cash_state.required_amount = event.amount
                 self.set_collector(CollectorPosition.COLLECT)
-                self.open_cash_inputs()
-                self.results.put(CashControllerMessage.ACCEPTING_CASH.value)
-                self.last_reported_amount = 0
+                self.open_cash_inputs(accept_notes=self.can_change_notes(event.amount))
+                self.results.publish(CashSignal(CashControllerMessage.ACCEPTING_CASH))
                 self.cash_state.status = Status.ACCEPTING_CASH
+                self.journal_entry(JournalKind.OPENED, commit=True)
+            self.show()
+            if self.cash_state.balance:
+                # Credit restored after a power cut counts towards this payment
+                self.update_payment_status()
+            return True
+        return False
 
     def close_cash_inputs(self):
         self.note_register.close()
         self.coin_register.close()
 
-    def open_cash_inputs(self):
-        self.note_register.open()
+    def release(self):
+        # Gives the acceptors' pins back, so another controller can claim them
+        for register in (self.note_register, self.coin_register):
+            register.input_relay.close()
+            register.pulse_pin.close()
+
+    def open_cash_inputs(self, accept_notes=True):
+        if accept_notes:
+            self.note_register.open()
         self.coin_register.open()
 
+    def can_change_notes(self, required_amount):
+        # Only take notes if we could pay out the change for paying with any single kind of note
+        for note in self.note_register.note_values:
+            paid = -(-required_amount // note) * note
+            if not self.change_box.can_make_change(paid - required_amount):
+                return False
+        return True
+
     # Accepting Cash, Command deny Cash
-    def cancel_cash(self, command=None):
+    def cancel_cash(self, event=None):
         if self.cash_state.status == Status.PAYMENT_READY:
             if self.not_registering():
-                self.drop_payment()
-            else:
-                return False
+                return self.drop_payment()
+            return False
         elif self.cash_state.status == Status.ACCEPTING_CASH:
             if self.not_registering():
                 self.close_cash_inputs()
-                self.reset_cash_state()
-            else:
-                return False
+                self.journal_entry(JournalKind.CANCELLED, amount=self.cash_state.balance, commit=True)
+                self.log.info(f"Payment cancelled at {self.cash_state.balance}")
+                return self.reset_cash_state()
+            return False
         elif self.cash_state.status == Status.DENYING_CASH:
             return True
 
         assert False
 
-    # Accepting Cash, no command, but waiting for full balance or cancel request
-    def update_payment_status(self, command=None):
+    # Accepting Cash, pulse arrived, waiting for full balance or cancel request
+    def update_payment_status(self, event=None):
         with self.cash_state.BALANCE_LOCK:
+            # The view model only swaps its state; the last coin shows even while the acceptors settle
+            self.show()
             if self.cash_state.balance >= self.cash_state.required_amount:
                 if self.not_registering():
                     self.close_cash_inputs()
                     self.cash_state.status = Status.PAYMENT_READY
-                    self.last_reported_amount = self.cash_state.balance
-                    self.results.put(CashControllerMessage.PAYMENT_READY.value)
+                    self.journal_entry(JournalKind.READY, commit=True)
+                    self.log.info(f"Payment ready, {self.cash_state.balance} of {self.cash_state.required_amount}")
+                    self.show()
+                    self.results.publish(CashSignal(CashControllerMessage.PAYMENT_READY))
                     return True
-            else:
-                if not self.last_reported_amount or self.last_reported_amount < self.cash_state.balance:
-                    try:
-                        self.results.put(f'{Status.ACCEPTING_CASH.value} {self.cash_state.balance}', timeout=0)
-                    except Full:
-                        pass
-            return False
+                return False
+            return True
+
+    # Startup, the journal shows a session that still held money when power was cut
+    def recover_session(self, record):
+        # Not in flight any more: a refund that a second power cut interrupts is not paid twice
+        self.journal_entry(JournalKind.RECOVERED, amount=record.balance, commit=True)
+        owed = record.balance
+        if self.change_box.can_make_change(record.balance):
+            owed = self.change_box.give_change(record.balance)
+        refunded = record.balance - owed
+        with self.cash_state.BALANCE_LOCK:
+            self.cash_state.balance = owed
+        self.show()
+        if refunded:
+            self.journal_entry(JournalKind.REFUNDED, amount=refunded, commit=True)
+            self.log.info(f"Refunded {refunded}")
+        if owed:
+            # What could not be paid back is kept as credit for the next payment
+            if refunded:
+                self.log.error(f"{owed} of the {record.balance} refund could not be paid out")
+            self.journal_entry(JournalKind.RESTORED, amount=owed, commit=True)
+            self.log.info(f"Kept {owed} as credit")
+        return True
 
     def start_all(self):
         self.start(), self.note_register.start(), self.coin_register.start()
@@ -237,27 +408,79 @@ class CashController(Thread):
 
 
 class CashRegister(Thread):
-    def __init__(self, pulse_clearance, input_relay, pulse_pin, balance_per_pulse, controller: CashController):
+    def __init__(
+            self, pulse_clearance, input_relay, pulse_pin, balance_per_pulse, controller: CashController,
+            min_pulse_width, max_pulse_width, train_gap, buffer_size=256, decode_interval=0.005,
+            source=JournalSource.NONE
+    ):
+        self.source = source
         self.pulse_clearance = pulse_clearance
         self.input_relay = input_relay
         self.pulse_pin: Button = pulse_pin
         self.last_pulse_l: RLock = RLock()
-        self.last_pulse: Union[None, datetime] = None
+        self.last_pulse: Union[None, float] = None
         self.balance_per_pulse: int = balance_per_pulse
         self.controller = controller
+        self.decoder = PulseDecoder(
+            min_width=min_pulse_width,
+            max_width=max_pulse_width,
+            train_gap=train_gap,
+            buffer_size=buffer_size,
+            on_train=self.train_closed,
+        )
+        self.inserted = []
+        self.decode_interval = decode_interval
+        self.debug_log = Throttle()
 
         self.is_open = False
         self.input_relay.off()
 
         super(CashRegister, self).__init__(target=self.handler)
 
-    def handler(self):
-        def when_held_handler():
+    @property
+    def glitches(self):
+        return self.decoder.glitches
+
+    def settle_deadline(self):
+        last_edge = self.decoder.edges.last_edge
+        return 0.0 if last_edge is None else last_edge + self.pulse_clearance
+
+    def settled(self):
+        return clock.monotonic() >= self.settle_deadline()
+
+    def train_closed(self, train):
+        value = train.pulses * self.balance_per_pulse
+        self.inserted.append(value)
+        # A whole coin or note is counted, that is worth an msync, which the controller does
+        self.controller.journal_entry(JournalKind.INSERTED, amount=value, source=self.source)
+        self.controller.tasks.put(TrainClosed(self))
+
+    def decode(self):
+        pulses = self.decoder.decode()
+        if pulses:
+            amount = pulses * self.balance_per_pulse
             with self.controller.cash_state.BALANCE_LOCK:
-                self.controller.cash_state.balance += self.balance_per_pulse
-                self.last_pulse = datetime.now()
+                self.controller.cash_state.balance += amount
+                self.controller.journal_entry(JournalKind.PULSE, amount=amount, source=self.source)
+            with self.last_pulse_l:
+                self.last_pulse = self.decoder.last_pulse
+            metrics.since('cash.pulse_to_balance', self.decoder.last_pulse)
+            suppressed = self.debug_log.allow()
+            if suppressed is not None:
+                self.controller.log.bind(suppressed=suppressed).debug(
+                    f"{type(self).__name__} counted {pulses} pulses, {self.glitches} glitches so far"
+                )
+            self.controller.tasks.put(PulseArrived(self))
+        return pulses
 
-        self.pulse_pin.when_held = when_held_handler
+    def handler(self):
+        # The GPIO callbacks only timestamp edges; counting happens here.
+        self.pulse_pin.when_pressed = self.decoder.edges.rising
+        self.pulse_pin.when_released = self.decoder.edges.falling
+
+        while True:
+            sleep(self.decode_interval)
+            self.decode()
 
     def open(self):
         self.input_relay.on()
@@ -273,18 +496,28 @@ class CoinAcceptorRegister(CashRegister):
         super().__init__(
             pulse_clearance=1.4,
             input_relay=OutputDevice(Pins.COIN_INPUT_RELAY),
-            pulse_pin=Button(Pins.COIN_ACCEPTOR_PULSE_INPUT, hold_time=0.025),
+            pulse_pin=Button(Pins.COIN_ACCEPTOR_PULSE_INPUT),
             balance_per_pulse=10,
-            controller=controller
+            controller=controller,
+            min_pulse_width=0.025,
+            max_pulse_width=0.2,
+            train_gap=0.3,
+            source=JournalSource.COIN,
         )
 
 
 class NoteAcceptorRegister(CashRegister):
+    note_values = (500, 1000, 2000, 5000)
+
     def __init__(self, controller: CashController):
         super().__init__(
             pulse_clearance=1.6,
             input_relay=OutputDevice(Pins.NOTE_INPUT_RELAY),
-            pulse_pin=Button(Pins.NOTE_ACCEPTOR_PULSE_INPUT, hold_time=0.045),
+            pulse_pin=Button(Pins.NOTE_ACCEPTOR_PULSE_INPUT),
             balance_per_pulse=500,
-            controller=controller
+            controller=controller,
+            min_pulse_width=0.045,
+            max_pulse_width=0.3,
+            train_gap=0.5,
+            source=JournalSource.NOTE,
         )
@@ -0,0 +1,177 @@
+import csv
+import mmap
+import os
+import struct
+import zlib
+from collections import namedtuple
+from datetime import datetime, timezone
+from enum import IntEnum
+from threading import Lock
+from time import time
+from loguru import logger
+
+
+class JournalKind(IntEnum):
+    OPENED = 1
+    PULSE = 2
+    INSERTED = 3
+    READY = 4
+    CHANGE = 5
+    COLLECTED = 6
+    DROPPED = 7
+    CANCELLED = 8
+    RECOVERED = 9
+    REFUNDED = 10
+    RESTORED = 11
+    OWED = 12
+
+
+class JournalSource(IntEnum):
+    NONE = 0
+    COIN = 1
+    NOTE = 2
+
+
+JournalRecord = namedtuple('JournalRecord', 'seq at kind source session amount balance required')
+
+# A session whose last record is one of these still holds the customer's money
+IN_FLIGHT = (JournalKind.OPENED, JournalKind.PULSE, JournalKind.INSERTED, JournalKind.READY, JournalKind.RESTORED)
+
+
+class CashJournal:
+    """
+    Every pulse, balance transition, payout and drop of the cash controller, in
+    a preallocated file that is mapped into memory and used as a ring.
+
+    Appending packs one fixed-size record with its CRC into the map, which costs
+    about as much as a dict update. Pages only go to the SD card on ``commit``,
+    which the controller calls at transaction boundaries: a coin or note counted,
+    a payment ready, collected or dropped. One msync covers everything appended
+    since the previous one.
+    """
+
+    JOURNAL_FILE = '../cash_journal.bin'
+    MAGIC = b'FTXJ'
+    FORMAT = 1
+    HEADER = struct.Struct('<4sHHI')
+    RECORD = struct.Struct('<QdBBxxIiii')
+    CRC = struct.Struct('<I')
+
+    def __init__(self, path=None, capacity=65536):
+        self.path = path or CashJournal.JOURNAL_FILE
+        self.capacity = capacity
+        self.size = self.RECORD.size + self.CRC.size
+        self.lock = Lock()
+        self.seq = 1
+        self.session = 0
+        self._dirty = None
+
+        length = self.HEADER.size + capacity * self.size
+        if os.path.isfile(self.path) and not self._valid():
+            # Never drop cash records silently, keep the file for whoever reconciles
+            os.replace(self.path, self.path + '.damaged')
+            logger.warning(f"{self.path} is damaged, it was moved aside and a new journal started")
+        if not os.path.isfile(self.path):
+            with open(self.path, 'wb') as journal_file:
+                journal_file.write(self.HEADER.pack(self.MAGIC, self.FORMAT, self.size, capacity))
+                journal_file.truncate(length)
+                os.fsync(journal_file.fileno())
+
+        self.file = open(self.path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), length)
+        records = self.records()
+        if records:
+            self.seq = records[-1].seq + 1
+            self.session = max(record.session for record in records)
+        self.recovered = self.in_flight(records)
+
+    def _valid(self):
+        with open(self.path, 'rb') as journal_file:
+            header = journal_file.read(self.HEADER.size)
+            journal_file.seek(0, os.SEEK_END)
+            length = journal_file.tell()
+        if len(header) < self.HEADER.size:
+            return False
+        magic, fmt, size, capacity = self.HEADER.unpack(header)
+        return (
+            magic == self.MAGIC and fmt == self.FORMAT and size == self.size and capacity == self.capacity
+            and length == self.HEADER.size + capacity * size
+        )
+
+    def _offset(self, seq):
+        return self.HEADER.size + (seq % self.capacity) * self.size
+
+    def append(self, kind, amount=0, balance=0, required=0, source=JournalSource.NONE, session=None):
+        with self.lock:
+            seq = self.seq
+            self.seq += 1
+            offset = self._offset(seq)
+            self.RECORD.pack_into(
+                self.map, offset, seq, time(), kind, source,
+                self.session if session is None else session, amount, balance, required
+            )
+            self.CRC.pack_into(
+                self.map, offset + self.RECORD.size,
+                zlib.crc32(self.map[offset:offset + self.RECORD.size])
+            )
+            if self._dirty is None:
+                self._dirty = (offset, offset + self.size)
+            else:
+                self._dirty = (min(self._dirty[0], offset), max(self._dirty[1], offset + self.size))
+        return seq
+
+    def commit(self):
+        with self.lock:
+            if self._dirty is None:
+                return
+            start, end = self._dirty
+            self._dirty = None
+        start -= start % mmap.PAGESIZE
+        self.map.flush(start, end - start)
+
+    def records(self):
+        records = []
+        data = self.map[:]
+        unused = bytes(8)
+        for offset in range(self.HEADER.size, len(data), self.size):
+            raw = data[offset:offset + self.RECORD.size]
+            if raw[:8] == unused:
+                continue
+            crc, = self.CRC.unpack_from(data, offset + self.RECORD.size)
+            if crc != zlib.crc32(raw):
+                # Torn by a power cut while it was written
+                continue
+            seq, at, kind, source, session, amount, balance, required = self.RECORD.unpack(raw)
+            records.append(JournalRecord(
+                seq, at, JournalKind(kind), JournalSource(source), session, amount, balance, required
+            ))
+        records.sort(key=lambda record: record.seq)
+        return records
+
+    def in_flight(self, records=None):
+        # The last session, if power was cut while it still held money
+        records = self.records() if records is None else records
+        if records and records[-1].kind in IN_FLIGHT and records[-1].balance > 0:
+            return records[-1]
+        return None
+
+    def export_csv(self, output):
+        writer = csv.writer(output)
+        writer.writerow(['seq', 'time', 'session', 'kind', 'source', 'amount', 'balance', 'required'])
+        for record in self.records():
+            writer.writerow([
+                record.seq,
+                datetime.fromtimestamp(record.at, timezone.utc).isoformat(),
+                record.session,
+                record.kind.name,
+                record.source.name.lower() if record.source else '',
+                record.amount,
+                record.balance,
+                record.required,
+            ])
+
+    def close(self):
+        self.commit()
+        self.map.close()
+        self.file.close()
+
@@ -1,21 +1,143 @@
+from functools import reduce
+from math import gcd
+from threading import RLock
+
+
 class ChangeBox:
-    def __init__(self):
-        self.denominations = {
+    NO_PAYOUT = 1 << 30
+
+    def __init__(self, denominations=None, max_change=5000, payout=None):
+        self.denominations = dict(denominations or {
             10: 50,
             20: 50,
             50: 50,
             100: 50,
             200: 50
-        }
+        })
+        self.max_change = max_change
+        self.payout = payout
+        self.stalled_hoppers = set()
+        self.on_change = None
+        self.unit = reduce(gcd, self.denominations)
+        self.lock = RLock()
+
+        self._order = None
+        self._caps = {}
+        self._groups = []
+        self._tables = []
+        self._build()
+
+    def _cap(self, denomination):
+        # Stock beyond what could ever be paid out does not change the tables
+        return min(self.denominations[denomination], self.max_change // denomination)
+
+    def _build(self, start=0):
+        # Bounded-stock minimum coin change as a 0/1 knapsack over binary split
+        # bundles of each denomination. For every bundle we remember at which
+        # amounts it improved the table, which is enough to reconstruct a payout.
+        # The bundles of one denomination form a group, and the table before each
+        # group is kept, so a stock change only recomputes its own group and the
+        # ones after it. The largest coins come first, the small ones that change
+        # with every payout are cheapest to redo.
+        if start == 0:
+            self._order = sorted(self.denominations, reverse=True)
+            self._tables = [[0] + [self.NO_PAYOUT] * (self.max_change // self.unit)]
+        del self._groups[start:]
+        del self._tables[start + 1:]
+
+        fewest = list(self._tables[start])
+        size = len(fewest) - 1
+        for denomination in self._order[start:]:
+            cap = self._caps[denomination] = self._cap(denomination)
+            group = []
+            bundle = 1
+            while cap > 0:
+                take = min(bundle, cap)
+                cap -= take
+                bundle <<= 1
+
+                weight = take * denomination // self.unit
+                used = bytearray(size + 1)
+                for amount in range(size, weight - 1, -1):
+                    coins = fewest[amount - weight] + take
+                    if coins < fewest[amount]:
+                        fewest[amount] = coins
+                        used[amount] = 1
+                group.append((denomination, take, weight, used))
+            self._groups.append(group)
+            self._tables.append(list(fewest))
+
+    def _stock_changed(self, denomination):
+        # Updated right away, so the next payout finds the tables ready
+        if denomination not in self._caps:
+            self._build()
+        elif self._caps[denomination] != self._cap(denomination):
+            self._build(self._order.index(denomination))
+
+    def can_make_change(self, amount):
+        if amount < 0 or amount % self.unit or amount > self.max_change:
+            return False
+        with self.lock:
+            return self._tables[-1][amount // self.unit] < self.NO_PAYOUT
+
+    def plan(self, amount):
+        if not self.can_make_change(amount):
+            return None
+        with self.lock:
+            payout = {}
+            rest = amount // self.unit
+            for group in reversed(self._groups):
+                for denomination, take, weight, used in reversed(group):
+                    if rest and used[rest]:
+                        payout[denomination] = payout.get(denomination, 0) + take
+                        rest -= weight
+            assert rest == 0
+            return payout
+
+    def take_in(self, denomination, count=1):
+        with self.lock:
+            self.denominations[denomination] = self.denominations.get(denomination, 0) + count
+            self._stock_changed(denomination)
+
+    def pay_out(self, payout):
+        with self.lock:
+            for denomination, count in payout.items():
+                if count > self.denominations[denomination]:
+                    raise RuntimeError(f"Only {self.denominations[denomination]} coins of {denomination} left")
+            for denomination, count in payout.items():
+                self.denominations[denomination] -= count
+                self._stock_changed(denomination)
+
+    def dispensed(self, denomination, count):
+        with self.lock:
+            self.denominations[denomination] = max(0, self.denominations[denomination] - count)
+            self._stock_changed(denomination)
+
+    def stalled(self, denomination):
+        with self.lock:
+            self.stalled_hoppers.add(denomination)
+            self.denominations[denomination] = 0
+            self._stock_changed(denomination)
+        if self.on_change:
+            self.on_change(self)
+
+    def refill(self, denomination, count):
+        with self.lock:
+            self.stalled_hoppers.discard(denomination)
+            self.denominations[denomination] = count
+            self._stock_changed(denomination)
+        if self.on_change:
+            self.on_change(self)
 
     def give_change(self, amount):
-        if amount % 10:
-            raise RuntimeError
-        while amount:
-            for d in self.denominations:
-                if d <= amount:
-                    amount -= d
-                    pin = self.denominations[d]
-                    # do something with pin
-                    break
-        return True
+        # Returns what could not be paid out, 0 when all of it was
+        with self.lock:
+            payout = self.plan(amount)
+            if payout is None:
+                return amount
+            if self.payout is None:
+                self.pay_out(payout)
+                return 0
+
+        # The hoppers run without the lock, the plan is made again from what is left
+        return max(0, self.payout.dispense(self, amount))
@@ -1,110 +1,176 @@
-import yaml
 import swagger_client
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
-from cryptography.hazmat.primitives import serialization, hashes
-import json
+from cryptography.hazmat.primitives import serialization
+from .signature_schemes import KeyType, SIGNATURE_SCHEMES, scheme_for_key
+from .merkle import MerkleTree, canonical_json
+from .transport import Transport, TransportSettings
+from .config_store import ConfigStore, ConfigSnapshot
+from .fare_catalog import FareCatalog
+from .metrics import metrics
+from .card_index import CardIndex
 import os
 from base64 import b64encode
-from enum import Enum
-from yaml import safe_load
+from collections import namedtuple
+from threading import Lock
+
+# The scheme and the key it signs with, always replaced together
+SigningKey = namedtuple('SigningKey', ['scheme', 'private_key'])
 
 
 class MachineIdentity:
     IDENTITY_FILE = '../identity.pem'
-    MACHINE_CONFIG_FILE = '../machine.config.yaml'
 
-    class KEYS(Enum):
-        API_KEY = 'api_key'
-        UUID = 'uuid'
+    def __init__(self, store: ConfigStore = None):
+        self.store = store or ConfigStore.shared()
+        snapshot = self.store.snapshot
+        self.api_key = snapshot.api_key
+        self.uuid = snapshot.uuid
+        self.key_type = KeyType(snapshot.key_type)
+        self._rotation = Lock()
 
-    def __init__(self):
         if not (os.path.exists(MachineIdentity.IDENTITY_FILE) and
                 os.path.isfile(MachineIdentity.IDENTITY_FILE)):
-            self._private_key = rsa.generate_private_key(public_exponent=65537, key_size=4096)
-
-            with open(MachineIdentity.IDENTITY_FILE, 'wb') as key_file:
-                key_file.write(self._private_key.private_bytes(
-                    encoding=serialization.Encoding.PEM,
-                    format=serialization.PrivateFormat.TraditionalOpenSSL,
-                    encryption_algorithm=serialization.NoEncryption(),
-                ))
+            scheme = SIGNATURE_SCHEMES[self.key_type]
+            self._key = SigningKey(scheme, scheme.generate())
+            self._write_identity()
         else:
             with open(MachineIdentity.IDENTITY_FILE, 'rb') as key_file:
-                self._private_key = serialization.load_pem_private_key(
+                private_key = serialization.load_pem_private_key(
                     key_file.read(),
                     password=None,
                 )
-
-        if os.path.exists(MachineIdentity.MACHINE_CONFIG_FILE) and os.path.isfile(MachineIdentity.MACHINE_CONFIG_FILE):
-            with open(MachineIdentity.MACHINE_CONFIG_FILE) as config_file:
-                root = safe_load(config_file)
-                self.api_key = root[self.KEYS.API_KEY.value]
-                self.uuid = root[self.KEYS.UUID.value]
-        else:
-            raise RuntimeError("No configuration detected")
+            # The key on disk wins; key_type only decides what the next key will be
+            self._key = SigningKey(scheme_for_key(private_key), private_key)
+
+    @property
+    def scheme(self):
+        return self._key.scheme
+
+    @staticmethod
+    def _stage(path, data):
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'wb') as key_file:
+            key_file.write(data)
+            key_file.flush()
+            os.fsync(key_file.fileno())
+        return tmp_file
+
+    def _write_identity(self):
+        os.replace(
+            self._stage(MachineIdentity.IDENTITY_FILE, self._key.scheme.private_bytes(self._key.private_key)),
+            MachineIdentity.IDENTITY_FILE
+        )
+
+    def rotate_key(self, key_type: KeyType = None):
+        """
+        Replaces the identity key, optionally switching the scheme, and returns the
+        new public key. Records are signed with the new key from then on; the
+        replaced one is kept as identity.pem.previous, so that it can be put back
+        by hand if the backend never takes the new public key.
+        """
+        with self._rotation:
+            key_type = KeyType(key_type) if key_type is not None else self.key_type
+            scheme = SIGNATURE_SCHEMES[key_type]
+            private_key = scheme.generate()
+
+            # identity.pem is only ever replaced as a whole: a crash at any point leaves
+            # either the old key or the new one there, never no key
+            staged = self._stage(MachineIdentity.IDENTITY_FILE, scheme.private_bytes(private_key))
+            if os.path.exists(MachineIdentity.IDENTITY_FILE):
+                previous = MachineIdentity.IDENTITY_FILE + '.previous'
+                with open(MachineIdentity.IDENTITY_FILE, 'rb') as key_file:
+                    os.replace(self._stage(previous, key_file.read()), previous)
+            # The key on disk wins over key_type, so updating it first is safe
+            self.store.update({'key_type': key_type.value})
+            os.replace(staged, MachineIdentity.IDENTITY_FILE)
+            # Signers read the pair once, so none of them sees a new scheme with the old key
+            self._key = SigningKey(scheme, private_key)
+            self.key_type = key_type
+            return self.get_public_key()
 
     def signed_data(self, data):
         data.update({'signature': self.sign(data)})
         return data
 
+    def signed_batch(self, records):
+        # One signature over the Merkle root covers the whole batch; every record
+        # carries the proof that ties it to that root.
+        if len(records) == 1:
+            return [self.signed_data(records[0])]
+
+        key = self._key
+        with metrics.span('signing.batch'):
+            tree = MerkleTree([canonical_json(record) for record in records])
+            signature = b64encode(key.scheme.sign(key.private_key, tree.root))
+        for index, record in enumerate(records):
+            record['batch_signature'] = {
+                'root': tree.root.hex(),
+                'signature': signature,
+                'index': index,
+                'proof': tree.proof(index),
+            }
+        return records
+
     def sign(self, data):
-        return b64encode(self._private_key.sign(
-            json.dumps(data).encode(),
-            padding.PSS(
-                mgf=padding.MGF1(hashes.SHA3_512()),
-                salt_length=padding.PSS.MAX_LENGTH
-            ),
-            hashes.SHA3_512()
-        ))
+        key = self._key
+        with metrics.span('signing.record'):
+            return b64encode(key.scheme.sign(key.private_key, canonical_json(data)))
 
     def get_public_key(self):
-        return self._private_key.public_key().public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.PKCS1
-        ).decode()
+        key = self._key
+        return key.scheme.public_bytes(key.private_key).decode()
 
 
 class MachineConfiguration:
-    MACHINE_CONFIG_FILE = '../machine.config.yaml'
+    def __init__(self, store: ConfigStore = None):
+        self.store = store or ConfigStore.shared()
+        self.store.subscribe(self.reload)
 
-    class KEYS(Enum):
-        HOST = 'host'
-
-    def __init__(self):
-        if not (os.path.exists(MachineConfiguration.MACHINE_CONFIG_FILE) and
-                os.path.isfile(MachineConfiguration.MACHINE_CONFIG_FILE)):
-            self.host = '/'
-            self.update_config_file()
-        else:
-            with open(MachineConfiguration.MACHINE_CONFIG_FILE) as conf:
-                root = yaml.safe_load(conf.read())
-
-            self.host = root[self.KEYS.HOST]
+    def reload(self, snapshot: ConfigSnapshot):
+        self.snapshot = snapshot
+        self.host = snapshot.host
 
     def update_config_file(self):
-        with open(MachineConfiguration.MACHINE_CONFIG_FILE, 'w') as conf:
-            conf.write(yaml.safe_dump(
-                {
-                    self.KEYS.HOST: self.host,
-                }
-            ))
+        self.store.update({'host': self.host})
 
 
 class ClientContext:
     def __init__(
             self, api: swagger_client.DefaultApi = None,
             identity: MachineIdentity = None,
-            config: MachineConfiguration = None
+            config: MachineConfiguration = None,
+            batch_signing: bool = None,
+            transport: TransportSettings = None,
+            fare_catalog: FareCatalog = None,
+            card_index: CardIndex = None
     ):
         self.identity = identity or MachineIdentity()
-        self.config = config or MachineConfiguration()
+        self.config = config or MachineConfiguration(self.identity.store)
+        self.config_store = self.config.store
+        self.batch_signing = self.config.snapshot.batch_signing if batch_signing is None else batch_signing
+        self.fare_catalog = fare_catalog or FareCatalog()
+        self.card_index = card_index or CardIndex()
 
         self._api_conf = swagger_client.Configuration()
         self._api_conf.api_key = self.identity.api_key
         self._api_conf.host = self.config.host
-        self._api_client = swagger_client.ApiClient(self._api_conf)
+        # A host pushed by the backend or edited on disk applies to the next request
+        self.config_store.subscribe(lambda snapshot: setattr(self._api_conf, 'host', snapshot.host))
+
+        # Requests and the command long-poll get separate pools, so a held
+        # long-poll never makes a sale wait for a free connection
+        snapshot = self.config.snapshot
+        self.transport = Transport(self._api_conf, transport or TransportSettings(
+            workers=snapshot.api_workers,
+            compress_min_size=1024 if snapshot.compress_requests else None,
+        ))
+        self._api_client = self.transport.api_client(self.transport.settings.requests)
+        self._long_poll_client = self.transport.api_client(self.transport.settings.long_poll)
 
         self.api = api or swagger_client.DefaultApi(self._api_client)
+        self.long_poll_api = api or swagger_client.DefaultApi(self._long_poll_client)
+
+        if api is None:
+            self.transport.prewarm()
 
 
 if __name__ == '__main__':
@@ -1,10 +1,17 @@
 from .client_context import ClientContext
 import os
-from queue import Queue
-from .cash_controller import CashController
+from .cash_controller import CashController, CashCommand
+from .cash_journal import CashJournal
 from .nfc_controller import NFCTag, NFCController
 from .ec_card_controller import ECCardController
 from .api_controller import APIController
+from .status_reporter import StatusReporter
+from .config_store import ConfigSnapshot
+from .signal_bus import SignalBus, Topic, BackendCommand
+from .command_channel import command_text
+from .metrics import MetricsExporter, metrics
+from .trace import TraceRecorder
+from .view_model import ViewModel
 from frontend import FrontendController
 from ..status_light import StatusLight
 from ..main_power_switch import MainPowerSwitch
@@ -12,36 +19,111 @@ from gpiozero.pins.mock import MockFactory
 from gpiozero import Device
 from time import sleep
 from threading import Thread
+from loguru import logger
 
 if os.environ.get('TESTING_ENVIRONMENT', None):
     Device.pin_factory = MockFactory()
 
+log = logger.bind(controller='client')
+
 
 class ClientController(Thread):
     def __init__(self, context: ClientContext):
-        self.signals = Queue()
+        self.signals = SignalBus()
         self.context = context
 
-        self.cash_controller = CashController(report_to=self.signals)
-        self.nfc_controller = NFCController(report_to=self.signals)
+        self.view = ViewModel(report_to=self.signals)
+        self.cash_controller = CashController(report_to=self.signals, journal=CashJournal(), view=self.view)
+        self.nfc_controller = NFCController(report_to=self.signals, view=self.view)
         self.ec_card_controller = ECCardController(report_to=self.signals)
         self.frontend_controller = FrontendController(report_to=self.signals)
-        self.api_controller = APIController(report_to=self.signals, context=self.context)
+        snapshot = self.context.config_store.snapshot
+        self.api_controller = APIController(
+            report_to=self.signals, context=self.context,
+            workers=snapshot.api_workers, command_stream=snapshot.command_stream
+        )
 
         self.status_light = StatusLight()
         self.power_switch = MainPowerSwitch()
 
+        self.status_reporter = StatusReporter(self.api_controller, interval=snapshot.status_interval)
+        self.metrics_exporter = MetricsExporter()
+        self.trace_recorder = TraceRecorder() if snapshot.trace else None
+        self.register_status_sources()
+        self.context.config_store.subscribe(self.apply_config)
+        self.signals.subscribe(Topic.COMMAND, self.route_command)
+        self.subscribe_frontend()
+        if self.trace_recorder is not None:
+            self.trace_recorder.attach(
+                self.cash_controller, self.nfc_controller, self.api_controller, self.signals, view=self.view
+            )
+
         super(ClientController, self).__init__(target=self.handler)
 
+    def register_status_sources(self):
+        cash_state = self.cash_controller.cash_state
+        change_box = self.cash_controller.change_box
+        reporter = self.status_reporter
+
+        reporter.register('power_on', lambda: self.power_switch.power_is_on, critical=lambda on: not on)
+        reporter.register('status_light', lambda: 'green' if self.status_light.is_green else 'red')
+        reporter.register('cash_status', lambda: cash_state.status.name)
+        reporter.register('change_stock', lambda: dict(change_box.denominations))
+        reporter.register('latency', metrics.summary, volatile=True)
+        reporter.register(
+            'stalled_hoppers', lambda: sorted(change_box.stalled_hoppers), critical=lambda stalled: bool(stalled)
+        )
+
+        self.power_switch.on_change = reporter.poke
+        self.status_light.on_change = reporter.poke
+        change_box.on_change = reporter.poke
+
+    def subscribe_frontend(self):
+        # The frontend takes its work from a task queue, like the other controllers
+        tasks = getattr(self.frontend_controller, 'tasks', None)
+        if tasks is None:
+            log.warning(f"{type(self.frontend_controller).__name__} has no task queue, view updates are not shown")
+            return
+        self.signals.subscribe(Topic.VIEW, tasks.put)
+
+    def apply_config(self, snapshot: ConfigSnapshot):
+        # Timings are read on every use, so swapping them is enough to apply a reload
+        self.cash_controller.coin_register.pulse_clearance = snapshot.coin_pulse_clearance
+        self.cash_controller.note_register.pulse_clearance = snapshot.note_pulse_clearance
+        self.nfc_controller.debounce = snapshot.nfc_debounce
+        self.status_reporter.interval = snapshot.status_interval
+        if self.trace_recorder is not None and self.trace_recorder.cash_controller is not None:
+            self.trace_recorder.record_state()
+
+    def route_command(self, signal: BackendCommand):
+        # Swagger models and dicts carry the text in their command field
+        text = command_text(signal.command)
+        try:
+            parsed = CashCommand.parse(text) if text is not None else None
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            log.warning(f"Ignoring a backend command that cannot be parsed: {signal.command!r}")
+            return
+        self.cash_controller.tasks.put(parsed)
+
     def handler(self):
-        pass
+        while True:
+            self.signals.dispatch()
 
     def start_all(self):
+        self.context.config_store.watch()
         self.api_controller.start_all()
+        self.api_controller.refresh_config()
         self.cash_controller.start_all()
         self.nfc_controller.start_all()
+        self.view.start()
         self.frontend_controller.start_all()
         self.ec_card_controller.start_all()
+        self.status_reporter.start()
+        self.metrics_exporter.start()
+        if self.trace_recorder is not None:
+            self.trace_recorder.start()
 
         sleep(1)
         self.power_switch.power_on()
@@ -0,0 +1,40 @@
+from time import monotonic, sleep
+
+
+class Clock:
+    """
+    The time the controllers decide on: pulse widths, settle deadlines and NFC
+    debouncing all read ``clock.monotonic()``. It is real time, unless a replay
+    installs a VirtualClock.
+    """
+
+    def __init__(self):
+        self.monotonic = monotonic
+        self.sleep = sleep
+
+    def install(self, source):
+        self.monotonic = source.monotonic
+        self.sleep = source.sleep
+
+    def reset(self):
+        self.monotonic = monotonic
+        self.sleep = sleep
+
+
+class VirtualClock:
+    # Only moves when it is told to, so a replay gives the same result every time
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(0.0, seconds)
+
+    def advance_to(self, now):
+        if now > self.now:
+            self.now = now
+
+
+clock = Clock()
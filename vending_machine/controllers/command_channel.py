@@ -0,0 +1,160 @@
+import os
+from collections import deque, namedtuple
+from swagger_client.rest import ApiException
+
+# One command as both channels deliver it: ``cursor`` is what to acknowledge once it was handled
+Command = namedtuple('Command', ['id', 'text', 'cursor'])
+
+
+def _field(command, name):
+    return command.get(name) if isinstance(command, dict) else getattr(command, name, None)
+
+
+def command_text(command):
+    # Long-poll answers hold models or dicts with the command in a field, the stream sends the text
+    if isinstance(command, bytes):
+        return command.decode('utf-8', errors='replace')
+    if isinstance(command, str):
+        return command
+    text = _field(command, 'command')
+    return command_text(text) if isinstance(text, (bytes, str)) else None
+
+
+class CommandCursor:
+    CURSOR_FILE = '../command.cursor'
+
+    def __init__(self, path=None, remembered=64):
+        self.path = path or CommandCursor.CURSOR_FILE
+        self.value = None
+        self.seen = deque(maxlen=remembered)
+
+        if os.path.isfile(self.path):
+            with open(self.path) as cursor_file:
+                self.value = cursor_file.read().strip() or None
+
+    def advance(self, value):
+        if not value or value == self.value:
+            return
+        self.value = value
+        tmp_file = self.path + '.tmp'
+        with open(tmp_file, 'w') as cursor_file:
+            cursor_file.write(value)
+        os.replace(tmp_file, self.path)
+
+    def is_new(self, command_id):
+        # Commands that carry an id are delivered at most once, even if the backend repeats them
+        if command_id is None:
+            return True
+        if command_id in self.seen:
+            return False
+        self.seen.append(command_id)
+        return True
+
+
+class LongPollChannel:
+    """
+    Holds one long-poll request open at a time. The cursor goes out as ETag and
+    Last-Event-ID, which both lets the backend answer 304 when nothing is new and
+    acknowledges everything delivered up to it.
+
+    The generated client takes no headers per call, and default headers would
+    go out with every request sharing it, so this goes through ``call_api``.
+    """
+
+    COMMANDS_PATH = '/machines/{uuid}/commands'
+
+    def __init__(self, context, cursor: CommandCursor):
+        self.context = context
+        self.cursor = cursor
+
+    def receive(self):
+        client = self.context.long_poll_api.api_client
+        headers = {'Accept': 'application/json'}
+        if self.cursor.value:
+            headers['If-None-Match'] = headers['Last-Event-ID'] = self.cursor.value
+
+        try:
+            data, status, response_headers = client.call_api(
+                self.COMMANDS_PATH, 'GET',
+                path_params={'uuid': self.context.identity.uuid},
+                header_params=headers,
+                response_type='object',
+                auth_settings=list(client.configuration.auth_settings()),
+                _return_http_data_only=False,
+            )
+        except ApiException as e:
+            if e.status in (304, 408):
+                return []
+            raise
+
+        etag = response_headers.get('ETag') if response_headers else None
+        commands = data if isinstance(data, list) else [data] if data is not None else []
+        if not commands:
+            self.cursor.advance(etag)
+            return []
+        # The ETag covers the whole answer, so it is acknowledged with the last command
+        return [
+            Command(
+                _field(command, 'id') or _field(command, 'uuid'),
+                command_text(command),
+                etag if position == len(commands) - 1 else None,
+            )
+            for position, command in enumerate(commands)
+        ]
+
+
+class SSEChannel:
+    STREAM_PATH = '/machines/{uuid}/commands/stream'
+
+    def __init__(self, context, cursor: CommandCursor):
+        self.context = context
+        self.cursor = cursor
+
+    def events(self):
+        client = self.context.long_poll_api.api_client
+        headers = {'Accept': 'text/event-stream'}
+        if self.cursor.value:
+            headers['Last-Event-ID'] = self.cursor.value
+
+        response = client.call_api(
+            self.STREAM_PATH, 'GET',
+            path_params={'uuid': self.context.identity.uuid},
+            header_params=headers,
+            auth_settings=list(client.configuration.auth_settings()),
+            _preload_content=False,
+            _return_http_data_only=True,
+        )
+        try:
+            event_id, data = None, []
+            for line in _lines(response):
+                if not line:
+                    if data:
+                        yield event_id, '\n'.join(data)
+                    event_id, data = None, []
+                elif line.startswith(':'):
+                    continue
+                else:
+                    field, _, value = line.partition(':')
+                    value = value[1:] if value.startswith(' ') else value
+                    if field == 'id':
+                        event_id = value
+                    elif field == 'data':
+                        data.append(value)
+        finally:
+            response.release_conn()
+
+    def receive(self):
+        # Yields commands as they arrive; returns when the server closes the stream
+        for event_id, data in self.events():
+            yield Command(event_id, data, event_id)
+
+
+def _lines(response):
+    # read1 returns whatever arrived instead of waiting for a full chunk
+    read = getattr(response, 'read1', None)
+    buffer = b''
+    for chunk in iter(lambda: read(1024), b'') if read else response.stream(1024):
+        buffer += chunk
+        while b'\n' in buffer:
+            line, buffer = buffer.split(b'\n', 1)
+            yield line.rstrip(b'\r').decode('utf-8')
@@ -0,0 +1,169 @@
+import os
+from collections import namedtuple
+from threading import Thread, Lock
+from time import sleep
+import yaml
+from loguru import logger
+from .signature_schemes import KeyType
+
+
+class ConfigKey:
+    def __init__(self, kind, default=None, required=False, remote=True, choices=None, minimum=None, restart=False):
+        self.kind = kind
+        self.default = default
+        self.required = required
+        # Whether the backend may change it through GetMachineConfig
+        self.remote = remote
+        self.choices = choices
+        self.minimum = minimum
+        # Read once on start-up, a change is stored but only takes effect after a restart
+        self.restart = restart
+
+    def validate(self, name, value):
+        if value is None:
+            if self.required:
+                raise ValueError(f"{name} is required")
+            return self.default
+        if self.kind is float and isinstance(value, int) and not isinstance(value, bool):
+            value = float(value)
+        if not isinstance(value, self.kind) or (self.kind is int and isinstance(value, bool)):
+            raise ValueError(f"{name} must be {self.kind.__name__}, not {type(value).__name__}")
+        if self.choices is not None and value not in self.choices:
+            raise ValueError(f"{name} must be one of {', '.join(map(str, self.choices))}, not {value}")
+        if self.minimum is not None and value < self.minimum:
+            raise ValueError(f"{name} must be at least {self.minimum}, not {value}")
+        return value
+
+
+SCHEMA = {
+    'api_key': ConfigKey(str, required=True, remote=False, restart=True),
+    'uuid': ConfigKey(str, required=True, remote=False, restart=True),
+    'key_type': ConfigKey(str, default='rsa', remote=False, choices=[key_type.value for key_type in KeyType]),
+    'host': ConfigKey(str, default='/'),
+    'batch_signing': ConfigKey(bool, default=False, restart=True),
+    'runtime': ConfigKey(str, default='threads', remote=False, choices=['threads', 'asyncio'], restart=True),
+    'trace': ConfigKey(bool, default=False, remote=False, restart=True),
+    'log_level': ConfigKey(str, default='INFO'),
+    'api_workers': ConfigKey(int, default=3, minimum=1, restart=True),
+    'compress_requests': ConfigKey(bool, default=False, restart=True),
+    'command_stream': ConfigKey(bool, default=False, restart=True),
+    'status_interval': ConfigKey(float, default=60.0),
+    'coin_pulse_clearance': ConfigKey(float, default=1.4),
+    'note_pulse_clearance': ConfigKey(float, default=1.6),
+    'nfc_debounce': ConfigKey(float, default=2.0),
+}
+
+ConfigSnapshot = namedtuple('ConfigSnapshot', SCHEMA)
+
+
+class ConfigStore:
+    """
+    The single owner of machine.config.yaml. Readers take ``snapshot``, an
+    immutable tuple that is swapped as a whole, so reading needs no lock.
+    """
+
+    MACHINE_CONFIG_FILE = os.environ.get('MACHINE_CONFIG_FILE', '../machine.config.yaml')
+    _shared = None
+    _shared_lock = Lock()
+
+    def __init__(self, path=None, poll_interval=2.0):
+        self.path = path or ConfigStore.MACHINE_CONFIG_FILE
+        self.poll_interval = poll_interval
+        self.lock = Lock()
+        self.subscribers = []
+
+        if not os.path.isfile(self.path):
+            raise RuntimeError("No configuration detected")
+        self._raw, self.snapshot = self._load()
+        self._mtime = os.stat(self.path).st_mtime_ns
+        self._watcher = None
+
+    @classmethod
+    def shared(cls):
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def _load(self):
+        with open(self.path) as config_file:
+            raw = yaml.safe_load(config_file) or {}
+        return raw, self._validate(raw)
+
+    @staticmethod
+    def _validate(raw):
+        return ConfigSnapshot(**{name: key.validate(name, raw.get(name)) for name, key in SCHEMA.items()})
+
+    def _write(self, raw):
+        tmp_file = self.path + '.tmp'
+        with open(tmp_file, 'w') as config_file:
+            config_file.write(yaml.safe_dump(raw))
+            config_file.flush()
+            os.fsync(config_file.fileno())
+        os.replace(tmp_file, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def _publish(self, snapshot):
+        for name, key in SCHEMA.items():
+            if key.restart and getattr(snapshot, name) != getattr(self.snapshot, name):
+                logger.warning(f"{name} changed, the new value takes effect after a restart")
+        self.snapshot = snapshot
+        for subscriber in list(self.subscribers):
+            subscriber(snapshot)
+
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+        subscriber(self.snapshot)
+
+    def update(self, values: dict):
+        with self.lock:
+            # Keys outside the schema are kept as they are, so nothing else in the file is lost
+            raw = dict(self._raw, **values)
+            snapshot = self._validate(raw)
+            self._write(raw)
+            self._raw = raw
+        self._publish(snapshot)
+
+    def apply_remote(self, values: dict):
+        # A bad value from the backend costs only its own key, the others still apply
+        allowed = {}
+        for name, value in values.items():
+            if name not in SCHEMA or not SCHEMA[name].remote:
+                continue
+            try:
+                SCHEMA[name].validate(name, value)
+            except ValueError as e:
+                logger.warning(f"Ignoring {name} from the backend: {e}")
+                continue
+            allowed[name] = value
+        if allowed:
+            self.update(allowed)
+
+    def reload(self):
+        with self.lock:
+            try:
+                raw, snapshot = self._load()
+            except (OSError, ValueError, yaml.YAMLError) as e:
+                logger.warning(f"Keeping the current configuration, {self.path} is invalid: {e}")
+                return
+            self._raw = raw
+        self._publish(snapshot)
+
+    def check(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self._mtime = mtime
+            self.reload()
+
+    def watch(self):
+        def handler():
+            while True:
+                sleep(self.poll_interval)
+                self.check()
+
+        if self._watcher is None:
+            self._watcher = Thread(target=handler, daemon=True)
+            self._watcher.start()
@@ -0,0 +1,177 @@
+import json
+import mmap
+import os
+import struct
+from collections import namedtuple
+from threading import Lock
+from loguru import logger
+
+Fare = namedtuple('Fare', ['product_id', 'fare_class', 'name', 'price'])
+
+
+class FareCatalog:
+    """
+    Fares kept in a small binary file that is mapped on startup, so a ticket is
+    quoted without asking the backend and quoting keeps working offline.
+
+    The file is a header, then fixed-size fare records, then the UTF-8 names the
+    records point into. Updates arrive as deltas against a catalog version and
+    are written to a new file that replaces the old one.
+    """
+
+    CATALOG_FILE = '../fare_catalog.bin'
+    MAGIC = b'FTXC'
+    FORMAT = 1
+    HEADER = struct.Struct('<4sHIII')
+    RECORD = struct.Struct('<IHIII')
+    DELTA_COMMAND = 'CATALOG_DELTA'
+    UINT16 = 0xFFFF
+    UINT32 = 0xFFFFFFFF
+
+    def __init__(self, path=None):
+        self.path = path or FareCatalog.CATALOG_FILE
+        self.lock = Lock()
+        self.version = 0
+        self.needs_full = False
+        # Called whenever a full catalog becomes necessary, so that one is fetched
+        self.on_needs_full = None
+        self.quotes = {}
+        self.menu = ()
+
+        if os.path.isfile(self.path):
+            try:
+                self._map()
+            except (ValueError, struct.error):
+                # A catalog from an older format or a damaged one is dropped and fetched again as a whole
+                self.version, self.quotes, self.menu = 0, {}, ()
+
+    def _map(self):
+        with open(self.path, 'rb') as catalog_file:
+            with mmap.mmap(catalog_file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                magic, fmt, version, count, strings_size = self.HEADER.unpack_from(view, 0)
+                if magic != self.MAGIC or fmt != self.FORMAT:
+                    raise ValueError(f"{self.path} is not a fare catalog")
+
+                records_start = self.HEADER.size
+                strings_start = records_start + count * self.RECORD.size
+                if len(view) < strings_start + strings_size:
+                    raise ValueError(f"{self.path} is truncated")
+
+                fares = []
+                for product_id, fare_class, price, offset, length in self.RECORD.iter_unpack(
+                        view[records_start:strings_start]
+                ):
+                    name = view[strings_start + offset:strings_start + offset + length].decode('utf-8')
+                    fares.append(Fare(product_id, fare_class, name, price))
+
+        self._publish(version, fares)
+
+    def _publish(self, version, fares):
+        # The frontend reads these without locking, so they are replaced, never changed
+        self.quotes = {(fare.product_id, fare.fare_class): fare.price for fare in fares}
+        self.menu = tuple(sorted(fares))
+        self.version = version
+
+    def _write(self, version, fares):
+        strings = bytearray()
+        records = bytearray()
+        for fare in sorted(fares):
+            name = fare.name.encode('utf-8')
+            records += self.RECORD.pack(fare.product_id, fare.fare_class, fare.price, len(strings), len(name))
+            strings += name
+
+        tmp_file = self.path + '.tmp'
+        with open(tmp_file, 'wb') as catalog_file:
+            catalog_file.write(self.HEADER.pack(self.MAGIC, self.FORMAT, version, len(fares), len(strings)))
+            catalog_file.write(records)
+            catalog_file.write(strings)
+            catalog_file.flush()
+            os.fsync(catalog_file.fileno())
+        os.replace(tmp_file, self.path)
+
+    @property
+    def sync_version(self):
+        # The version the backend should send a delta against, 0 asks for everything
+        return 0 if self.needs_full else self.version
+
+    @classmethod
+    def _checked(cls, field, value, limit):
+        # The record format has no room for anything else, and a bool is no product id
+        if not isinstance(value, int) or isinstance(value, bool) or not 0 <= value <= limit:
+            raise ValueError(f"{field} {value!r} does not fit a catalog record")
+        return value
+
+    @classmethod
+    def _fare(cls, fare: dict):
+        name = fare['name']
+        if not isinstance(name, str):
+            raise TypeError(f"name {name!r} is not a string")
+        return Fare(
+            cls._checked('product_id', fare['product_id'], cls.UINT32),
+            cls._checked('fare_class', fare.get('fare_class', 0), cls.UINT16),
+            name,
+            cls._checked('price', fare['price'], cls.UINT32),
+        )
+
+    def quote(self, product_id, fare_class=0):
+        return self.quotes.get((product_id, fare_class))
+
+    def apply_delta(self, delta: dict):
+        """
+        Applies ``{'version', 'base_version', 'upsert': [...], 'remove': [...]}``.
+        A delta without base_version is a full catalog. Returns False when the delta
+        does not start from the local version, in which case a full catalog is needed.
+        """
+        with self.lock:
+            version = self._checked('version', delta['version'], self.UINT32)
+            if version <= self.version:
+                return True
+
+            base_version = delta.get('base_version')
+            if base_version is None:
+                fares = {}
+            elif base_version == self.version:
+                fares = {(fare.product_id, fare.fare_class): fare for fare in self.menu}
+            else:
+                self.request_full()
+                return False
+
+            # Every fare is checked before anything is written, a bad one rejects the whole delta
+            for product_id, fare_class in delta.get('remove', ()):
+                fares.pop((product_id, fare_class), None)
+            for fare in map(self._fare, delta.get('upsert', ())):
+                fares[(fare.product_id, fare.fare_class)] = fare
+
+            self._write(version, fares.values())
+            self._publish(version, list(fares.values()))
+            self.needs_full = False
+            return True
+
+    def request_full(self):
+        self.needs_full = True
+        if self.on_needs_full is not None:
+            self.on_needs_full()
+
+    def update(self, delta):
+        # A malformed delta is dropped; it leaves a gap, so the whole catalog is fetched instead
+        try:
+            return self.apply_delta(delta)
+        except (KeyError, TypeError, ValueError, AttributeError, struct.error) as e:
+            logger.warning(f"Dropping a malformed catalog delta: {e!r}")
+            self.request_full()
+            return False
+
+    def handle_command(self, command):
+        # Deltas pushed over the command channel look like "CATALOG_DELTA <json>"
+        if isinstance(command, bytes):
+            command = command.decode('utf-8', errors='replace')
+        if not isinstance(command, str) or not command.startswith(self.DELTA_COMMAND + ' '):
+            return False
+        try:
+            delta = json.loads(command[len(self.DELTA_COMMAND) + 1:])
+        except ValueError as e:
+            logger.warning(f"Dropping a malformed catalog delta: {e!r}")
+            self.request_full()
+            return True
+        self.update(delta)
+        return True
@@ -0,0 +1,113 @@
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from threading import Condition
+from gpiozero.pins.mock import MockFactory
+from gpiozero import Device, Button, OutputDevice
+from pins import Pins
+import os
+
+# Set the default pin factory to a mock factory, if in testing environment
+if os.environ.get('TESTING_ENVIRONMENT', None):
+    Device.pin_factory = MockFactory()
+
+
+class HopperState(Enum):
+    READY = "READY"
+    DISPENSING = "DISPENSING"
+    STALLED = "STALLED"
+
+
+class Hopper:
+    def __init__(self, denomination, motor: OutputDevice, sensor: Button, jam_timeout=1.0, run_on=0.15):
+        self.denomination = denomination
+        self.motor = motor
+        self.sensor = sensor
+        self.jam_timeout = jam_timeout
+        self.run_on = run_on
+        self.state = HopperState.READY
+
+        self._coins = 0
+        self._stray = 0
+        self._coin_passed = Condition()
+
+        self.motor.off()
+        self.sensor.when_pressed = self.coin_passed
+
+    def coin_passed(self):
+        with self._coin_passed:
+            if self.state == HopperState.DISPENSING:
+                self._coins += 1
+            else:
+                self._stray += 1
+            self._coin_passed.notify()
+
+    def take_stray(self):
+        # Coins that came out while no payout was running, still gone from the stock
+        with self._coin_passed:
+            stray, self._stray = self._stray, 0
+            return stray
+
+    def dispense(self, count):
+        # Runs the motor until the sensor confirmed count coins, or until no coin
+        # came out within jam_timeout, which is what a jammed or empty hopper looks like.
+        with self._coin_passed:
+            self._coins = 0
+            self.state = HopperState.DISPENSING
+            stalled = False
+            self.motor.on()
+            try:
+                while self._coins < count:
+                    seen = self._coins
+                    if not self._coin_passed.wait_for(lambda: self._coins > seen, timeout=self.jam_timeout):
+                        stalled = True
+                        break
+            finally:
+                self.motor.off()
+                # A coin the disc already pushed out still drops after the motor stops
+                seen = None
+                while seen != self._coins:
+                    seen = self._coins
+                    self._coin_passed.wait_for(lambda: self._coins > seen, timeout=self.run_on)
+                self.state = HopperState.STALLED if stalled else HopperState.READY
+            return self._coins
+
+
+class PayoutScheduler:
+    def __init__(self, hoppers):
+        self.hoppers = {hopper.denomination: hopper for hopper in hoppers}
+        self.executor = ThreadPoolExecutor(max_workers=len(self.hoppers), thread_name_prefix='hopper')
+
+    def dispense(self, change_box, amount):
+        for denomination, hopper in self.hoppers.items():
+            stray = hopper.take_stray()
+            if stray:
+                change_box.dispensed(denomination, stray)
+
+        remaining = amount
+        while remaining > 0:
+            payout = change_box.plan(remaining)
+            if not payout:
+                break
+
+            jobs = {
+                denomination: self.executor.submit(self.hoppers[denomination].dispense, count)
+                for denomination, count in payout.items() if count
+            }
+            for denomination, job in jobs.items():
+                dispensed = job.result()
+                change_box.dispensed(denomination, dispensed)
+                remaining -= dispensed * denomination
+                if self.hoppers[denomination].state == HopperState.STALLED:
+                    # Leave it out of the next plan until it is refilled or cleared
+                    change_box.stalled(denomination)
+        return remaining
+
+
+def default_hoppers(jam_timeout=1.0):
+    return [
+        Hopper(10, OutputDevice(Pins.HOPPER_10_MOTOR), Button(Pins.HOPPER_10_SENSOR), jam_timeout),
+        Hopper(20, OutputDevice(Pins.HOPPER_20_MOTOR), Button(Pins.HOPPER_20_SENSOR), jam_timeout),
+        Hopper(50, OutputDevice(Pins.HOPPER_50_MOTOR), Button(Pins.HOPPER_50_SENSOR), jam_timeout),
+        Hopper(100, OutputDevice(Pins.HOPPER_100_MOTOR), Button(Pins.HOPPER_100_SENSOR), jam_timeout),
+        Hopper(200, OutputDevice(Pins.HOPPER_200_MOTOR), Button(Pins.HOPPER_200_SENSOR), jam_timeout),
+    ]
@@ -0,0 +1,198 @@
+import glob
+import gzip
+import json
+import os
+import shutil
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from threading import Thread, Event
+from time import monotonic, time
+from loguru import logger
+
+
+class Throttle:
+    """
+    Lets a hot path log at most once per ``interval`` seconds. ``allow`` returns
+    how many messages were held back since the last one, or None to skip this one.
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.next = 0.0
+        self.suppressed = 0
+
+    def allow(self):
+        now = monotonic()
+        if now < self.next:
+            self.suppressed += 1
+            return None
+        self.next = now + self.interval
+        suppressed, self.suppressed = self.suppressed, 0
+        return suppressed
+
+
+class LogSink(Thread):
+    """
+    A loguru sink whose ``enqueue`` only appends the record to a bounded buffer; formatting
+    and writing happen on this thread, so logging costs a thread that sells a
+    ticket next to nothing and never waits on the SD card. When the buffer is
+    full, records below ERROR are dropped and counted instead; ERROR records
+    have ``error_reserve`` more slots before they are dropped too. A failing
+    write is logged and retried, the lines it could not write are kept.
+
+    Records are written as JSON lines, with what was bound to the logger
+    (controller, transaction) as fields. The file is appended to across
+    restarts and rotated when it reaches ``max_bytes`` or when a
+    ``rotate_every`` period (UTC aligned) ends. Rotated files are gzipped on a
+    thread of their own and the oldest removed beyond ``backups``.
+    """
+
+    LOG_FILE = os.environ.get('LOG_FILE', '../vending_machine.log')
+    ERROR = 40
+
+    def __init__(
+            self, path=None, max_bytes=5 * 2 ** 20, rotate_every=86400.0, backups=14,
+            buffer_size=10000, error_reserve=1000, flush_interval=1.0
+    ):
+        self.path = path or LogSink.LOG_FILE
+        self.max_bytes = max_bytes
+        self.rotate_every = rotate_every
+        self.backups = backups
+        self.buffer_size = buffer_size
+        self.error_reserve = error_reserve
+        self.flush_interval = flush_interval
+
+        self.records = deque()
+        self.lines = []
+        self.dropped = 0
+        self.failures = Throttle(60.0)
+        self.compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='log-gzip')
+        self.wakeup = Event()
+        self.handler_id = None
+        self.file = None
+        self.period = None
+
+        super(LogSink, self).__init__(target=self.handler, daemon=True)
+
+    def enqueue(self, message):
+        record = message.record
+        if record['level'].no >= self.ERROR and len(self.records) < self.buffer_size + self.error_reserve:
+            # Worth writing now, the process may be about to go down
+            self.records.append(record)
+            self.wakeup.set()
+        elif len(self.records) < self.buffer_size:
+            self.records.append(record)
+        else:
+            self.dropped += 1
+
+    def install(self, level='INFO'):
+        # loguru filters by level before the message is even formatted; a new level replaces the handler
+        handler_id = logger.add(self.enqueue, level=level, format='{message}')
+        if self.handler_id is not None:
+            logger.remove(self.handler_id)
+        self.handler_id = handler_id
+
+    def apply_config(self, snapshot):
+        try:
+            self.install(snapshot.log_level)
+        except ValueError:
+            logger.warning(f"Unknown log_level {snapshot.log_level}, keeping the current one")
+
+    @staticmethod
+    def format(record):
+        entry = {
+            'time': record['time'].isoformat(),
+            'level': record['level'].name,
+            'message': record['message'],
+            'module': record['name'],
+            'line': record['line'],
+            'thread': record['thread'].name,
+        }
+        entry.update(record['extra'])
+        if record['exception'] is not None:
+            entry['exception'] = ''.join(traceback.format_exception(*record['exception']))
+        return json.dumps(entry, default=str)
+
+    def _period(self, at):
+        return int(at // self.rotate_every)
+
+    def _open(self):
+        if os.path.isfile(self.path) and self._period(os.stat(self.path).st_mtime) != self._period(time()):
+            # Left over from an earlier period, by a previous run
+            self.rotate()
+        self.file = open(self.path, 'a')
+        self.period = self._period(time())
+
+    def rotate(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        rotated = f"{self.path}.{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S-%f')}"
+        os.replace(self.path, rotated)
+        # Compressing a full file takes seconds on the SD card, records keep being written meanwhile
+        self.compressor.submit(self.compress, rotated)
+
+    def compress(self, rotated):
+        try:
+            with open(rotated, 'rb') as source, gzip.open(rotated + '.gz', 'wb') as target:
+                shutil.copyfileobj(source, target)
+            os.remove(rotated)
+            for old in sorted(glob.glob(glob.escape(self.path) + '.*.gz'))[:-self.backups]:
+                os.remove(old)
+        except OSError as e:
+            logger.warning(f"Could not compress {rotated}: {e}")
+
+    def write(self):
+        while self.records:
+            self.lines.append(self.format(self.records.popleft()))
+        if self.file is None:
+            self._open()
+        lines, dropped = self.lines, self.dropped
+        if dropped:
+            lines = lines + [json.dumps({
+                'time': datetime.now(timezone.utc).isoformat(),
+                'level': 'WARNING',
+                'message': f"{dropped} log records dropped, buffer full",
+            })]
+        if lines:
+            self.file.write('\n'.join(lines) + '\n')
+            self.file.flush()
+            self.lines = []
+            self.dropped -= dropped
+
+        if self.file.tell() >= self.max_bytes or self._period(time()) != self.period:
+            self.rotate()
+            self._open()
+
+    def handler(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.write()
+            except OSError as e:
+                self.failed(e)
+
+    def failed(self, error):
+        # A full or pulled SD card: reopen on the next attempt, keep no more lines than the buffer holds
+        if self.file is not None:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+            self.file = None
+        if len(self.lines) > self.buffer_size:
+            self.dropped += len(self.lines) - self.buffer_size
+            del self.lines[:-self.buffer_size]
+        suppressed = self.failures.allow()
+        if suppressed is not None:
+            logger.bind(suppressed=suppressed).warning(f"Could not write {self.path}: {error}")
+
+    def close(self):
+        if self.handler_id is not None:
+            logger.remove(self.handler_id)
+            self.handler_id = None
+        self.write()
+        self.compressor.shutdown(wait=True)
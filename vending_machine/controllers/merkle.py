@@ -0,0 +1,54 @@
+import json
+from hashlib import sha256
+
+# Domain separation between leaves and inner nodes, as in RFC 6962
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+
+def canonical_json(data) -> bytes:
+    return json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def leaf_hash(data: bytes) -> bytes:
+    return sha256(LEAF_PREFIX + data).digest()
+
+
+def node_hash(left: bytes, right: bytes) -> bytes:
+    return sha256(NODE_PREFIX + left + right).digest()
+
+
+class MerkleTree:
+    def __init__(self, leaves):
+        self.levels = [[leaf_hash(leaf) for leaf in leaves]]
+        if not self.levels[0]:
+            raise ValueError("A Merkle tree needs at least one leaf")
+
+        while len(self.levels[-1]) > 1:
+            level = self.levels[-1]
+            # An unpaired last node is carried up as is instead of being hashed with itself
+            self.levels.append([
+                node_hash(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+                for i in range(0, len(level), 2)
+            ])
+
+    @property
+    def root(self) -> bytes:
+        return self.levels[-1][0]
+
+    def proof(self, index):
+        path = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling < len(level):
+                path.append(('L' if sibling < index else 'R', level[sibling].hex()))
+            index //= 2
+        return path
+
+
+def verify_proof(data: bytes, proof, root: bytes) -> bool:
+    digest = leaf_hash(data)
+    for side, sibling in proof:
+        sibling = bytes.fromhex(sibling)
+        digest = node_hash(sibling, digest) if side == 'L' else node_hash(digest, sibling)
+    return digest == root
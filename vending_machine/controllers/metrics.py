@@ -0,0 +1,162 @@
+import json
+import os
+from array import array
+from queue import Queue
+from threading import Thread, Lock
+from time import monotonic, sleep
+from loguru import logger
+from .clock import clock
+
+
+class Histogram:
+    """
+    Log-linear buckets in the style of HdrHistogram. Values are kept in
+    microseconds with two significant digits, from 1 us up to ``highest``
+    seconds, in a fixed array, so recording never allocates.
+    """
+
+    SUB_BITS = 8
+
+    def __init__(self, highest=120.0):
+        self.sub_count = 1 << self.SUB_BITS
+        self.half = self.sub_count >> 1
+        self.highest = int(highest * 1e6)
+        self.counts = array('Q', [0]) * (self._index(self.highest) + 1)
+        self.lock = Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def _index(self, value):
+        shift = max(0, value.bit_length() - self.SUB_BITS)
+        return shift * self.half + (value >> shift)
+
+    def _value(self, index):
+        if index < self.sub_count:
+            return index
+        shift = (index - self.sub_count) // self.half + 1
+        # The middle of the bucket
+        return ((index - shift * self.half) << shift) + (1 << (shift - 1))
+
+    def record(self, seconds):
+        index = self._index(min(self.highest, max(0, int(seconds * 1e6))))
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, percent):
+        with self.lock:
+            if not self.count:
+                return 0.0
+            rank = max(1, round(self.count * percent / 100))
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank:
+                    return min(self._value(index) / 1e6, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class Span:
+    __slots__ = ('metrics', 'name', 'started')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, monotonic() - self.started)
+
+
+class Metrics:
+    def __init__(self):
+        self.histograms = {}
+        self.lock = Lock()
+
+    def histogram(self, name) -> Histogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def record(self, name, seconds):
+        self.histogram(name).record(seconds)
+
+    def since(self, name, started):
+        self.histogram(name).record(clock.monotonic() - started)
+
+    def span(self, name):
+        return Span(self, name)
+
+    def snapshot(self):
+        return {name: histogram.to_dict() for name, histogram in sorted(self.histograms.items())}
+
+    def summary(self):
+        # What PatchStatus carries: p50/p99 in milliseconds, enough to compare machines
+        return {
+            name: [round(values['p50'] * 1000, 2), round(values['p99'] * 1000, 2), values['count']]
+            for name, values in self.snapshot().items() if values['count']
+        }
+
+
+metrics = Metrics()
+
+
+class TimedQueue(Queue):
+    """A Queue that records in ``wait`` how long each item sat in it before it was taken."""
+
+    def __init__(self, name, maxsize=0):
+        super(TimedQueue, self).__init__(maxsize)
+        self.wait = metrics.histogram(name)
+
+    def _put(self, item):
+        self.queue.append((clock.monotonic(), item))
+
+    def _get(self):
+        enqueued, item = self.queue.popleft()
+        self.wait.record(clock.monotonic() - enqueued)
+        return item
+
+
+class MetricsExporter(Thread):
+    METRICS_FILE = '../metrics.json'
+
+    def __init__(self, registry: Metrics = None, path=None, interval=60.0):
+        self.registry = registry or metrics
+        self.path = path or MetricsExporter.METRICS_FILE
+        self.interval = interval
+
+        super(MetricsExporter, self).__init__(target=self.handler, daemon=True)
+
+    def export(self):
+        # A full disk or an odd value must not stop the exports that follow
+        tmp_file = self.path + '.tmp'
+        try:
+            with open(tmp_file, 'w') as metrics_file:
+                json.dump(self.registry.snapshot(), metrics_file, indent=1)
+            os.replace(tmp_file, self.path)
+        except Exception as e:
+            logger.warning(f"Could not export metrics to {self.path}: {e!r}")
+
+    def handler(self):
+        while True:
+            sleep(self.interval)
+            self.export()
@@ -1,11 +1,17 @@
+from collections import OrderedDict
 from enum import IntEnum
-from threading import Thread, RLock
+from threading import Thread, RLock, Event
 from gpiozero.pins.mock import MockFactory
 from gpiozero import Device
 import os
-from queue import Queue
+from .signal_bus import SignalBus, TagDetected
+from .view_model import ViewModel
+from .metrics import metrics, TimedQueue
+from .clock import clock
+from .log_sink import Throttle
 from uuid import UUID
 from time import sleep
+from loguru import logger
 
 # Set the default pin factory to a mock factory, if in testing environment
 if os.environ.get('TESTING_ENVIRONMENT', None):
@@ -13,39 +19,93 @@ if os.environ.get('TESTING_ENVIRONMENT', None):
 
 
     class SimpleMFRC522:
-        pass
+        def read_id_no_block(self):
+            return None
+
+        def read_no_block(self):
+            return None, None
 else:
     from mfrc522 import SimpleMFRC522
 
+log = logger.bind(controller='nfc')
+
 
 class NFCController(Thread):
     class Tasks(IntEnum):
         READ_TAG = 0b01
         STOP_READING = 0b10
 
-    def __init__(self, report_to: Queue, *args, **kwargs):
+    def __init__(self, report_to: SignalBus, *args, debounce=2.0, recent_tags=8, view: ViewModel = None, **kwargs):
         self.tag_lock = RLock()
         self.last_read_tag = None
         self.results = report_to
-        self.tasks = Queue()
+        self.view = view or ViewModel()
+        self.tasks = TimedQueue('queue.tasks.nfc')
         self.last_task = None
+        self.on_task = None
+        self.reading = Event()
         self.reader = NFCReader(controller=self)
-        self.read_tags = False
+
+        self.debounce = debounce
+        self.recent_tags = recent_tags
+        self.recent = OrderedDict()
 
         super().__init__(target=self.handler)
 
+    @property
+    def read_tags(self):
+        return self.reading.is_set()
+
+    def tag_read(self, tag):
+        # Called from the reader thread; the controller thread does the filtering
+        if self.reading.is_set():
+            self.tasks.put(tag)
+
     def handler(self):
         while True:
-            if self.tasks.not_empty:
-                self.last_task = self.tasks.get()
-            if self.last_task:
-                if self.last_task == NFCController.Tasks.READ_TAG:
-                    self.read_tags = True
-                    if self.last_read_tag:
-                        self.results.put(self.last_read_tag)
-                elif self.last_task == NFCController.Tasks.STOP_READING:
-                    self.read_tags = False
-                    self.last_read_tag = None
+            self.handle(self.tasks.get())
+
+    def handle(self, task):
+        if self.on_task is not None:
+            self.on_task(task)
+        if isinstance(task, NFCTag):
+            self.on_tag(task)
+            return
+
+        self.last_task = task
+        if task == NFCController.Tasks.READ_TAG:
+            with self.tag_lock:
+                self.last_read_tag = None
+                self.recent.clear()
+            self.reader.wake()
+            self.reading.set()
+            self.view.update(nfc='READING', tag=None)
+        elif task == NFCController.Tasks.STOP_READING:
+            self.reading.clear()
+            with self.tag_lock:
+                self.last_read_tag = None
+            self.view.update(nfc='IDLE', tag=None)
+
+    def on_tag(self, tag):
+        if not self.reading.is_set():
+            return
+
+        now = clock.monotonic()
+        with self.tag_lock:
+            last_seen = self.recent.pop(tag.id, None)
+            self.recent[tag.id] = now
+            if len(self.recent) > self.recent_tags:
+                self.recent.popitem(last=False)
+
+            # A tag that stays on the reader keeps refreshing last_seen, so it is one tap
+            if last_seen is not None and now - last_seen < self.debounce:
+                return
+            self.last_read_tag = tag
+
+        self.results.publish(TagDetected(tag))
+        self.view.update(nfc='DETECTED', tag=str(tag.id))
+        metrics.since('nfc.tap_to_detected', tag.seen)
+        log.info(f"Tag {tag.id} detected")
 
     def start_all(self):
         self.reader.start()
@@ -53,36 +113,98 @@ class NFCController(Thread):
 
 
 class NFCTag:
-    def __init__(self, _id, data):
+    def __init__(self, _id, data, seen=None):
         self.id = _id
         self.data = data
+        self.seen = clock.monotonic() if seen is None else seen
+        self._uuid = self._parse_uuid(data)
 
-    def is_valid(self):
+    @staticmethod
+    def _parse_uuid(data):
         try:
-            uuid = UUID(self.data)
+            uuid = UUID(data.strip())
             assert uuid.version == 4
-        except AssertionError or ValueError as e:
-            return False
+        except (AssertionError, AttributeError, ValueError):
+            return None
         else:
-            return True
+            return uuid
+
+    def is_valid(self):
+        return self._uuid is not None
 
     def get_uuid(self):
-        if self.is_valid():
-            return UUID(self.data)
-        else:
-            return None
+        return self._uuid
 
 
 class NFCReader(Thread):
-    def __init__(self, controller: NFCController):
+    def __init__(
+            self, controller: NFCController,
+            min_interval=0.03, max_interval=0.15, backoff=1.25, data_ttl=30.0, cached_tags=8
+    ):
         self.rfc_reader = SimpleMFRC522()
         self.parent = controller
+
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.last_uid = None
+
+        self.data_ttl = data_ttl
+        self.cached_tags = cached_tags
+        self.tag_data = OrderedDict()
+        self.debug_log = Throttle()
+
         super().__init__(target=self.handler)
 
+    def wake(self):
+        self.interval = self.min_interval
+        self.last_uid = None
+
+    def cached_data(self, uid, now):
+        entry = self.tag_data.get(uid)
+        if entry is None or now - entry[0] > self.data_ttl:
+            return None
+        self.tag_data.move_to_end(uid)
+        return entry[1]
+
+    def remember(self, uid, data, now):
+        self.tag_data[uid] = (now, data)
+        self.tag_data.move_to_end(uid)
+        if len(self.tag_data) > self.cached_tags:
+            self.tag_data.popitem(last=False)
+
+    def poll(self):
+        # A UID-only probe is much cheaper than reading the data sectors, so only
+        # read those for cards that were not on the reader recently.
+        probed = clock.monotonic()
+        uid = self.rfc_reader.read_id_no_block()
+        if uid is None or uid == self.last_uid:
+            self.last_uid = uid
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+            if uid is None:
+                return self.interval
+
+        now = clock.monotonic()
+        data = self.cached_data(uid, now)
+        if data is None:
+            _id, data = self.rfc_reader.read_no_block()
+            if _id != uid:
+                return self.interval
+            self.remember(uid, data, now)
+            suppressed = self.debug_log.allow()
+            if suppressed is not None:
+                log.bind(suppressed=suppressed).debug(f"Read the data of tag {uid}")
+
+        if uid != self.last_uid:
+            self.last_uid = uid
+            self.interval = self.min_interval
+        self.parent.tag_read(NFCTag(uid, data, seen=probed))
+        return self.interval
+
     def handler(self):
         while True:
-            _id, data = self.rfc_reader.read()
-            with self.parent.tag_lock:
-                if self.parent.read_tags:
-                    self.parent.last_read_tag = NFCTag(_id, data)
-            sleep(1)
+            if not self.parent.reading.is_set():
+                self.parent.reading.wait()
+                self.wake()
+            sleep(self.poll())
@@ -0,0 +1,242 @@
+import json
+import sqlite3
+from concurrent.futures import Future, wait
+from threading import Thread, Lock, Event
+from time import time, sleep
+from swagger_client.rest import ApiException
+from .request_scheduler import CircuitBreaker
+
+
+def _json_default(value):
+    if isinstance(value, bytes):
+        return value.decode('ascii')
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class Outbox:
+    OUTBOX_FILE = '../outbox.sqlite3'
+
+    def __init__(self, requests: dict, path=None):
+        self.requests = requests
+        self.lock = Lock()
+        self.db = sqlite3.connect(path or Outbox.OUTBOX_FILE, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " idempotency_key TEXT PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " args TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " dead INTEGER NOT NULL DEFAULT 0,"
+            " signed INTEGER NOT NULL DEFAULT 1"
+            ")"
+        )
+        if 'signed' not in [column[1] for column in self.db.execute("PRAGMA table_info(outbox)")]:
+            self.db.execute("ALTER TABLE outbox ADD COLUMN signed INTEGER NOT NULL DEFAULT 1")
+
+    def _insert(self, request, created):
+        # In batch signing mode a record is committed before it is signed, and signed in place
+        signed = request.signed_data is not None
+        self.db.execute(
+            "INSERT OR IGNORE INTO outbox (idempotency_key, kind, payload, args, created, signed)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                request.idempotency_key,
+                type(request).__name__,
+                json.dumps(request.signed_data if signed else request.data, default=_json_default),
+                json.dumps(request.outbox_args()),
+                created,
+                int(signed),
+            )
+        )
+
+    def add(self, request):
+        with self.lock:
+            self._insert(request, time())
+
+    def replace(self, keys, request):
+        # The merged record takes the place of the newest one it replaces, so it
+        # is still sent before anything that was queued after them
+        with self.lock:
+            self.db.execute("BEGIN")
+            created = self.db.execute(
+                f"SELECT MAX(created) FROM outbox WHERE idempotency_key IN ({', '.join('?' * len(keys))})", keys
+            ).fetchone()[0]
+            self._insert(request, time() if created is None else created)
+            self.db.executemany("DELETE FROM outbox WHERE idempotency_key = ?", [(key,) for key in keys])
+            self.db.execute("COMMIT")
+
+    def signed(self, requests):
+        with self.lock:
+            self.db.execute("BEGIN")
+            self.db.executemany(
+                "UPDATE outbox SET payload = ?, signed = 1 WHERE idempotency_key = ?",
+                [
+                    (json.dumps(request.signed_data, default=_json_default), request.idempotency_key)
+                    for request in requests
+                ]
+            )
+            self.db.execute("COMMIT")
+
+    def _restore(self, context, signed, limit=-1):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT kind, payload, args FROM outbox WHERE dead = 0 AND signed = ? ORDER BY created LIMIT ?",
+                (int(signed), limit)
+            ).fetchall()
+        requests = [
+            self.requests[kind].restore(json.loads(payload), context, **json.loads(args))
+            for kind, payload, args in rows
+        ]
+        if not signed:
+            for request in requests:
+                request.signed_data = None
+        return requests
+
+    def pending(self, context, limit):
+        return self._restore(context, signed=True, limit=limit)
+
+    def unsigned(self, context):
+        # Records committed in batch signing mode that power loss kept from being signed
+        return self._restore(context, signed=False)
+
+    def acknowledge(self, keys):
+        if not keys:
+            return
+        with self.lock:
+            self.db.execute("BEGIN")
+            self.db.executemany("DELETE FROM outbox WHERE idempotency_key = ?", [(key,) for key in keys])
+            self.db.execute("COMMIT")
+
+    def attempted(self, key, dead=False):
+        with self.lock:
+            self.db.execute(
+                "UPDATE outbox SET attempts = attempts + 1, dead = ? WHERE idempotency_key = ?", (int(dead), key)
+            )
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM outbox WHERE dead = 0").fetchone()[0]
+
+
+def _chain(source: Future, targets):
+    def resolve(done):
+        error = done.exception()
+        for target in targets:
+            if error is None:
+                target.set_result(done.result())
+            else:
+                target.set_exception(error)
+    source.add_done_callback(resolve)
+
+
+class OutboxFlusher(Thread):
+    """
+    Hands the outbox to the request workers a batch at a time. The records of
+    a batch are sent in parallel, at their request's priority, and everything
+    the batch settled is booked in one transaction. Status patches that were
+    never sent are merged into one first, the newest value of a field winning.
+    """
+
+    # Statuses that mean resending the same record can never succeed
+    REJECTED = {400, 401, 403, 404, 422}
+    # The backend already holds a record with this idempotency key
+    DUPLICATE = 409
+
+    def __init__(self, controller, outbox: Outbox, batch_size=20):
+        self.controller = controller
+        self.outbox = outbox
+        self.batch_size = batch_size
+        self._wakeup = Event()
+        self._wakeup.set()
+
+        super(OutboxFlusher, self).__init__(target=self.handler)
+
+    def wake(self):
+        self._wakeup.set()
+
+    def coalesce(self, batch):
+        patches = [request for request in batch if type(request).__name__ == 'PatchStatus']
+        if len(patches) < 2:
+            return batch
+
+        fields = {}
+        for patch in patches:
+            fields.update(
+                (field, value) for field, value in patch.data.items()
+                if field not in ('signature', 'batch_signature', 'idempotency_key')
+            )
+        merged = type(patches[0])(fields, context=self.controller.context)
+        if merged.signed_data is None:
+            merged.signed_data = self.controller.context.identity.signed_data(merged.data)
+
+        keys = [patch.idempotency_key for patch in patches]
+        futures = self.controller.outbox_futures
+        waiting = [futures.pop(key) for key in keys if key in futures]
+        futures[merged.idempotency_key] = Future()
+        _chain(futures[merged.idempotency_key], waiting)
+        self.outbox.replace(keys, merged)
+        return [request for request in batch if request not in patches] + [merged]
+
+    def send(self):
+        # The next batch, handed to the request workers; None when the outbox is empty
+        breaker = self.controller.breaker
+        if breaker.state == CircuitBreaker.OPEN and breaker.retry_in():
+            return []
+        batch = self.outbox.pending(self.controller.context, self.batch_size)
+        if not batch:
+            return None
+        batch = self.coalesce(batch)
+        for request in batch:
+            # The caller's future is only settled once the outcome is final
+            request.future = Future()
+            self.controller.tasks.put(request)
+        return batch
+
+    def settle(self, batch):
+        # Books what the batch did; False when the backend could not be reached
+        futures = self.controller.outbox_futures
+        acknowledged = []
+        reached = bool(batch)
+        for request in batch:
+            key = request.idempotency_key
+            error = request.future.exception()
+            if error is None or getattr(error, 'status', None) == self.DUPLICATE:
+                acknowledged.append(key)
+                waiting = futures.pop(key, None)
+                if waiting is not None:
+                    waiting.set_result(None if error is not None else request.future.result())
+            elif isinstance(error, ApiException) and error.status in self.REJECTED:
+                self.outbox.attempted(key, dead=True)
+                waiting = futures.pop(key, None)
+                if waiting is not None:
+                    waiting.set_exception(error)
+            else:
+                self.outbox.attempted(key)
+                reached = False
+        self.outbox.acknowledge(acknowledged)
+
+        # Coalescing shrinks a full batch, so what is left in the outbox decides
+        if reached and len(self.outbox):
+            self.wake()
+        return reached
+
+    def flush(self):
+        batch = self.send()
+        if batch is None:
+            return True
+        wait([request.future for request in batch])
+        return self.settle(batch)
+
+    def handler(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            if self.flush():
+                self.controller.backoff.success(Outbox.__name__)
+            else:
+                sleep(self.controller.backoff.failure(Outbox.__name__))
+                self._wakeup.set()
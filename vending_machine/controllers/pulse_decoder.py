@@ -0,0 +1,128 @@
+from array import array
+from collections import deque
+from .clock import clock
+
+
+class EdgeRingBuffer:
+    """
+    Preallocated single-producer/single-consumer ring of raw edge timestamps.
+
+    The GPIO callback is the only writer and only advances ``_head``; the
+    decoder is the only reader and only advances ``_tail``. Neither side takes
+    a lock, so the callback never waits on the decoder or on the balance.
+    """
+
+    RISING = 1
+    FALLING = 0
+
+    def __init__(self, size=256):
+        self._size = size
+        self._stamps = array('d', [0.0]) * size
+        self._levels = array('b', [0]) * size
+        self._head = 0
+        self._tail = 0
+        self.last_edge = None
+        self.overruns = 0
+        # Sees every edge with its timestamp, for the trace recorder
+        self.on_edge = None
+
+    def _record(self, level):
+        now = clock.monotonic()
+        head = self._head
+        self.last_edge = now
+        if self.on_edge is not None:
+            self.on_edge(now, level)
+        if head - self._tail >= self._size:
+            self.overruns += 1
+            return
+        i = head % self._size
+        self._stamps[i] = now
+        self._levels[i] = level
+        self._head = head + 1
+
+    def rising(self):
+        self._record(self.RISING)
+
+    def falling(self):
+        self._record(self.FALLING)
+
+    def __len__(self):
+        return self._head - self._tail
+
+    def drain(self):
+        head = self._head
+        tail = self._tail
+        while tail < head:
+            i = tail % self._size
+            yield self._stamps[i], self._levels[i]
+            tail += 1
+        self._tail = tail
+
+
+class PulseTrain:
+    def __init__(self, pulses, started, ended):
+        self.pulses = pulses
+        self.started = started
+        self.ended = ended
+
+
+class PulseDecoder:
+    """
+    Turns the raw edges of one acceptor into validated pulses and pulse trains.
+
+    A pulse is a rising edge followed by a falling edge whose width lies within
+    ``min_width`` and ``max_width``; anything else is counted as a glitch. A
+    train is closed once no edge has been seen for ``train_gap`` seconds.
+    """
+
+    def __init__(self, min_width, max_width, train_gap, buffer_size=256, on_train=None):
+        self.edges = EdgeRingBuffer(buffer_size)
+        self.on_train = on_train
+        self.min_width = min_width
+        self.max_width = max_width
+        self.train_gap = train_gap
+
+        self.glitches = 0
+        self.pulses = 0
+        self.last_pulse = None
+        self.trains = deque(maxlen=32)
+
+        self._rise = None
+        self._train_pulses = 0
+        self._train_start = None
+
+    @property
+    def idle(self):
+        # Nothing buffered, no pulse half seen and no train waiting to be closed
+        return not len(self.edges) and self._rise is None and not self._train_pulses
+
+    def decode(self, now=None):
+        pulses = 0
+        for stamp, level in self.edges.drain():
+            if level == EdgeRingBuffer.RISING:
+                if self._rise is not None:
+                    self.glitches += 1
+                self._rise = stamp
+            elif self._rise is not None:
+                width = stamp - self._rise
+                self._rise = None
+                if self.min_width <= width <= self.max_width:
+                    pulses += 1
+                    self.last_pulse = stamp
+                    if not self._train_pulses:
+                        self._train_start = stamp
+                    self._train_pulses += 1
+                else:
+                    self.glitches += 1
+
+        now = clock.monotonic() if now is None else now
+        if self._train_pulses and self._rise is None and now - self.last_pulse >= self.train_gap:
+            train = PulseTrain(self._train_pulses, self._train_start, self.last_pulse)
+            self.trains.append(train)
+            if self.on_train:
+                self.on_train(train)
+            self._train_pulses = 0
+            self._train_start = None
+
+        self.pulses += pulses
+        return pulses
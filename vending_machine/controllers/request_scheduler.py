@@ -0,0 +1,133 @@
+from enum import IntEnum
+from heapq import heappush, heappop
+from itertools import count
+from random import uniform
+from threading import Condition, Lock
+from time import monotonic
+from .metrics import metrics
+
+
+class RequestPriority(IntEnum):
+    INTERACTIVE = 0
+    SALES = 1
+    TELEMETRY = 2
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class RequestScheduler:
+    def __init__(self):
+        self._ready = []
+        self._delayed = []
+        self._seq = count()
+        self._cond = Condition()
+        self.waits = {priority: metrics.histogram(f'queue.tasks.{priority.name}') for priority in RequestPriority}
+        # Called after every put, for workers that wait somewhere else than on the condition
+        self.on_put = None
+
+    def put(self, task, delay=0.0):
+        with self._cond:
+            # A retried task keeps the time it was first queued, its wait includes the backoff
+            if getattr(task, 'enqueued', None) is None:
+                task.enqueued = monotonic()
+            if delay > 0:
+                heappush(self._delayed, (monotonic() + delay, next(self._seq), task))
+            else:
+                heappush(self._ready, (task.priority, next(self._seq), task.enqueued, task))
+            # Workers may be restricted to some priorities, so any of them could be the right one
+            self._cond.notify_all()
+        if self.on_put is not None:
+            self.on_put()
+
+    def _take(self, lowest):
+        now = monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, task = heappop(self._delayed)
+            heappush(self._ready, (task.priority, next(self._seq), task.enqueued, task))
+
+        if self._ready and self._ready[0][0] <= lowest:
+            priority, _, enqueued, task = heappop(self._ready)
+            self.waits[priority].record(now - enqueued)
+            return task, None
+        return None, self._delayed[0][0] - now if self._delayed else None
+
+    def get(self, lowest=RequestPriority.TELEMETRY):
+        with self._cond:
+            while True:
+                task, wait = self._take(lowest)
+                if task is not None:
+                    return task
+                self._cond.wait(wait)
+
+    def poll(self, lowest=RequestPriority.TELEMETRY):
+        # The next task, or None and how long until a delayed one is due
+        with self._cond:
+            return self._take(lowest)
+
+    def depth(self):
+        with self._cond:
+            depth = {priority: 0 for priority in RequestPriority}
+            for entry in self._ready:
+                depth[entry[-1].priority] += 1
+            for entry in self._delayed:
+                depth[entry[-1].priority] += 1
+            return depth
+
+
+class Backoff:
+    def __init__(self, base_delay=0.5, max_delay=300.0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failures = {}
+        self.lock = Lock()
+
+    def failure(self, endpoint):
+        # Full jitter keeps a fleet that lost the backend at the same time from retrying in lockstep
+        with self.lock:
+            failures = self.failures[endpoint] = self.failures.get(endpoint, 0) + 1
+        return uniform(0, min(self.max_delay, self.base_delay * 2 ** (failures - 1)))
+
+    def success(self, endpoint):
+        with self.lock:
+            self.failures.pop(endpoint, None)
+
+
+class CircuitBreaker:
+    CLOSED = "CLOSED"
+    OPEN = "OPEN"
+    HALF_OPEN = "HALF_OPEN"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.opened = 0.0
+        self.lock = Lock()
+
+    def retry_in(self):
+        return max(0.0, self.opened + self.reset_timeout - monotonic())
+
+    def allow(self):
+        with self.lock:
+            if self.state == CircuitBreaker.CLOSED:
+                return True
+            if self.state == CircuitBreaker.OPEN and not self.retry_in():
+                # Let a single probe through; everything else waits for its outcome
+                self.state = CircuitBreaker.HALF_OPEN
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.state = CircuitBreaker.CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == CircuitBreaker.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = CircuitBreaker.OPEN
+                self.opened = monotonic()
@@ -0,0 +1,193 @@
+from collections import deque
+from enum import Enum
+from queue import Full
+from threading import Condition, Lock
+from time import monotonic
+from .metrics import metrics
+
+
+class Topic(Enum):
+    CASH = 'cash'
+    VIEW = 'view'
+    NFC = 'nfc'
+    API_RESULT = 'api_result'
+    COMMAND = 'command'
+    LEGACY = 'legacy'
+
+
+class OverflowPolicy(Enum):
+    BLOCK = 'block'
+    KEEP_LATEST = 'keep_latest'
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+
+
+class Signal:
+    __slots__ = ()
+    topic: Topic = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+
+class CashSignal(Signal):
+    __slots__ = ('message',)
+    topic = Topic.CASH
+
+    def __init__(self, message):
+        self.message = message
+
+
+class ViewUpdate(Signal):
+    __slots__ = ('state', 'changed')
+    topic = Topic.VIEW
+
+    def __init__(self, state, changed):
+        self.state = state
+        self.changed = changed
+
+
+class TagDetected(Signal):
+    __slots__ = ('tag',)
+    topic = Topic.NFC
+
+    def __init__(self, tag):
+        self.tag = tag
+
+
+class APIResult(Signal):
+    __slots__ = ('endpoint', 'result')
+    topic = Topic.API_RESULT
+
+    def __init__(self, endpoint, result):
+        self.endpoint = endpoint
+        self.result = result
+
+
+class BackendCommand(Signal):
+    __slots__ = ('command',)
+    topic = Topic.COMMAND
+
+    def __init__(self, command):
+        self.command = command
+
+
+class LegacySignal(Signal):
+    __slots__ = ('payload',)
+    topic = Topic.LEGACY
+
+    def __init__(self, payload):
+        self.payload = payload
+
+
+DEFAULT_POLICIES = {
+    # Cash and command messages change what the machine does, so producers wait instead of losing them
+    Topic.CASH: (OverflowPolicy.BLOCK, 64),
+    Topic.COMMAND: (OverflowPolicy.BLOCK, 64),
+    Topic.VIEW: (OverflowPolicy.KEEP_LATEST, 1),
+    Topic.NFC: (OverflowPolicy.DROP_OLDEST, 8),
+    Topic.API_RESULT: (OverflowPolicy.DROP_OLDEST, 64),
+    Topic.LEGACY: (OverflowPolicy.DROP_OLDEST, 256),
+}
+
+
+class TopicQueue:
+    def __init__(self, topic: Topic, policy: OverflowPolicy, maxsize):
+        self.policy = policy
+        self.maxsize = 1 if policy == OverflowPolicy.KEEP_LATEST else maxsize
+        # The deque drops from the left by itself when it is bounded
+        bounded = policy in (OverflowPolicy.KEEP_LATEST, OverflowPolicy.DROP_OLDEST)
+        self.items = deque(maxlen=self.maxsize if bounded else None)
+        self.scheduled = False
+        self.dropped = 0
+        self.wait = metrics.histogram(f'queue.signals.{topic.value}')
+
+    def full(self):
+        return len(self.items) >= self.maxsize
+
+
+class SignalBus:
+    """
+    Replaces the single unbounded signals queue. Every topic has its own bounded
+    queue with an overflow policy, and the dispatcher takes one message per
+    topic in turn, so a burst on one topic cannot starve the others.
+
+    ``put`` keeps the Queue interface for producers that still hand over raw
+    payloads; those end up on the LEGACY topic.
+    """
+
+    def __init__(self, policies: dict = None):
+        policies = {**DEFAULT_POLICIES, **(policies or {})}
+        self.queues = {topic: TopicQueue(topic, *policies[topic]) for topic in Topic}
+        self.subscribers = {topic: [] for topic in Topic}
+        self.ready = deque()
+        self.lock = Lock()
+        self.not_empty = Condition(self.lock)
+        self.not_full = Condition(self.lock)
+        # Called when a topic gets its first pending message, for dispatchers that wait elsewhere
+        self.on_ready = None
+        self.on_publish = None
+
+    def subscribe(self, topic: Topic, subscriber):
+        self.subscribers[topic].append(subscriber)
+
+    def publish(self, signal: Signal, block=True, timeout=None):
+        if self.on_publish is not None:
+            self.on_publish(signal)
+        queue = self.queues[signal.topic]
+        scheduled = False
+        with self.lock:
+            if queue.full():
+                if queue.policy == OverflowPolicy.BLOCK:
+                    deadline = None if timeout is None else monotonic() + timeout
+                    while queue.full():
+                        remaining = None if deadline is None else deadline - monotonic()
+                        if not block or (remaining is not None and remaining <= 0):
+                            raise Full
+                        self.not_full.wait(remaining)
+                elif queue.policy == OverflowPolicy.DROP_NEWEST:
+                    queue.dropped += 1
+                    return
+                else:
+                    queue.dropped += 1
+
+            queue.items.append((monotonic(), signal))
+            if not queue.scheduled:
+                queue.scheduled = scheduled = True
+                self.ready.append(signal.topic)
+                self.not_empty.notify()
+        if scheduled and self.on_ready is not None:
+            self.on_ready()
+
+    def put(self, item, block=True, timeout=None):
+        self.publish(item if isinstance(item, Signal) else LegacySignal(item), block=block, timeout=timeout)
+
+    def get(self, timeout=None):
+        with self.lock:
+            if not self.ready and not self.not_empty.wait_for(lambda: self.ready, timeout):
+                return None
+            topic = self.ready.popleft()
+            queue = self.queues[topic]
+            enqueued, signal = queue.items.popleft()
+            queue.wait.record(monotonic() - enqueued)
+            if queue.items:
+                self.ready.append(topic)
+            else:
+                queue.scheduled = False
+            if queue.policy == OverflowPolicy.BLOCK:
+                self.not_full.notify_all()
+            return signal
+
+    def dispatch(self, timeout=None):
+        signal = self.get(timeout)
+        if signal is None:
+            return False
+        for subscriber in self.subscribers[signal.topic]:
+            subscriber(signal)
+        return True
+
+    def depth(self):
+        return {topic.value: len(queue.items) for topic, queue in self.queues.items()}
+
+    def dropped(self):
+        return {topic.value: queue.dropped for topic, queue in self.queues.items() if queue.dropped}
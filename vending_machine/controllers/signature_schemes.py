@@ -0,0 +1,92 @@
+from abc import ABC, abstractmethod
+from enum import Enum
+from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519, padding
+from cryptography.hazmat.primitives import serialization, hashes
+
+
+class KeyType(Enum):
+    RSA = 'rsa'
+    ED25519 = 'ed25519'
+    ECDSA_P256 = 'ecdsa-p256'
+
+
+class SignatureScheme(ABC):
+    key_type: KeyType = None
+    key_class = None
+    private_format = serialization.PrivateFormat.PKCS8
+    public_format = serialization.PublicFormat.SubjectPublicKeyInfo
+
+    @abstractmethod
+    def generate(self):
+        pass
+
+    @abstractmethod
+    def sign(self, private_key, data: bytes) -> bytes:
+        pass
+
+    def private_bytes(self, private_key):
+        return private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=self.private_format,
+            encryption_algorithm=serialization.NoEncryption(),
+        )
+
+    def public_bytes(self, private_key):
+        return private_key.public_key().public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=self.public_format,
+        )
+
+
+class RSAScheme(SignatureScheme):
+    key_type = KeyType.RSA
+    key_class = rsa.RSAPrivateKey
+    private_format = serialization.PrivateFormat.TraditionalOpenSSL
+    public_format = serialization.PublicFormat.PKCS1
+
+    def generate(self):
+        return rsa.generate_private_key(public_exponent=65537, key_size=4096)
+
+    def sign(self, private_key, data: bytes) -> bytes:
+        return private_key.sign(
+            data,
+            padding.PSS(
+                mgf=padding.MGF1(hashes.SHA3_512()),
+                salt_length=padding.PSS.MAX_LENGTH
+            ),
+            hashes.SHA3_512()
+        )
+
+
+class Ed25519Scheme(SignatureScheme):
+    key_type = KeyType.ED25519
+    key_class = ed25519.Ed25519PrivateKey
+
+    def generate(self):
+        return ed25519.Ed25519PrivateKey.generate()
+
+    def sign(self, private_key, data: bytes) -> bytes:
+        return private_key.sign(data)
+
+
+class ECDSAP256Scheme(SignatureScheme):
+    key_type = KeyType.ECDSA_P256
+    key_class = ec.EllipticCurvePrivateKey
+
+    def generate(self):
+        return ec.generate_private_key(ec.SECP256R1())
+
+    def sign(self, private_key, data: bytes) -> bytes:
+        return private_key.sign(data, ec.ECDSA(hashes.SHA256()))
+
+
+SIGNATURE_SCHEMES = {
+    scheme.key_type: scheme for scheme in (RSAScheme(), Ed25519Scheme(), ECDSAP256Scheme())
+}
+
+
+def scheme_for_key(private_key) -> SignatureScheme:
+    for scheme in SIGNATURE_SCHEMES.values():
+        if isinstance(private_key, scheme.key_class):
+            return scheme
+    raise RuntimeError(f"Unsupported identity key {type(private_key).__name__}")
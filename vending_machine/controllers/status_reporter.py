@@ -0,0 +1,78 @@
+from threading import Thread, Event, Lock
+from time import monotonic
+from .api_controller import APIController, PatchStatus
+
+
+class StatusReporter(Thread):
+    """
+    Samples the registered status sources and sends only the fields that changed
+    since the last PatchStatus, at most once per interval. A critical value is
+    sent as soon as a source pokes the reporter. States that came and went
+    between two samples are never sent.
+
+    A volatile source, such as latency figures, differs on every sample. It does
+    not count as a change and only goes along when something else is sent.
+    """
+
+    def __init__(self, api_controller: APIController, interval=60.0):
+        self.api_controller = api_controller
+        self.interval = interval
+        self.sources = {}
+        self.critical = {}
+        self.volatile = set()
+        self.sent = {}
+        self.lock = Lock()
+        self._wakeup = Event()
+
+        super(StatusReporter, self).__init__(target=self.handler)
+
+    def register(self, field, getter, critical=None, volatile=False):
+        with self.lock:
+            self.sources[field] = getter
+            if critical is not None:
+                self.critical[field] = critical
+            if volatile:
+                self.volatile.add(field)
+
+    def poke(self, *args):
+        self._wakeup.set()
+
+    def changes(self):
+        with self.lock:
+            sources = [(field, getter) for field, getter in self.sources.items() if field not in self.volatile]
+        snapshot = {field: getter() for field, getter in sources}
+        return {
+            field: value for field, value in snapshot.items()
+            if field not in self.sent or self.sent[field] != value
+        }
+
+    def volatile_values(self):
+        with self.lock:
+            sources = [(field, self.sources[field]) for field in self.volatile]
+        return {field: getter() for field, getter in sources}
+
+    def is_critical(self, changes):
+        return any(self.critical[field](value) for field, value in changes.items() if field in self.critical)
+
+    def send(self, changes):
+        self.api_controller.request(
+            PatchStatus(dict(changes, **self.volatile_values()), context=self.api_controller.context)
+        )
+        self.sent.update(changes)
+
+    def tick(self, next_send):
+        # Returns when the next periodic send is due
+        changes = self.changes()
+        if changes and (monotonic() >= next_send or self.is_critical(changes)):
+            self.send(changes)
+            return monotonic() + self.interval
+        if monotonic() >= next_send:
+            return monotonic() + self.interval
+        return next_send
+
+    def handler(self):
+        next_send = monotonic()
+        while True:
+            self._wakeup.wait(timeout=max(0.0, next_send - monotonic()))
+            self._wakeup.clear()
+            next_send = self.tick(next_send)
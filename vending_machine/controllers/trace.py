@@ -0,0 +1,234 @@
+import json
+import os
+import struct
+from collections import deque, namedtuple
+from enum import IntEnum
+from threading import Thread
+from time import sleep, strftime, time
+from loguru import logger
+from .clock import clock
+from .signal_bus import CashSignal, TagDetected
+
+
+class TraceKind(IntEnum):
+    TIME = 0
+    STATE = 1
+    EDGE = 2
+    COMMAND = 3
+    NFC_TASK = 4
+    NFC_TAG = 5
+    API = 6
+    OUTPUT = 7
+
+
+TraceEvent = namedtuple('TraceEvent', 'at kind arg payload')
+
+# Registers as numbered in EDGE records, arg = register << 1 | level
+COIN, NOTE = 0, 1
+
+
+def describe(signal):
+    # The outputs a replay has to reproduce, as text that can be diffed
+    if isinstance(signal, CashSignal):
+        return signal.message.value
+    if isinstance(signal, TagDetected):
+        return f"TAG {signal.tag.id}"
+    return None
+
+
+def describe_view(state):
+    # Every view state rather than the frames, which depend on how the frame timer fell
+    return f"VIEW {state.session} {state.balance}/{state.required} {state.nfc} {state.tag}"
+
+
+class TraceFormat:
+    """
+    A header with the monotonic and wall clock time the trace started at, then
+    one record per event: kind, argument, the microseconds since the previous
+    record and the payload length, followed by the payload. An edge takes
+    10 bytes. A TIME record carries an absolute offset for gaps that do not
+    fit the delta.
+    """
+
+    MAGIC = b'FTXR'
+    VERSION = 1
+    HEADER = struct.Struct('<4sHdd')
+    RECORD = struct.Struct('<BBiI')
+    TICK = struct.Struct('<q')
+
+
+class TraceRecorder(Thread):
+    """
+    Captures the inputs of a session: pulse edges, cash commands, NFC tasks and
+    reads, and API responses, plus the controllers' outputs to diff a replay
+    against. Hooks only append to a deque, so the GPIO callbacks never wait on
+    the file; the thread writes everything out every ``flush_interval``. If the
+    file falls behind by ``max_events``, the oldest are dropped and counted.
+
+    Every boot starts a new file, named after the time it started; an existing
+    trace is never written over.
+    """
+
+    TRACE_FILE = os.environ.get('TRACE_FILE', '../session-{started}.trace')
+
+    def __init__(self, path=None, flush_interval=0.5, max_events=65536):
+        self.path = (path or TraceRecorder.TRACE_FILE).format(started=strftime('%Y%m%d-%H%M%S'))
+        self.flush_interval = flush_interval
+        self.events = deque(maxlen=max_events)
+        self.dropped = 0
+        self._reported = 0
+        self.started = clock.monotonic()
+        self.file = None
+        self.cash_controller = None
+        self.nfc_controller = None
+        self._tick = 0
+
+        super(TraceRecorder, self).__init__(target=self.handler, daemon=True)
+
+    def record(self, kind, arg=0, payload=b'', at=None):
+        if len(self.events) == self.events.maxlen:
+            self.dropped += 1
+        self.events.append((clock.monotonic() if at is None else at, kind, arg, payload))
+
+    def attach(self, cash_controller=None, nfc_controller=None, api_controller=None, signals=None, view=None):
+        if cash_controller is not None:
+            for register, cash_register in ((COIN, cash_controller.coin_register), (NOTE, cash_controller.note_register)):
+                cash_register.decoder.edges.on_edge = self._edge_hook(register)
+            cash_controller.on_command = lambda command: self.record(TraceKind.COMMAND, payload=str(command).encode())
+        if nfc_controller is not None:
+            nfc_controller.on_task = self.nfc_task
+        if api_controller is not None:
+            api_controller.on_response = self.api_response
+        if signals is not None:
+            signals.on_publish = self.output
+        if view is not None:
+            view.on_update = lambda state: self.record(TraceKind.OUTPUT, payload=describe_view(state).encode())
+        self.cash_controller = cash_controller
+        self.nfc_controller = nfc_controller
+        self.record_state()
+
+    def record_state(self):
+        # What a replay needs to start from, and again whenever the config changes it
+        state = {}
+        if self.cash_controller is not None:
+            state['change_stock'] = self.cash_controller.change_box.denominations
+            state['coin_pulse_clearance'] = self.cash_controller.coin_register.pulse_clearance
+            state['note_pulse_clearance'] = self.cash_controller.note_register.pulse_clearance
+        if self.nfc_controller is not None:
+            state['nfc_debounce'] = self.nfc_controller.debounce
+            state['nfc_reading'] = self.nfc_controller.reading.is_set()
+        self.record(TraceKind.STATE, payload=json.dumps(state).encode())
+
+    def _edge_hook(self, register):
+        events = self.events
+
+        def on_edge(stamp, level):
+            if len(events) == events.maxlen:
+                self.dropped += 1
+            events.append((stamp, TraceKind.EDGE, register << 1 | level, b''))
+        return on_edge
+
+    def nfc_task(self, task):
+        if isinstance(task, int):
+            self.record(TraceKind.NFC_TASK, arg=int(task))
+        else:
+            self.record(TraceKind.NFC_TAG, payload=json.dumps([task.id, task.data]).encode(), at=task.seen)
+
+    def api_response(self, endpoint, result):
+        if hasattr(result, 'to_dict'):
+            result = result.to_dict()
+        self.record(TraceKind.API, payload=json.dumps({'endpoint': endpoint, 'result': result}, default=str).encode())
+
+    def output(self, signal):
+        text = describe(signal)
+        if text is not None:
+            self.record(TraceKind.OUTPUT, payload=text.encode())
+
+    def _encode(self, at, kind, arg, payload):
+        tick = round((at - self.started) * 1e6)
+        delta = tick - self._tick
+        self._tick = tick
+        if -2 ** 31 <= delta < 2 ** 31:
+            return TraceFormat.RECORD.pack(kind, arg, delta, len(payload)) + payload
+        return (
+            TraceFormat.RECORD.pack(TraceKind.TIME, 0, 0, TraceFormat.TICK.size) + TraceFormat.TICK.pack(tick) +
+            TraceFormat.RECORD.pack(kind, arg, 0, len(payload)) + payload
+        )
+
+    def _open(self):
+        base, extension = os.path.splitext(self.path)
+        path, attempt = self.path, 0
+        while True:
+            try:
+                self.file = open(path, 'xb')
+                break
+            except FileExistsError:
+                attempt += 1
+                path = f'{base}-{attempt}{extension}'
+        self.path = path
+        self.file.write(TraceFormat.HEADER.pack(TraceFormat.MAGIC, TraceFormat.VERSION, self.started, time()))
+
+    def flush(self):
+        if self.file is None:
+            self._open()
+        if self.dropped != self._reported:
+            logger.warning(f"The trace dropped {self.dropped - self._reported} events, {self.path} has gaps")
+            self._reported = self.dropped
+        events = []
+        while self.events:
+            events.append(self.events.popleft())
+        # Hooks on different threads can append slightly out of order
+        events.sort(key=lambda event: event[0])
+        self.file.write(b''.join(self._encode(*event) for event in events))
+        self.file.flush()
+
+    def handler(self):
+        while True:
+            sleep(self.flush_interval)
+            self.flush()
+
+
+class Trace:
+    """A recorded trace, with ``at`` in seconds since the recording started."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as trace_file:
+            data = trace_file.read()
+        magic, version, self.started, self.wall_clock = TraceFormat.HEADER.unpack_from(data)
+        if magic != TraceFormat.MAGIC or version != TraceFormat.VERSION:
+            raise ValueError(f"{path} is not a version {TraceFormat.VERSION} trace")
+
+        self.events = []
+        tick = 0
+        offset = TraceFormat.HEADER.size
+        record = TraceFormat.RECORD
+        # A recorder that was killed can leave half a record at the end
+        while offset + record.size <= len(data):
+            kind, arg, delta, length = record.unpack_from(data, offset)
+            offset += record.size
+            if offset + length > len(data):
+                break
+            payload = data[offset:offset + length]
+            offset += length
+            if kind == TraceKind.TIME:
+                tick = TraceFormat.TICK.unpack(payload)[0]
+                continue
+            tick += delta
+            self.events.append(TraceEvent(tick / 1e6, TraceKind(kind), arg, payload))
+        self.events.sort(key=lambda event: event.at)
+
+    @property
+    def duration(self):
+        return self.events[-1].at if self.events else 0.0
+
+    def inputs(self):
+        return [event for event in self.events if event.kind != TraceKind.OUTPUT]
+
+    def outputs(self):
+        return [(event.at, event.payload.decode()) for event in self.events if event.kind == TraceKind.OUTPUT]
+
+    def counts(self):
+        counts = {}
+        for event in self.events:
+            counts[event.kind.name] = counts.get(event.kind.name, 0) + 1
+        return counts
@@ -0,0 +1,165 @@
+import gzip
+import socket
+import ssl
+from threading import Thread
+import certifi
+import swagger_client
+from urllib3 import PoolManager, ProxyManager, Timeout
+from urllib3.connection import HTTPConnection
+
+
+class SessionSavingSocket(ssl.SSLSocket):
+    def close(self):
+        # TLS 1.3 tickets arrive after the handshake, so look again before the socket goes away
+        try:
+            self.context.remember(self.server_hostname, self.session)
+        except (OSError, ValueError):
+            pass
+        super(SessionSavingSocket, self).close()
+
+
+class SessionReusingContext(ssl.SSLContext):
+    """
+    Remembers the last TLS session per host and offers it on the next handshake,
+    so a reconnect over the cellular uplink is an abbreviated handshake.
+    """
+
+    def __new__(cls, *args, **kwargs):
+        context = super().__new__(cls, *args, **kwargs)
+        context.sessions = {}
+        context.sslsocket_class = SessionSavingSocket
+        return context
+
+    def remember(self, server_hostname, session):
+        if session is not None:
+            self.sessions[server_hostname] = session
+
+    def wrap_socket(self, sock, *args, server_hostname=None, session=None, **kwargs):
+        session = session or self.sessions.get(server_hostname)
+        tls_sock = super().wrap_socket(sock, *args, server_hostname=server_hostname, session=session, **kwargs)
+        self.remember(server_hostname, tls_sock.session)
+        return tls_sock
+
+
+class Compressing:
+    # Request bodies are only gzipped when compress_min_size is set, for a backend that accepts Content-Encoding
+    def __init__(self, *args, compress_min_size=None, **kwargs):
+        self.compress_min_size = compress_min_size
+        super(Compressing, self).__init__(*args, **kwargs)
+
+    def urlopen(self, method, url, redirect=True, **kw):
+        headers = dict(kw.get('headers') or self.headers)
+        headers.setdefault('Accept-Encoding', 'gzip')
+
+        body = kw.get('body')
+        if self.compress_min_size is not None and body is not None and len(body) >= self.compress_min_size:
+            kw['body'] = gzip.compress(body.encode('utf-8') if isinstance(body, str) else body)
+            headers['Content-Encoding'] = 'gzip'
+
+        kw['headers'] = headers
+        # The generated client passes timeout=None unless given _request_timeout, which would
+        # wait forever on a stalled backend; without it the pool's own Timeout applies
+        if kw.get('timeout') is None:
+            kw.pop('timeout', None)
+        return super(Compressing, self).urlopen(method, url, redirect=redirect, **kw)
+
+
+class CompressingPoolManager(Compressing, PoolManager):
+    pass
+
+
+class CompressingProxyManager(Compressing, ProxyManager):
+    pass
+
+
+class PoolSettings:
+    def __init__(self, maxsize, read_timeout, connect_timeout=5.0):
+        self.maxsize = maxsize
+        self.read_timeout = read_timeout
+        self.connect_timeout = connect_timeout
+
+
+class TransportSettings:
+    def __init__(
+            self,
+            requests: PoolSettings = None,
+            long_poll: PoolSettings = None,
+            keepalive_idle=30,
+            keepalive_interval=10,
+            keepalive_count=3,
+            compress_min_size=None,
+            prewarm=True,
+            workers=3,
+    ):
+        # One connection per request worker, so no worker waits for a free one
+        self.requests = requests or PoolSettings(maxsize=workers, read_timeout=15.0)
+        self.long_poll = long_poll or PoolSettings(maxsize=1, read_timeout=90.0)
+        self.keepalive_idle = keepalive_idle
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_count = keepalive_count
+        self.compress_min_size = compress_min_size
+        self.prewarm = prewarm
+
+
+class Transport:
+    def __init__(self, configuration: swagger_client.Configuration, settings: TransportSettings = None):
+        self.configuration = configuration
+        self.settings = settings or TransportSettings()
+        self.managers = []
+
+        # Shared by both paths so a session negotiated by one is resumed by the other
+        self.tls = SessionReusingContext(ssl.PROTOCOL_TLS_CLIENT)
+        if configuration.verify_ssl:
+            self.tls.load_verify_locations(cafile=configuration.ssl_ca_cert or certifi.where())
+        else:
+            self.tls.check_hostname = False
+            self.tls.verify_mode = ssl.CERT_NONE
+        if configuration.cert_file:
+            self.tls.load_cert_chain(configuration.cert_file, configuration.key_file)
+
+    def socket_options(self):
+        options = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            options += [
+                (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.settings.keepalive_idle),
+                (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, self.settings.keepalive_interval),
+                (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, self.settings.keepalive_count),
+            ]
+        return options
+
+    def api_client(self, pool: PoolSettings) -> swagger_client.ApiClient:
+        client = swagger_client.ApiClient(self.configuration)
+        kwargs = dict(
+            compress_min_size=self.settings.compress_min_size,
+            num_pools=1,
+            maxsize=pool.maxsize,
+            block=True,
+            timeout=Timeout(connect=pool.connect_timeout, read=pool.read_timeout),
+            retries=False,
+            ssl_context=self.tls,
+            socket_options=self.socket_options(),
+        )
+        if self.configuration.assert_hostname is not None:
+            kwargs['assert_hostname'] = self.configuration.assert_hostname
+        if self.configuration.proxy:
+            manager = CompressingProxyManager(
+                self.configuration.proxy,
+                proxy_headers=getattr(self.configuration, 'proxy_headers', None),
+                **kwargs
+            )
+        else:
+            manager = CompressingPoolManager(**kwargs)
+        client.rest_client.pool_manager = manager
+        self.managers.append(manager)
+        return client
+
+    def prewarm(self):
+        def warm(manager):
+            try:
+                manager.request('HEAD', self.configuration.host, retries=False)
+            except Exception:
+                pass
+
+        if self.settings.prewarm:
+            for manager in self.managers:
+                Thread(target=warm, args=(manager,), daemon=True).start()
@@ -0,0 +1,67 @@
+from collections import namedtuple
+from threading import Thread, Lock, Event
+from time import sleep
+from .signal_bus import SignalBus, ViewUpdate
+
+ViewState = namedtuple('ViewState', ['session', 'balance', 'required', 'nfc', 'tag'])
+
+
+class ViewModel(Thread):
+    """
+    What the frontend shows, in one place. The controllers write their part of
+    it with ``update``, which only swaps the state; this thread sends what
+    changed at most ``max_fps`` times a second, so however fast coins come in,
+    the display is never more than one frame behind the balance.
+
+    A frame carries the whole state as well as the fields that changed since
+    the frame before, so a frontend that missed one still shows the right thing.
+    """
+
+    def __init__(self, report_to: SignalBus = None, max_fps=20.0):
+        self.results = report_to
+        self.interval = 1.0 / max_fps
+        self.lock = Lock()
+        self.state = ViewState(session='DENYING_CASH', balance=0, required=0, nfc='IDLE', tag=None)
+        self.sent = None
+        self.changed = Event()
+        # Sees every state, not only those that make it into a frame, for the trace recorder
+        self.on_update = None
+
+        super(ViewModel, self).__init__(target=self.handler, daemon=True)
+
+    def update(self, **fields):
+        with self.lock:
+            state = self.state._replace(**fields)
+            if state == self.state:
+                return
+            self.state = state
+            # Under the lock, so states are seen in the order they were made
+            if self.on_update is not None:
+                self.on_update(state)
+        self.changed.set()
+
+    def frame(self):
+        state = self.state
+        if self.sent is None:
+            changed = state._asdict()
+        else:
+            changed = {
+                field: value for field, value, before in zip(state._fields, state, self.sent) if value != before
+            }
+        if not changed:
+            return None
+        self.sent = state
+        return ViewUpdate(state, changed)
+
+    def send(self):
+        update = self.frame()
+        if update is not None and self.results is not None:
+            self.results.publish(update)
+
+    def handler(self):
+        while True:
+            self.changed.wait()
+            self.changed.clear()
+            self.send()
+            # Whatever changes meanwhile goes out together in the next frame
+            sleep(self.interval)
@@ -6,6 +6,7 @@ class MainPowerSwitch:
     def __init__(self):
         self._relay = OutputDevice(Pins.MAIN_POWER_RELAY)
         self._power_is_on = None
+        self.on_change = None
         self.power_off()
 
     @property
@@ -15,7 +16,11 @@ class MainPowerSwitch:
     def power_off(self):
         self._relay.on()
         self._power_is_on = False
+        if self.on_change:
+            self.on_change(self)
 
     def power_on(self):
         self._relay.off()
         self._power_is_on = True
+        if self.on_change:
+            self.on_change(self)
@@ -16,9 +16,21 @@ class Pins(IntEnum):
     NOTE_INPUT_RELAY = RELAY_1
     COIN_INPUT_RELAY = RELAY_2
 
+    HOPPER_10_MOTOR = RELAY_3
+    HOPPER_20_MOTOR = RELAY_4
+    HOPPER_50_MOTOR = RELAY_5
+    HOPPER_100_MOTOR = RELAY_6
+    HOPPER_200_MOTOR = 12
+
     NOTE_ACCEPTOR_PULSE_INPUT = 23
     COIN_ACCEPTOR_PULSE_INPUT = 24
 
+    HOPPER_10_SENSOR = 16
+    HOPPER_20_SENSOR = 17
+    HOPPER_50_SENSOR = 22
+    HOPPER_100_SENSOR = 27
+    HOPPER_200_SENSOR = 4
+
     # Reserved for NFC Reader
     NFC_RST = 25
     NFC_MOSI = 10
@@ -0,0 +1,5 @@
+from . import command_server
+from . import pulse_generator
+from . import fake_nfc
+from . import fake_api
+from . import hoppers
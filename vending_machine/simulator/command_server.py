@@ -0,0 +1,101 @@
+import json
+import re
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Condition, Thread
+
+
+class CommandServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the backend's command endpoints: a long-poll at
+    /machines/<uuid>/commands answering with an ETag cursor, and an SSE stream at
+    /machines/<uuid>/commands/stream that resumes from Last-Event-ID.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), hold=30.0):
+        super(CommandServer, self).__init__(address, CommandHandler)
+        self.hold = hold
+        self.commands = []
+        self.requests = 0
+        self.changed = Condition()
+        self.thread = None
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def push(self, command: str):
+        with self.changed:
+            self.commands.append(command)
+            self.changed.notify_all()
+
+    def after(self, cursor, timeout):
+        # Blocks like the real backend until there is something past the cursor
+        position = int(cursor) if cursor and cursor.isdigit() else 0
+        with self.changed:
+            self.changed.wait_for(lambda: len(self.commands) > position, timeout=timeout)
+            return list(enumerate(self.commands[position:], start=position + 1))
+
+    def start(self):
+        self.thread = Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class CommandHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    COMMANDS = re.compile(r'^/machines/[^/]+/commands(/stream)?$')
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        match = self.COMMANDS.match(self.path.split('?')[0])
+        if not match:
+            return self.send_error(404)
+        self.server.requests += 1
+        if match.group(1):
+            return self.stream()
+        return self.long_poll()
+
+    def long_poll(self):
+        cursor = self.headers.get('If-None-Match') or self.headers.get('Last-Event-ID')
+        pending = self.server.after(cursor, self.server.hold)
+        if not pending:
+            self.send_response(304 if cursor else 408)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = json.dumps([{'id': position, 'command': command} for position, command in pending]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', str(pending[-1][0]))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        cursor = self.headers.get('Last-Event-ID')
+        try:
+            while True:
+                pending = self.server.after(cursor, self.server.hold)
+                if not pending:
+                    self.wfile.write(b': keep-alive\n\n')
+                for position, command in pending:
+                    self.wfile.write(f'id: {position}\ndata: {command}\n\n'.encode())
+                    cursor = str(position)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
@@ -0,0 +1,104 @@
+from random import random
+from threading import Lock
+from time import sleep
+from swagger_client.rest import ApiException
+
+
+class FakeRecord(dict):
+    # Answers both the way swagger models do (attributes, to_dict) and like a dict
+    __getattr__ = dict.get
+
+    def to_dict(self):
+        return dict(self)
+
+
+class FakeConfiguration:
+    def auth_settings(self):
+        return {}
+
+
+class FakeApiClient:
+    def __init__(self, api):
+        self.api = api
+        self.configuration = FakeConfiguration()
+        self.default_headers = {}
+        self.header_params = []
+
+    def set_default_header(self, name, value):
+        self.default_headers[name] = value
+
+    def call_api(self, resource_path, method, path_params=None, header_params=None, **kwargs):
+        # Only the paths the controllers reach through call_api are answered
+        self.header_params.append(dict(header_params or {}))
+        if (resource_path, method) == ('/machines/{uuid}/commands', 'GET'):
+            return self.api.machines_uuid_commands_get_with_http_info(path_params['uuid'])
+        if (resource_path, method) == ('/machines/{uuid}/config', 'GET'):
+            return self.api.machines_uuid_config_get(path_params['uuid'])
+        raise ApiException(status=404, reason="Not Found")
+
+
+class FakeApi:
+    """
+    In-process stand-in for swagger_client.DefaultApi with a fixed latency and
+    failure rate. It keeps what was sent so that runs can be checked afterwards.
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, balances=None, commands=None, hold=0.05, config=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.balances = dict(balances or {})
+        self.commands = list(commands or [])
+        self.config = dict(config or {})
+        self.hold = hold
+        self.api_client = FakeApiClient(self)
+        self.lock = Lock()
+        self.calls = {}
+        self.sales = []
+        self.top_ups = []
+        self.status = {}
+
+    def _call(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            sleep(self.latency)
+        if self.failure_rate and random() < self.failure_rate:
+            raise ApiException(status=503, reason="Service Unavailable")
+
+    def faehr_card_uuid_get(self, uuid):
+        self._call('faehr_card_uuid_get')
+        return FakeRecord(uuid=uuid)
+
+    def faehr_card_uuid_balance_get(self, uuid):
+        self._call('faehr_card_uuid_balance_get')
+        return FakeRecord(uuid=uuid, balance=self.balances.get(uuid, 0))
+
+    def faehr_card_uuid_topup_post(self, body, uuid):
+        self._call('faehr_card_uuid_topup_post')
+        self.top_ups.append(body)
+        self.balances[uuid] = self.balances.get(uuid, 0) + body.get('amount', 0)
+
+    def ticket_sales_post(self, body):
+        self._call('ticket_sales_post')
+        self.sales.append(body)
+
+    def machines_uuid_status_patch(self, body, uuid):
+        self._call('machines_uuid_status_patch')
+        self.status.update(body)
+
+    def machines_uuid_commands_get_with_http_info(self, uuid):
+        self._call('machines_uuid_commands_get')
+        with self.lock:
+            commands, self.commands = self.commands, []
+        if not commands:
+            # Like an empty long-poll that the backend closed
+            sleep(self.hold)
+            raise ApiException(status=304, reason="Not Modified")
+        return commands, 200, {}
+
+    def machines_uuid_config_get(self, uuid):
+        self._call('machines_uuid_config_get')
+        return dict(self.config)
+
+    def machines_uuid_commands_get(self, uuid):
+        return self.machines_uuid_commands_get_with_http_info(uuid)[0]
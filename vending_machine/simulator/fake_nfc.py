@@ -0,0 +1,59 @@
+from threading import Lock
+from time import monotonic, sleep
+
+
+class Tap:
+    def __init__(self, uid, data, at, duration=0.5):
+        self.uid = uid
+        self.data = data
+        self.at = at
+        self.duration = duration
+
+
+def tap_pattern(cards, count, interval, duration=0.5, start=0.0):
+    """``count`` taps, ``interval`` seconds apart, cycling through ``cards`` (uid, data) pairs."""
+    return [
+        Tap(*cards[i % len(cards)], at=start + i * interval, duration=duration)
+        for i in range(count)
+    ]
+
+
+class FakeMFRC522:
+    """
+    Stands in for SimpleMFRC522. A card is on the reader while a tap lasts;
+    the SPI delays are those of a real MFRC522 on a Pi, a quick UID probe and a
+    much slower sector read.
+    """
+
+    def __init__(self, taps=(), probe_delay=0.002, read_delay=0.025):
+        self.taps = sorted(taps, key=lambda tap: tap.at)
+        self.probe_delay = probe_delay
+        self.read_delay = read_delay
+        self.started = monotonic()
+        self.lock = Lock()
+        self.probes = 0
+        self.reads = 0
+
+    def tap(self, uid, data, duration=0.5):
+        with self.lock:
+            self.taps.append(Tap(uid, data, monotonic() - self.started, duration))
+
+    def present(self):
+        now = monotonic() - self.started
+        with self.lock:
+            for tap in self.taps:
+                if tap.at <= now < tap.at + tap.duration:
+                    return tap
+        return None
+
+    def read_id_no_block(self):
+        self.probes += 1
+        sleep(self.probe_delay)
+        tap = self.present()
+        return tap.uid if tap else None
+
+    def read_no_block(self):
+        self.reads += 1
+        sleep(self.read_delay)
+        tap = self.present()
+        return (tap.uid, tap.data) if tap else (None, None)
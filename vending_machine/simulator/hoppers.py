@@ -0,0 +1,38 @@
+from threading import Event, Thread
+from time import sleep
+
+
+class HopperSimulator(Thread):
+    """
+    Ejects coins past a Hopper's mocked sensor while its motor runs, at the
+    rate of a real hopper, until ``stock`` is used up; after that it behaves
+    like an empty hopper and the Hopper reports it stalled.
+    """
+
+    def __init__(self, hopper, coins_per_second=12.0, stock=None, poll=0.001):
+        self.hopper = hopper
+        self.interval = 1.0 / coins_per_second
+        self.stock = stock
+        self.poll = poll
+        self.ejected = 0
+        self.sensor = hopper.sensor.pin
+        self.stopped = Event()
+
+        super(HopperSimulator, self).__init__(target=self.handler, daemon=True)
+
+    def handler(self):
+        while not self.stopped.is_set():
+            if not self.hopper.motor.value or self.stock == 0:
+                sleep(self.poll)
+                continue
+            sleep(self.interval / 2)
+            self.sensor.drive_low()
+            sleep(self.interval / 2)
+            self.sensor.drive_high()
+            self.ejected += 1
+            if self.stock is not None:
+                self.stock -= 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
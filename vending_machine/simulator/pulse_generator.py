@@ -0,0 +1,66 @@
+from random import uniform
+from time import perf_counter, sleep
+from gpiozero import Device
+from gpiozero.pins.mock import MockFactory
+from pins import Pins
+
+
+def wait(seconds):
+    # sleep() alone overshoots by up to a scheduler tick, which matters for stress rates
+    deadline = perf_counter() + seconds
+    if seconds > 0.002:
+        sleep(seconds - 0.002)
+    while perf_counter() < deadline:
+        pass
+
+
+class PulseGenerator:
+    """
+    Drives an acceptor's pulse input on the MockFactory like the acceptor's
+    open-collector output does: the line is pulled low for as long as a pulse lasts.
+    """
+
+    def __init__(self, pin_number):
+        if not isinstance(Device.pin_factory, MockFactory):
+            raise RuntimeError("The pulse generator needs TESTING_ENVIRONMENT, so that pins are mocked")
+        self.pin = Device.pin_factory.pin(pin_number)
+
+    def pulse(self, width):
+        self.pin.drive_low()
+        wait(width)
+        self.pin.drive_high()
+
+    def train(self, pulses, width, gap, jitter=0.0):
+        for i in range(pulses):
+            self.pulse(width + uniform(-jitter, jitter))
+            if i + 1 < pulses:
+                wait(gap + uniform(-jitter, jitter))
+
+    def glitch(self, width=0.002):
+        self.pulse(width)
+
+
+class CoinPulseGenerator(PulseGenerator):
+    # What the coin acceptor sends: 50 ms pulses, 50 ms apart, one pulse per 10 cents
+    WIDTH = 0.05
+    GAP = 0.05
+    BALANCE_PER_PULSE = 10
+
+    def __init__(self):
+        super(CoinPulseGenerator, self).__init__(Pins.COIN_ACCEPTOR_PULSE_INPUT)
+
+    def insert(self, value, jitter=0.005):
+        self.train(value // self.BALANCE_PER_PULSE, self.WIDTH, self.GAP, jitter)
+
+
+class NotePulseGenerator(PulseGenerator):
+    # The note validator sends 100 ms pulses, one per 5 EUR
+    WIDTH = 0.1
+    GAP = 0.1
+    BALANCE_PER_PULSE = 500
+
+    def __init__(self):
+        super(NotePulseGenerator, self).__init__(Pins.NOTE_ACCEPTOR_PULSE_INPUT)
+
+    def insert(self, value, jitter=0.01):
+        self.train(value // self.BALANCE_PER_PULSE, self.WIDTH, self.GAP, jitter)
@@ -0,0 +1,209 @@
+import argparse
+import json
+import os
+import sys
+from difflib import SequenceMatcher
+from queue import Empty
+from time import perf_counter, sleep
+from ..controllers.clock import clock, VirtualClock
+from ..controllers.cash_controller import CashController, SettleExpired
+from ..controllers.changebox import ChangeBox
+from ..controllers.nfc_controller import NFCController, NFCTag
+from ..controllers.metrics import metrics
+from ..controllers.trace import Trace, TraceKind, describe, describe_view
+from ..controllers.view_model import ViewModel
+
+
+class Replay:
+    """
+    Feeds a recorded trace through a real CashController and NFCController.
+
+    Nothing runs on the controllers' own threads: the replay decodes, dispatches
+    and expires settle deadlines itself, on a VirtualClock that jumps from one
+    event to the next, so a replay is deterministic. ``speed`` paces it against
+    wall clock time, 1.0 being real time; None replays as fast as possible.
+
+    The clock is process wide, so nothing else may run while a replay does, and
+    like the benchmarks it needs TESTING_ENVIRONMENT for the pins. Change is
+    booked on the change box but not driven through the hoppers, which are never
+    built. ``close`` gives the acceptors' pins back for the next replay. API
+    responses are kept in ``responses``, not sent again.
+    """
+
+    def __init__(self, trace: Trace, speed=None, tail=5.0):
+        self.trace = trace
+        self.speed = speed
+        self.tail = tail
+        # Never started, only its states are compared
+        self.view = ViewModel()
+        self.view.on_update = lambda state: self.outputs.append((self.clock.now, describe_view(state)))
+        self.cash_controller = CashController(report_to=self, view=self.view, change_box=ChangeBox())
+        self.nfc_controller = NFCController(report_to=self, view=self.view)
+        self.registers = (self.cash_controller.coin_register, self.cash_controller.note_register)
+        self.tick = min(register.decode_interval for register in self.registers)
+
+        self.clock = VirtualClock()
+        self.outputs = []
+        self.responses = []
+        self._started = None
+
+    def publish(self, signal, block=True, timeout=None):
+        text = describe(signal)
+        if text is not None:
+            self.outputs.append((self.clock.now, text))
+
+    def advance(self, now):
+        if self.speed:
+            delay = self._started + now / self.speed - perf_counter()
+            if delay > 0:
+                sleep(delay)
+        self.clock.advance_to(now)
+
+    def next_due(self):
+        due = []
+        if not all(register.decoder.idle for register in self.registers):
+            due.append(self.clock.now + self.tick)
+        if self.cash_controller.pending:
+            due.append(max(self.clock.now, self.cash_controller.settle_deadline()))
+        return min(due) if due else None
+
+    def drain(self):
+        controller = self.cash_controller
+        while True:
+            try:
+                event = controller.as_event(controller.tasks.get_nowait())
+            except Empty:
+                return
+            if event is not None:
+                controller.dispatch(event)
+
+    def step(self):
+        for register in self.registers:
+            register.decode()
+        self.drain()
+        controller = self.cash_controller
+        if controller.pending and self.clock.now >= controller.settle_deadline():
+            controller.dispatch(SettleExpired())
+
+    def run_until(self, now):
+        while True:
+            due = self.next_due()
+            if due is None or due > now:
+                break
+            self.advance(due)
+            self.step()
+        self.advance(now)
+
+    def apply_state(self, state):
+        controller = self.cash_controller
+        for denomination, count in state.get('change_stock', {}).items():
+            controller.change_box.refill(int(denomination), count)
+        if 'coin_pulse_clearance' in state:
+            controller.coin_register.pulse_clearance = state['coin_pulse_clearance']
+        if 'note_pulse_clearance' in state:
+            controller.note_register.pulse_clearance = state['note_pulse_clearance']
+        if 'nfc_debounce' in state:
+            self.nfc_controller.debounce = state['nfc_debounce']
+        if state.get('nfc_reading'):
+            self.nfc_controller.reading.set()
+
+    def inject(self, event):
+        if event.kind == TraceKind.STATE:
+            self.apply_state(json.loads(event.payload))
+        elif event.kind == TraceKind.EDGE:
+            edges = self.registers[event.arg >> 1].decoder.edges
+            if event.arg & 1:
+                edges.rising()
+            else:
+                edges.falling()
+        elif event.kind == TraceKind.COMMAND:
+            self.cash_controller.tasks.put(event.payload.decode())
+            self.drain()
+        elif event.kind == TraceKind.NFC_TASK:
+            self.nfc_controller.handle(NFCController.Tasks(event.arg))
+        elif event.kind == TraceKind.NFC_TAG:
+            uid, data = json.loads(event.payload)
+            self.nfc_controller.handle(NFCTag(uid, data, seen=event.at))
+        elif event.kind == TraceKind.API:
+            self.responses.append((event.at, json.loads(event.payload)))
+
+    def run(self):
+        self.outputs = []
+        self.responses = []
+        self._started = perf_counter()
+        clock.install(self.clock)
+        try:
+            for event in self.trace.inputs():
+                self.run_until(event.at)
+                self.inject(event)
+            self.run_until(self.clock.now + self.tail)
+        finally:
+            clock.reset()
+        return self.outputs
+
+    def close(self):
+        self.cash_controller.release()
+
+
+def diff(recorded, replayed, limit=20):
+    """
+    Compares two lists of (at, output). Besides the differences, it reports how
+    far the replayed outputs moved in time against the recorded ones.
+    """
+    matcher = SequenceMatcher(a=[text for _, text in recorded], b=[text for _, text in replayed], autojunk=False)
+    differences = []
+    shifts = []
+    for operation, a_start, a_end, b_start, b_end in matcher.get_opcodes():
+        if operation == 'equal':
+            shifts.extend(
+                abs(replayed[b][0] - recorded[a][0])
+                for a, b in zip(range(a_start, a_end), range(b_start, b_end))
+            )
+            continue
+        differences.extend(f"- {recorded[a][0]:.3f} {recorded[a][1]}" for a in range(a_start, a_end))
+        differences.extend(f"+ {replayed[b][0]:.3f} {replayed[b][1]}" for b in range(b_start, b_end))
+
+    shifts.sort()
+    return {
+        'recorded': len(recorded),
+        'replayed': len(replayed),
+        'matched': len(shifts),
+        'differences': differences[:limit],
+        'shift_p50': shifts[len(shifts) // 2] if shifts else 0.0,
+        'shift_max': shifts[-1] if shifts else 0.0,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replays a session trace through the cash and NFC controllers")
+    parser.add_argument('trace')
+    parser.add_argument('--speed', type=float, default=None, help="1 for real time, 10 for ten times; as fast as possible by default")
+    parser.add_argument('--output', default=None, help="Where to write the result as JSON")
+    args = parser.parse_args()
+
+    if not os.environ.get('TESTING_ENVIRONMENT'):
+        sys.exit("Run replays with TESTING_ENVIRONMENT=1, they drive mocked pins")
+
+    trace = Trace(args.trace)
+    replay = Replay(trace, speed=args.speed)
+    started = perf_counter()
+    outputs = replay.run()
+    result = {
+        'trace': args.trace,
+        'events': trace.counts(),
+        'duration': trace.duration,
+        'replay_seconds': perf_counter() - started,
+        'diff': diff(trace.outputs(), outputs),
+        'latency': {
+            name: values for name, values in metrics.snapshot().items() if name.startswith(('cash.', 'nfc.'))
+        },
+        'api_responses': len(replay.responses),
+    }
+    if args.output:
+        tmp_file = args.output + '.tmp'
+        with open(tmp_file, 'w') as output:
+            json.dump(result, output, indent=1)
+        os.replace(tmp_file, args.output)
+    print(json.dumps(result, indent=1))
+    sys.stdout.flush()
+    os._exit(0 if not result['diff']['differences'] else 1)
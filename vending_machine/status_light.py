@@ -6,6 +6,7 @@ class StatusLight:
     def __init__(self):
         self._relay = OutputDevice(Pins.STATUS_LIGHT_RELAY)
         self._is_red, self._is_green = None, None
+        self.on_change = None
         self.red()
 
     @property
@@ -20,8 +21,12 @@ class StatusLight:
         self._relay.on()
         self._is_red = True
         self._is_green = False
+        if self.on_change:
+            self.on_change(self)
 
     def green(self):
         self._relay.off()
         self._is_red = False
         self._is_green = True
+        if self.on_change:
+            self.on_change(self)
@@ -5,10 +5,20 @@ os.environ.setdefault("BASE_PATH", "../frontend/")
 from loguru import logger
 from controllers.client_controller import ClientController
 from controllers.client_context import ClientContext
+from controllers.async_runtime import AsyncRuntime
+from controllers.log_sink import LogSink
 
 if __name__ == '__main__':
-    logger.add(open('../vending_machine.log', 'w'))
+    # Nothing may write to a terminal or the SD card on a controller's thread
+    logger.remove()
+    log_sink = LogSink()
+    log_sink.install()
+    log_sink.start()
     logger.info("Starting Vending Machine")
     client_context = ClientContext()
+    client_context.config_store.subscribe(log_sink.apply_config)
     ctrl = ClientController(context=client_context)
-    ctrl.start()
+    if client_context.config_store.snapshot.runtime == 'asyncio':
+        AsyncRuntime(ctrl).run()
+    else:
+        ctrl.start()